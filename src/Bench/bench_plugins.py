@@ -0,0 +1,144 @@
+# GEM plugin benchmark
+#
+# Runs the request paths of GEMStudent, GEMTeacher and GEMAssistant
+# outside Sublime Text, with the headless sublime modules in this
+# folder, against a server (normally gem_standin.py), and reports
+# latency percentiles per path:
+#
+#   python3 gem_standin.py -latency 50 -jitter 20 -error_rate 0.02 &
+#   python3 bench_plugins.py -server http://127.0.0.1:8090 -requests 200
+#
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+Bench = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, Bench)
+for plugin in ['GEMStudent', 'GEMTeacher', 'GEMAssistant']:
+	sys.path.insert(1, os.path.join(os.path.dirname(Bench), plugin))
+
+import sublime
+import GEMStudent
+import GEMTeacher
+import GEMAssistant
+from gem_load import Stats
+
+# ------------------------------------------------------------------
+# Bytes sent and received by the requests of the current thread, as
+# recorded by the plugins' exchange functions.
+# ------------------------------------------------------------------
+Traffic = threading.local()
+
+def count_traffic(plugin, prefix):
+	exchange = getattr(plugin, prefix + '_exchange')
+	def counted(url, load, method, timeout, response_headers, trace):
+		try:
+			return exchange(url, load, method, timeout, response_headers, trace)
+		finally:
+			Traffic.sent = getattr(Traffic, 'sent', 0) + trace['Sent']
+			Traffic.received = getattr(Traffic, 'received', 0) + trace['Received']
+	setattr(plugin, prefix + '_exchange', counted)
+
+# ------------------------------------------------------------------
+# Point a plugin at its own info file in folder and register it.
+# ------------------------------------------------------------------
+def setup(plugin, prefix, role, args, folder):
+	def var(name):
+		return getattr(plugin, prefix + name)
+	count_traffic(plugin, prefix)
+	info = var('InfoFile')(os.path.join(folder, prefix + '_info'))
+	setattr(plugin, prefix + 'INFO', info)
+	if prefix == 'gems':
+		plugin.gemsOUTBOX = plugin.gemsOutbox(os.path.join(folder, 'outbox'))
+		plugin.gemsLEDGER = plugin.gemsLedger(os.path.join(folder, 'ledger'))
+	name = '{}_bench'.format(role if prefix != 'gema' else 'ta')
+	info.update(Server=args.server, CourseId=args.course, Folder=folder, Name=name)
+	for attempt in range(5):	# the server may be injecting failures
+		response = var('Request')('complete_registration', dict(name=name, role=role, course_id=args.course), authenticated=False)
+		if response is not None and ',' in response:
+			break
+	else:
+		raise SystemExit('Unable to register {} with {}: {}'.format(name, args.server, response))
+	uid, password = response.split(',', 1)
+	info.update(Uid=int(uid), Password=password)
+
+def student_shares():
+	content = ''.join('line {} = {}\n'.format(i, random.randint(0, 9)) for i in range(40))
+	return GEMStudent.gems_send(dict(filename='bench.py', answer='', priority=random.choice([1, 2])), content)
+
+def student_periodic_update():
+	return GEMStudent.gemsRequest('student_periodic_update', {}, verbal=False)
+
+def student_gets():
+	return GEMStudent.gemsRequest('student_gets', {})
+
+def teacher_broadcasts():
+	return GEMTeacher.gemtRequest('teacher_broadcasts', dict(content='# bench\n', answer='',
+		filename='bench.py', merit=2, effort=1, attempts=1000000, tag='', exact_answer='False'))
+
+def teacher_gets(request):
+	def get():
+		return request('teacher_gets', dict(index=-1, priority=0))
+	return get
+
+def teacher_gets_queue():
+	return GEMTeacher.gemtRequest('teacher_gets_queue', dict(summary=1, since=-1))
+
+def teacher_grades(request):
+	def grade():
+		return request('teacher_grades', dict(sid=0, content='', decision='correct', changed=False))
+	return grade
+
+Scenarios = [
+	('student_shares', student_shares),
+	('student_periodic_update', student_periodic_update),
+	('student_gets', student_gets),
+	('teacher_broadcasts', teacher_broadcasts),
+	('teacher_gets', teacher_gets(GEMTeacher.gemtRequest)),
+	('teacher_gets_queue', teacher_gets_queue),
+	('teacher_grades', teacher_grades(GEMTeacher.gemtRequest)),
+	('assistant_gets', teacher_gets(GEMAssistant.gemaRequest)),
+	('assistant_grades', teacher_grades(GEMAssistant.gemaRequest)),
+]
+
+# ------------------------------------------------------------------
+def run(args):
+	folder = tempfile.mkdtemp(prefix='gem_bench_')
+	setup(GEMStudent, 'gems', 'student', args, folder)
+	setup(GEMTeacher, 'gemt', 'teacher', args, folder)
+	setup(GEMAssistant, 'gema', 'teacher', args, folder)
+	stats = Stats()
+	selected = [s for s in Scenarios if not args.only or s[0] in args.only]
+
+	def work(name, fn):
+		for i in range(args.requests // args.concurrency):
+			Traffic.sent = Traffic.received = 0
+			start = time.time()
+			try:
+				response = fn()
+			except Exception:
+				response = None
+			stats.add(name, time.time() - start, response is not None, Traffic.sent, Traffic.received)
+
+	for name, fn in selected:
+		threads = [threading.Thread(target=work, args=(name, fn)) for i in range(args.concurrency)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+	print(stats.report())
+	print('{} dialog(s) raised; see sublime.messages.'.format(len(sublime.messages)))
+
+# ------------------------------------------------------------------
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the GEM plugin request paths.')
+	parser.add_argument('-server', default='http://127.0.0.1:8090', help='server or name server address')
+	parser.add_argument('-course', default='MyCourse', help='course id')
+	parser.add_argument('-requests', type=int, default=100, help='requests per path (default 100)')
+	parser.add_argument('-concurrency', type=int, default=1, help='threads per path (default 1)')
+	parser.add_argument('-only', nargs='*', help='paths to run, e.g. student_shares teacher_gets')
+	run(parser.parse_args())
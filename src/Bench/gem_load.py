@@ -0,0 +1,289 @@
+# GEM load generator
+#
+# Simulates a class against a running GEM server, with the requests the
+# plugins make: students poll student_periodic_update, fetch boards and
+# share code; teachers and TAs drain the queue with teacher_gets and
+# teacher_grades. Reports latency percentiles and throughput per endpoint.
+#
+#   python3 gem_load.py -server http://localhost:8080 -course MyCourse \
+#       -students students.txt -teachers teachers.txt -profile burst
+#
+# Students and teachers must have been added to the server (-add_students,
+# -add_teachers); they are registered here with complete_registration.
+#
+# To stress the server's locking, build it with "go build -race" and run
+# a burst with short polls and quick grading, e.g. -profile burst -poll 1
+# -grade_time 0.1; the race detector reports on the server's console.
+# With 150 students and 5 teachers over 40 s, the server before the
+# sharded state reported 38 races (Students map, boards, WorkingSubs);
+# it now reports none. That run used a stand-in for the sqlite driver
+# on one core, so it checks locking, not database or multi-core speed.
+#
+# To measure batched database writes, compare the student_shares rate of
+# a run with "WriteDelay": -1 in the server's configuration (every write
+# committed on its own) against runs with the default 0 or a few ms.
+# With 150 students over 40 s (-profile steady -poll 5 -grade_time 30)
+# on one core and an ext4 disk, the server before WAL and batching kept
+# up with 150 shares/s (p99 196 ms) but at 250/s failed its writes and
+# exited; it now keeps up with 600/s (p99 59 ms) and writes about
+# 1170 rows/s with no errors when offered 1200/s.
+#
+import argparse
+import concurrent.futures
+import gzip
+import http.client
+import json
+import math
+import random
+import socket
+import threading
+import time
+import urllib.parse
+
+# ------------------------------------------------------------------
+class Stats:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.samples = {}
+
+	def add(self, path, seconds, ok, sent, received):
+		now = time.time()
+		with self.lock:
+			s = self.samples.setdefault(path, dict(Times=[], Errors=0, Sent=0, Received=0, First=now - seconds))
+			s['Last'] = now
+			s['Times'].append(seconds)
+			s['Sent'] += sent
+			s['Received'] += received
+			if not ok:
+				s['Errors'] += 1
+
+	def report(self):
+		lines = ['{:<26} {:>7} {:>6} {:>8} {:>8} {:>8} {:>8} {:>9} {:>9}'.format(
+			'endpoint', 'count', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'KB out', 'KB in')]
+		with self.lock:
+			for path, s in sorted(self.samples.items()):
+				times = sorted(s['Times'])
+				lines.append('{:<26} {:>7} {:>6} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>9.1f} {:>9.1f}'.format(
+					path, len(times), s['Errors'], len(times) / max(s['Last'] - s['First'], 1e-6),
+					1000 * percentile(times, 50), 1000 * percentile(times, 95), 1000 * percentile(times, 99),
+					s['Sent'] / 1024, s['Received'] / 1024))
+		return '\n'.join(lines)
+
+def percentile(times, p):
+	if not times:
+		return 0
+	return times[min(len(times) - 1, int(math.ceil(p / 100.0 * len(times))) - 1)]
+
+# ------------------------------------------------------------------
+# One keep-alive connection per simulated client, as in the plugins.
+# ------------------------------------------------------------------
+class Client:
+	def __init__(self, server, stats, name, role, timeout):
+		parts = urllib.parse.urlsplit(server)
+		self.host, self.port = parts.hostname, parts.port or 80
+		self.stats = stats
+		self.name = name
+		self.role = role
+		self.timeout = timeout
+		self.conn = None
+		self.auth = None
+
+	def post(self, path, data, authenticated=True):
+		if authenticated:
+			data = dict(data, **self.auth)
+		load = urllib.parse.urlencode(data).encode('utf-8')
+		headers = {
+			'Connection': 'keep-alive',
+			'Accept-Encoding': 'gzip',
+			'Content-Type': 'application/x-www-form-urlencoded',
+		}
+		start = time.time()
+		body, ok = b'', False
+		try:
+			if self.conn is None:
+				self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+				self.conn.connect()
+				self.conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			self.conn.request('POST', '/' + path, load, headers)
+			response = self.conn.getresponse()
+			body = response.read()
+			if response.will_close:
+				self.close()
+			if response.getheader('Content-Encoding') == 'gzip':
+				body = gzip.decompress(body)
+			ok = response.status < 400
+		except (http.client.HTTPException, OSError):
+			self.close()
+		self.stats.add(path, time.time() - start, ok, len(load), len(body))
+		return body.decode('utf-8') if ok else None
+
+	def close(self):
+		if self.conn is not None:
+			self.conn.close()
+			self.conn = None
+
+	def register(self, course_id):
+		response = self.post('complete_registration',
+			dict(name=self.name, role=self.role, course_id=course_id), authenticated=False)
+		if response is None or ',' not in response:
+			return False
+		uid, password = response.split(',', 1)
+		self.auth = dict(name=self.name, password=password, uid=uid)
+		if self.role == 'teacher':
+			self.auth['role'] = 'teacher'
+		return True
+
+# ------------------------------------------------------------------
+class Student(Client):
+	def __init__(self, server, stats, name, timeout):
+		Client.__init__(self, server, stats, name, 'student', timeout)
+		self.lock = threading.Lock()
+
+	def poll(self):
+		with self.lock:
+			response = self.post('student_periodic_update', {})
+			if response is not None and response.split(';')[1] == '1':
+				self.post('student_gets', {})
+
+	def share(self, filename, content, priority):
+		with self.lock:
+			self.post('student_shares', dict(content=content, filename=filename, priority=priority, answer=''))
+
+# ------------------------------------------------------------------
+class Teacher(Client):
+	def __init__(self, server, stats, name, timeout):
+		Client.__init__(self, server, stats, name, 'teacher', timeout)
+
+	def broadcast(self, filename, content):
+		return self.post('teacher_broadcasts', dict(content=content, answer='', filename=filename,
+			merit=2, effort=1, attempts=1000000, tag='load', exact_answer='False'))
+
+	def grade_next(self, think):
+		response = self.post('teacher_gets', dict(index=-1, priority=0))
+		if response is None:
+			return False
+		sub = json.loads(response)
+		if sub['Sid'] == 0:
+			return False
+		time.sleep(think())
+		self.post('teacher_grades', dict(sid=sub['Sid'], content='', decision=random.choice(['correct', 'incorrect']), changed=False))
+		return True
+
+# ------------------------------------------------------------------
+# Shares per second across the class at time t, for each profile.
+# "burst" adds a "time's up" spike in which burst_share of the class
+# submits within burst_width seconds.
+# ------------------------------------------------------------------
+def share_rate(args, n, t):
+	base = n * args.shares / 60.0
+	if args.profile == 'ramp':
+		return base * 2 * t / args.duration
+	if args.profile == 'burst' and args.burst_at <= t < args.burst_at + args.burst_width:
+		return base + n * args.burst_share / args.burst_width
+	return base
+
+def max_share_rate(args, n):
+	return max(share_rate(args, n, t) for t in [0, args.duration, args.burst_at])
+
+def parse_mix(mix):
+	weights = {}
+	for item in mix.split(','):
+		priority, weight = item.split(':')
+		weights[int(priority)] = float(weight)
+	return list(weights.keys()), list(weights.values())
+
+def read_names(filename):
+	with open(filename, 'r', encoding='utf-8') as f:
+		return [line.strip() for line in f if line.strip() != '']
+
+def resolve(args):
+	if args.server:
+		return args.server
+	url = urllib.parse.urljoin(args.nameserver, 'ask')
+	parts = urllib.parse.urlsplit(url)
+	conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=args.timeout)
+	conn.request('POST', parts.path, urllib.parse.urlencode({'who':args.course}),
+		{'Content-Type': 'application/x-www-form-urlencoded'})
+	return conn.getresponse().read().decode('utf-8')
+
+# ------------------------------------------------------------------
+def run(args):
+	server = resolve(args)
+	stats = Stats()
+	students = [Student(server, stats, name, args.timeout) for name in read_names(args.students)]
+	teachers = [Teacher(server, stats, name, args.timeout) for name in read_names(args.teachers)]
+	students = [s for s in students if s.register(args.course)]
+	teachers = [t for t in teachers if t.register(args.course)]
+	if not students or not teachers:
+		print('Need at least one registered student and teacher.')
+		return
+	filename = 'load_test.py'
+	teachers[0].broadcast(filename, '# load test\n')
+	content = ('x = 1\n' * (args.size // 6 + 1))[:args.size]
+	priorities, weights = parse_mix(args.mix)
+	think = lambda: random.expovariate(1.0 / args.grade_time)
+
+	stop = threading.Event()
+	start = time.time()
+
+	def poll_loop(student):
+		time.sleep(random.uniform(0, args.poll))
+		while not stop.is_set():
+			student.poll()
+			stop.wait(args.poll * random.uniform(0.8, 1.2))
+
+	def grade_loop(teacher):
+		while not stop.is_set():
+			if not teacher.grade_next(think):
+				stop.wait(1)
+
+	threads = [threading.Thread(target=poll_loop, args=(s,), daemon=True) for s in students]
+	threads += [threading.Thread(target=grade_loop, args=(t,), daemon=True) for t in teachers]
+	for t in threads:
+		t.start()
+
+	# Shares arrive as a Poisson process with time-varying rate (by thinning).
+	rate_max = max_share_rate(args, len(students))
+	with concurrent.futures.ThreadPoolExecutor(max_workers=len(students)) as pool:
+		t = 0
+		while rate_max > 0:
+			t += random.expovariate(rate_max)
+			if t >= args.duration:
+				break
+			delay = start + t - time.time()
+			if delay > 0:
+				time.sleep(delay)
+			if random.random() < share_rate(args, len(students), t) / rate_max:
+				priority = random.choices(priorities, weights)[0]
+				pool.submit(random.choice(students).share, filename, content, priority)
+		time.sleep(max(0, start + args.duration - time.time()))
+		stop.set()
+	for t in threads:
+		t.join(args.timeout)
+	print(stats.report())
+
+# ------------------------------------------------------------------
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Synthetic classroom load for a GEM server.')
+	parser.add_argument('-server', help='course server address, e.g. http://localhost:8080')
+	parser.add_argument('-nameserver', help='resolve the course server through this name server')
+	parser.add_argument('-course', required=True, help='course id')
+	parser.add_argument('-students', required=True, help='file of student names, one per line')
+	parser.add_argument('-teachers', required=True, help='file of teacher/TA names, one per line')
+	parser.add_argument('-duration', type=float, default=60, help='seconds to run (default 60)')
+	parser.add_argument('-poll', type=float, default=10, help='seconds between student polls (default 10)')
+	parser.add_argument('-shares', type=float, default=1, help='shares per student per minute (default 1)')
+	parser.add_argument('-mix', default='1:0.7,2:0.3', help='priority:weight of shares, 1 (got it) or 2 (help me)')
+	parser.add_argument('-size', type=int, default=2000, help='bytes per shared file (default 2000)')
+	parser.add_argument('-grade_time', type=float, default=5, help='mean seconds a teacher spends per submission')
+	parser.add_argument('-profile', choices=['steady', 'ramp', 'burst'], default='steady')
+	parser.add_argument('-burst_at', type=float, default=30, help='start of the burst in seconds')
+	parser.add_argument('-burst_width', type=float, default=5, help='length of the burst in seconds')
+	parser.add_argument('-burst_share', type=float, default=0.8, help='fraction of the class submitting in the burst')
+	parser.add_argument('-timeout', type=float, default=7)
+	args = parser.parse_args()
+	if not args.server and not args.nameserver:
+		parser.error('one of -server or -nameserver is required')
+	if not set(parse_mix(args.mix)[0]) <= {1, 2}:
+		parser.error('-mix priorities must be 1 or 2, as sent by GEMStudent; teacher_gets never claims others')
+	run(args)
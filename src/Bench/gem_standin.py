@@ -0,0 +1,210 @@
+# GEM stand-in server
+#
+# A small in-memory server implementing the endpoints the plugins call,
+# with injected latency, jitter, errors and dropped connections, for
+# benchmarking the plugins against a slow or flaky server:
+#
+#   python3 gem_standin.py -port 8090 -latency 50 -jitter 20 -error_rate 0.02
+#
+# It also serves as its own name server: /ask returns its address.
+#
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import time
+import urllib.parse
+
+# ------------------------------------------------------------------
+class Course:
+	def __init__(self, args):
+		self.args = args
+		self.users = {}
+		self.queue = []
+		self.boards = {}
+		self.next_sid = 1
+		self.queue_version = 0
+		self.epoch = time.time_ns()
+		self.problem = None
+
+	def register(self, form):
+		if form.get('course_id') != self.args.course:
+			return 'Failed'
+		name = form.get('name', '')
+		if name not in self.users:
+			self.users[name] = (len(self.users) + 1, 'pw{}'.format(len(self.users) + 1))
+		uid, password = self.users[name]
+		return '{},{}'.format(uid, password)
+
+	def authorized(self, form):
+		user = self.users.get(form.get('name'))
+		return user is not None and str(user[0]) == form.get('uid') and user[1] == form.get('password')
+
+	def padding(self):
+		return 'x' * self.args.payload
+
+	# --------------------------------------------------------------
+	def student_periodic_update(self, form, headers):
+		headers['X-Poll-Interval'] = str(self.args.poll)
+		uid = int(form['uid'])
+		return '0;{}'.format(1 if self.boards.get(uid) else 0)
+
+	def student_shares(self, form, headers):
+		sub = dict(Sid=self.next_sid, Key=self.next_sid, Uid=int(form['uid']), Pid=1, Content=form.get('content', ''),
+			Filename=form.get('filename', ''), Priority=int(form.get('priority') or 0),
+			At=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), Name=form.get('name', ''), Since=time.time())
+		self.next_sid += 1
+		self.queue.append(sub)
+		self.queue_version += 1
+		return 'Your submission will be looked at soon.'
+
+	def student_gets(self, form, headers):
+		boards = self.boards.pop(int(form['uid']), [])
+		return json.dumps(boards)
+
+	def teacher_gets(self, form, headers):
+		selected = dict(Sid=0, Key=0, Uid=0, Pid=0, Content='', Filename='', Priority=0, At='0001-01-01T00:00:00Z', Name='')
+		key = int(form.get('key') or 0)
+		for i, sub in enumerate(self.queue):
+			if key > 0 and sub['Key'] != key:
+				continue
+			selected = self.queue.pop(i)
+			self.queue_version += 1
+			break
+		selected = dict(selected)
+		selected.pop('Since', None)
+		return json.dumps(selected)
+
+	def teacher_gets_queue(self, form, headers):
+		if form.get('summary') == '1':
+			entries = [dict(Key=s['Key'], Sid=s['Sid'], Uid=s['Uid'], Name=s['Name'], Filename=s['Filename'],
+				Priority=s['Priority'], WaitSeconds=int(time.time() - s['Since'])) for s in self.queue]
+			return json.dumps(dict(Epoch=self.epoch, Version=self.queue_version, Full=True, Entries=entries, Removed=[]))
+		return json.dumps([dict(s) for s in self.queue], default=str)
+
+	def teacher_grades(self, form, headers):
+		return 'Submission is graded {}.'.format(form.get('decision', ''))
+
+	def teacher_broadcasts(self, form, headers):
+		board = dict(Content=form.get('content', '') + self.padding(), Answer=form.get('answer', ''),
+			Attempts=int(form.get('attempts') or 0), Filename=form.get('filename', ''), Pid=1,
+			StartingTime='0001-01-01T00:00:00Z', Type='code')
+		for uid, _ in self.users.values():
+			self.boards.setdefault(uid, []).append(board)
+		return 'Content copied to student boards.'
+
+# ------------------------------------------------------------------
+Handlers = [
+	'student_periodic_update',
+	'student_shares',
+	'student_gets',
+	'teacher_gets',
+	'teacher_gets_queue',
+	'teacher_grades',
+	'teacher_broadcasts',
+]
+
+def parse_overrides(items):
+	overrides = {}
+	for item in items or []:
+		path, ms = item.split('=')
+		overrides[path] = float(ms)
+	return overrides
+
+# ------------------------------------------------------------------
+class Server:
+	def __init__(self, args):
+		self.args = args
+		self.course = Course(args)
+		self.latency = parse_overrides(args.endpoint_latency)
+		self.address = 'http://{}:{}'.format(args.host, args.port)
+
+	def delay(self, path):
+		ms = self.latency.get(path, self.args.latency) + random.uniform(-self.args.jitter, self.args.jitter)
+		return max(ms, 0) / 1000.0
+
+	def respond(self, path, form, headers):
+		if path == 'ping':
+			return 200, 'pong'
+		if path == 'ask':
+			return 200, self.address
+		if path == 'complete_registration':
+			return 200, self.course.register(form)
+		if path not in Handlers:
+			return 404, 'Not found.'
+		if not self.course.authorized(form):
+			return 401, 'Unauthorized access. Please register again.'
+		return 200, getattr(self.course, path)(form, headers)
+
+	async def handle(self, reader, writer):
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				method, target, version = line.decode('latin-1').split(' ', 2)
+				request_headers = {}
+				while True:
+					line = (await reader.readline()).decode('latin-1').strip()
+					if line == '':
+						break
+					k, v = line.split(':', 1)
+					request_headers[k.strip().lower()] = v.strip()
+				body = await reader.readexactly(int(request_headers.get('content-length', 0)))
+				if request_headers.get('content-encoding') == 'gzip':
+					body = gzip.decompress(body)
+				parts = urllib.parse.urlsplit(target)
+				form = dict(urllib.parse.parse_qsl(parts.query))
+				form.update(urllib.parse.parse_qsl(body.decode('utf-8')))
+				path = parts.path.strip('/')
+
+				await asyncio.sleep(self.delay(path))
+				if random.random() < self.args.drop_rate:
+					break
+				headers = {'X-Gem-Features': self.args.features} if self.args.features else {}
+				if 'x-gem-request-id' in request_headers:
+					headers['X-Gem-Request-Id'] = request_headers['x-gem-request-id']
+				if random.random() < self.args.error_rate:
+					status, text = 500, 'Injected failure.'
+				else:
+					status, text = self.respond(path, form, headers)
+				payload = text.encode('utf-8')
+				if 'gzip' in self.args.features and 'gzip' in request_headers.get('accept-encoding', ''):
+					payload = gzip.compress(payload)
+					headers['Content-Encoding'] = 'gzip'
+				headers['Content-Length'] = str(len(payload))
+				head = 'HTTP/1.1 {} {}\r\n'.format(status, {200:'OK', 401:'Unauthorized', 404:'Not Found', 500:'Internal Server Error'}[status])
+				head += ''.join('{}: {}\r\n'.format(k, v) for k, v in headers.items()) + '\r\n'
+				writer.write(head.encode('latin-1') + payload)
+				await writer.drain()
+				if request_headers.get('connection', '').lower() == 'close':
+					break
+		except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+			pass
+		writer.close()
+
+	async def serve(self):
+		server = await asyncio.start_server(self.handle, self.args.host, self.args.port)
+		print('GEM stand-in for course {} serving at {}'.format(self.args.course, self.address))
+		async with server:
+			await server.serve_forever()
+
+# ------------------------------------------------------------------
+def parser():
+	parser = argparse.ArgumentParser(description='In-memory GEM server with injected latency and faults.')
+	parser.add_argument('-host', default='127.0.0.1')
+	parser.add_argument('-port', type=int, default=8090)
+	parser.add_argument('-course', default='MyCourse', help='course id')
+	parser.add_argument('-latency', type=float, default=0, help='milliseconds added to every response')
+	parser.add_argument('-jitter', type=float, default=0, help='latency varies by up to +/- this many milliseconds')
+	parser.add_argument('-endpoint_latency', nargs='*', help='per-endpoint latency, e.g. teacher_gets=200')
+	parser.add_argument('-error_rate', type=float, default=0, help='fraction of requests answered with 500')
+	parser.add_argument('-drop_rate', type=float, default=0, help='fraction of connections dropped without a response')
+	parser.add_argument('-payload', type=int, default=0, help='bytes added to each broadcast board')
+	parser.add_argument('-poll', type=int, default=10, help='poll interval advised to students, in seconds')
+	parser.add_argument('-features', default='gzip', help='features advertised in X-Gem-Features')
+	return parser
+
+if __name__ == '__main__':
+	asyncio.run(Server(parser().parse_args()).serve())
@@ -0,0 +1,142 @@
+# Headless stand-in for Sublime Text's sublime module
+#
+# Enough of the API for the GEM plugins to be imported and their request
+# paths run outside the editor. Callbacks passed to set_timeout run on
+# one "main" thread, as in Sublime; dialogs are recorded in messages.
+#
+import heapq
+import itertools
+import threading
+import time
+
+messages = []
+statuses = []
+
+class Loop:
+	def __init__(self):
+		self.cond = threading.Condition()
+		self.tasks = []
+		self.counter = itertools.count()
+		threading.Thread(target=self.run, daemon=True).start()
+
+	def add(self, fn, delay):
+		with self.cond:
+			heapq.heappush(self.tasks, (time.time() + delay / 1000.0, next(self.counter), fn))
+			self.cond.notify()
+
+	def run(self):
+		while True:
+			with self.cond:
+				while not self.tasks or self.tasks[0][0] > time.time():
+					self.cond.wait(self.tasks[0][0] - time.time() if self.tasks else None)
+				_, _, fn = heapq.heappop(self.tasks)
+			try:
+				fn()
+			except Exception as err:
+				print('callback failed: {}'.format(err))
+
+MainLoop = Loop()
+AsyncLoop = Loop()
+
+def set_timeout(fn, delay=0):
+	MainLoop.add(fn, delay)
+
+def set_timeout_async(fn, delay=0):
+	AsyncLoop.add(fn, delay)
+
+def message_dialog(mesg):
+	messages.append(mesg)
+
+def ok_cancel_dialog(mesg, ok_title=''):
+	messages.append(mesg)
+	return True
+
+def status_message(mesg):
+	statuses.append(mesg)
+
+def packages_path():
+	return '.'
+
+def run_command(cmd, args=None):
+	pass
+
+# ------------------------------------------------------------------
+class Region:
+	def __init__(self, a, b):
+		self.a, self.b = a, b
+
+class Settings:
+	def __init__(self):
+		self.values = {}
+
+	def get(self, key, default=None):
+		return self.values.get(key, default)
+
+	def set(self, key, value):
+		self.values[key] = value
+
+	def erase(self, key):
+		self.values.pop(key, None)
+
+class View:
+	def __init__(self, path=None, content=''):
+		self.path = path
+		self.content = content
+		self.view_settings = Settings()
+
+	def file_name(self):
+		return self.path
+
+	def size(self):
+		return len(self.content)
+
+	def substr(self, region):
+		return self.content[region.a:region.b]
+
+	def settings(self):
+		return self.view_settings
+
+	def set_status(self, key, value):
+		pass
+
+	def erase_status(self, key):
+		pass
+
+	def window(self):
+		return active_window()
+
+class Window:
+	def __init__(self):
+		self.views = []
+
+	def id(self):
+		return 1
+
+	def open_file(self, path, flags=0):
+		try:
+			with open(path, 'r', encoding='utf-8') as f:
+				view = View(path, f.read())
+		except OSError:
+			view = View(path)
+		self.views.append(view)
+		return view
+
+	def active_view(self):
+		return self.views[-1] if self.views else None
+
+	def folders(self):
+		return []
+
+	def run_command(self, cmd, args=None):
+		pass
+
+	def show_input_panel(self, caption, initial, on_done, on_change, on_cancel):
+		pass
+
+	def show_quick_panel(self, items, on_done, flags=0, selected_index=-1, on_highlight=None):
+		pass
+
+TheWindow = Window()
+
+def active_window():
+	return TheWindow
@@ -0,0 +1,16 @@
+# Headless stand-in for Sublime Text's sublime_plugin module
+import sublime
+
+class ApplicationCommand:
+	pass
+
+class WindowCommand:
+	def __init__(self, window=None):
+		self.window = window or sublime.active_window()
+
+class TextCommand:
+	def __init__(self, view=None):
+		self.view = view
+
+class EventListener:
+	pass
@@ -5,9 +5,19 @@
 import sublime, sublime_plugin
 import urllib.parse
 import urllib.request
+import http.client
+import threading
+import functools
+import queue
+import collections
 import os
 import json
 import socket
+import select
+import hashlib
+import difflib
+import gzip
+import time
 import webbrowser
 import random
 import re
@@ -15,46 +25,364 @@ import re
 gemaAnswerTag = 'ANSWER:'
 gemaFOLDER = ''
 gemaTIMEOUT = 7
-gemaStudentSubmissions = {}
+gemaStatsWindow = 500		# Requests per endpoint kept for connection stats
+gemaMaxIdleConnections = 4
+gemaConnections = {}
+gemaConnectionsLock = threading.Lock()
+gemaFeatures = {}
+gemaCompressMin = 512
+gemaCompressPaths = ('/teacher_broadcasts', '/teacher_grades', '/teacher_grades_batch')
+gemaIdempotentPaths = ('/ask', '/ping', '/teacher_gets_passcode', '/teacher_gets_queue')	# safe to send again after any connection failure
+gemaWorkers = 4
+gemaSpinner = ['-', '\\', '|', '/']
+gemaOriginalsMax = 256
+gemaPrefetchDepth = 5
+gemaPrefetched = []
+gemaPrefetchLease = 240		# Seconds a prefetched submission is kept; the server takes it back after 300
+gemaPrefetchLock = threading.Lock()
+gemaPrefetching = False
+gemaQueue = dict(Epoch=0, Version=-1, Entries=[])
 gemaConnected = False
 gemaFILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "info")
 gemaSERVER = ''
+gemaAddressTTL = 5400		# Seconds before the course server's address is resolved again
+gemaPingTIMEOUT = 3
+gemaAddressLock = threading.Lock()
+gemaRefreshing = False
 
 # ----------------------------------------------------------------------
 # ----------------------------------------------------------------------
 # These functionalities below are identical to the GEMAssistant module
 # ----------------------------------------------------------------------
-# ----------------------------------------------------------------------
-def gemaRequest(path, data, authenticated=True, method='POST'):
-	global gemaFOLDER, gemaSERVER
+# ------------------------------------------------------------------
+# The info file, cached in memory and revalidated by mtime/size.
+# Writes go to a temporary file that is renamed over the original.
+# ------------------------------------------------------------------
+class gemaInfoFile:
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.RLock()
+		self.stamp = None
+		self.info = {}
+
+	def refresh(self):
+		try:
+			st = os.stat(self.path)
+		except OSError:
+			self.stamp, self.info = None, {}
+			return
+		stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+		if stamp != self.stamp:
+			try:
+				with open(self.path, 'r') as f:
+					self.info = json.loads(f.read())
+			except ValueError:
+				self.info = {}
+			self.stamp = stamp
+
+	def load(self):
+		with self.lock:
+			self.refresh()
+			return dict(self.info)
+
+	def save(self, info):
+		with self.lock:
+			tmp = '{}.{}.tmp'.format(self.path, threading.get_ident())
+			with open(tmp, 'w') as f:
+				f.write(json.dumps(info, indent=4))
+			os.replace(tmp, self.path)
+			st = os.stat(self.path)
+			self.info = dict(info)
+			self.stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+
+	def update(self, **changes):
+		with self.lock:
+			self.refresh()
+			info = dict(self.info)
+			info.update(changes)
+			self.save(info)
+			return info
+
+gemaINFO = gemaInfoFile(gemaFILE)
+
+# ------------------------------------------------------------------
+# Persistent HTTP/1.1 connections, kept idle per server and reused.
+# ------------------------------------------------------------------
+def gema_checkout_connection(server, timeout):
+	with gemaConnectionsLock:
+		idle = gemaConnections.get(server, [])
+		while idle:
+			conn = idle.pop()
+			if conn.sock is None or select.select([conn.sock], [], [], 0)[0]:
+				conn.close()		# closed by the server while idle
+				continue
+			conn.timeout = timeout
+			conn.sock.settimeout(timeout)
+			return conn, True
+	conn = http.client.HTTPConnection(server[0], server[1], timeout=timeout)
+	conn.connect()
+	conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	return conn, False
 
+def gema_checkin_connection(server, conn):
+	with gemaConnectionsLock:
+		idle = gemaConnections.setdefault(server, [])
+		if len(idle) < gemaMaxIdleConnections:
+			idle.append(conn)
+			return
+	conn.close()
+
+def gema_urlopen(url, load=None, method='POST', timeout=gemaTIMEOUT, response_headers=None, request_id=None):
+	trace = dict(Id=request_id or gema_request_id(), Start=time.time(), Sent=0, Received=0)
+	outcome = 'error'
 	try:
-		with open(gemaFILE, 'r') as f:
-			info = json.loads(f.read())
-	except:
-		info = dict()
+		body = gema_exchange(url, load, method, timeout, response_headers, trace)
+		outcome = 'ok'
+		return body
+	except urllib.error.HTTPError as err:
+		outcome = str(err.code)
+		raise
+	finally:
+		trace['Total'] = time.time() - trace['Start']
+		trace['Outcome'] = outcome
+		gemaSTATS.add(urllib.parse.urlsplit(url).path.strip('/'), trace)
+
+def gema_exchange(url, load, method, timeout, response_headers, trace):
+	parts = urllib.parse.urlsplit(url)
+	server = (parts.hostname, parts.port or 80)
+	path = parts.path or '/'
+	if parts.query:
+		path += '?' + parts.query
+	headers = {'Connection': 'keep-alive', 'Accept-Encoding': 'gzip', 'X-Gem-Request-Id': trace['Id']}
+	if load is not None:
+		headers['Content-Type'] = 'application/x-www-form-urlencoded'
+		# Only servers that advertised gzip get compressed request bodies.
+		if path in gemaCompressPaths and len(load) >= gemaCompressMin and 'gzip' in gemaFeatures.get(server, ()):
+			load = gzip.compress(load)
+			headers['Content-Encoding'] = 'gzip'
+		trace['Sent'] = len(load)
+	while True:
+		try:
+			conn, reused = gema_checkout_connection(server, timeout)
+		except OSError as err:
+			raise urllib.error.URLError(err)
+		sent = False
+		try:
+			conn.request(method, path, load, headers)
+			sent = True
+			response = conn.getresponse()
+			trace['FirstByte'] = time.time() - trace['Start']
+			body = response.read()
+			trace['Received'] = len(body)
+		except (http.client.BadStatusLine, ConnectionError) as err:
+			conn.close()
+			# A request that was not sent in full cannot have been applied.
+			# Once sent, it may have been, so only requests that change
+			# nothing are sent again.
+			if reused and (not sent or parts.path in gemaIdempotentPaths):
+				continue
+			raise urllib.error.URLError(err)
+		except (http.client.HTTPException, OSError) as err:
+			conn.close()
+			raise urllib.error.URLError(err)
+		if response.will_close:
+			conn.close()
+		else:
+			gema_checkin_connection(server, conn)
+		features = response.getheader('X-Gem-Features')
+		if features is not None:
+			gemaFeatures[server] = features.split(',')
+		if response.getheader('Content-Encoding') == 'gzip':
+			body = gzip.decompress(body)
+		if response_headers is not None:
+			response_headers.update((k.lower(), v) for k, v in response.getheaders())
+		if response.status >= 400:
+			raise urllib.error.HTTPError(url, response.status, response.reason, response.msg, None)
+		return body
+
+# ------------------------------------------------------------------
+# Network requests run on a small pool of worker threads so that the
+# editor stays responsive. Callbacks are run on the UI thread.
+# ------------------------------------------------------------------
+class gemaTask:
+	def __init__(self, label, fn, callback):
+		self.label = label
+		self.fn = fn
+		self.callback = callback
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+class gemaExecutor:
+	def __init__(self, workers):
+		self.workers = workers
+		self.threads = []
+		self.tasks = queue.Queue()
+		self.pending = []
+		self.lock = threading.Lock()
+		self.ticking = False
+		self.frame = 0
+
+	def submit(self, label, fn, callback=None):
+		task = gemaTask(label, fn, callback)
+		with self.lock:
+			if len(self.threads) < self.workers:
+				t = threading.Thread(target=self.work, daemon=True)
+				self.threads.append(t)
+				t.start()
+			self.pending.append(task)
+			start_ticking, self.ticking = not self.ticking, True
+		self.tasks.put(task)
+		if start_ticking:
+			sublime.set_timeout(self.show_progress, 0)
+		return task
+
+	def work(self):
+		while True:
+			task = self.tasks.get()
+			if task is None:
+				return
+			result = None
+			if not task.cancelled:
+				try:
+					result = task.fn()
+				except Exception as err:
+					print('{} failed: {}'.format(task.label, err))
+			with self.lock:
+				self.pending.remove(task)
+			if task.callback is not None and not task.cancelled:
+				sublime.set_timeout(functools.partial(self.finish, task, result), 0)
+
+	def finish(self, task, result):
+		if not task.cancelled:
+			task.callback(result)
+
+	def cancel_all(self):
+		with self.lock:
+			for task in self.pending:
+				task.cancel()
+			return len(self.pending)
+
+	def shutdown(self):
+		self.cancel_all()
+		for t in self.threads:
+			self.tasks.put(None)
+
+	def show_progress(self):
+		with self.lock:
+			labels = [t.label for t in self.pending if not t.cancelled]
+			if not labels:
+				self.ticking = False
+		if not labels:
+			sublime.status_message('')
+			return
+		self.frame = (self.frame + 1) % len(gemaSpinner)
+		sublime.status_message('GEM {} {}'.format(gemaSpinner[self.frame], ', '.join(labels)))
+		sublime.set_timeout(self.show_progress, 100)
+
+gemaEXECUTOR = gemaExecutor(gemaWorkers)
+
+# ------------------------------------------------------------------
+def gema_async(path, data, callback=None, **kwargs):
+	return gemaEXECUTOR.submit(path, lambda: gemaRequest(path, data, **kwargs), callback)
+
+# ------------------------------------------------------------------
+def gema_message(mesg):
+	sublime.set_timeout(lambda: sublime.message_dialog(mesg), 0)
+
+# ------------------------------------------------------------------
+class gemaCancelRequests(sublime_plugin.ApplicationCommand):
+	def run(self):
+		n = gemaEXECUTOR.cancel_all()
+		sublime.status_message('{} pending request(s) cancelled.'.format(n))
+
+# ------------------------------------------------------------------
+# Every request carries an id in X-Gem-Request-Id, which the server
+# logs for slow or failed requests. The latest gemaStatsWindow requests
+# to each endpoint are kept for "Show connection stats".
+# ------------------------------------------------------------------
+def gema_request_id():
+	return '{:016x}'.format(random.getrandbits(64))
+
+def gema_percentile(values, p):
+	if not values:
+		return 0
+	return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+class gemaConnectionStats:
+	def __init__(self, window):
+		self.window = window
+		self.lock = threading.Lock()
+		self.samples = {}
+
+	def add(self, path, trace):
+		with self.lock:
+			if path not in self.samples:
+				self.samples[path] = collections.deque(maxlen=self.window)
+			self.samples[path].append(trace)
+
+	def summary(self):
+		with self.lock:
+			samples = dict((path, list(traces)) for path, traces in self.samples.items())
+		lines = ['{:<28} {:>6} {:>6} {:>8} {:>8} {:>8} {:>10} {:>9} {:>9}'.format(
+			'endpoint', 'count', 'failed', 'p50 ms', 'p95 ms', 'p99 ms', 'TTFB p50', 'KB out', 'KB in')]
+		for path, traces in sorted(samples.items()):
+			totals = sorted(t['Total'] for t in traces)
+			firsts = sorted(t['FirstByte'] for t in traces if 'FirstByte' in t)
+			lines.append('{:<28} {:>6} {:>6} {:>8.0f} {:>8.0f} {:>8.0f} {:>10.0f} {:>9.1f} {:>9.1f}'.format(
+				path, len(traces), sum(1 for t in traces if t['Outcome'] != 'ok'),
+				1000 * gema_percentile(totals, 50), 1000 * gema_percentile(totals, 95),
+				1000 * gema_percentile(totals, 99), 1000 * gema_percentile(firsts, 50),
+				sum(t['Sent'] for t in traces) / 1024.0, sum(t['Received'] for t in traces) / 1024.0))
+		slowest = sorted(((t['Total'], path, t) for path, traces in samples.items() for t in traces),
+			key=lambda s: s[0], reverse=True)[:10]
+		lines.append('\nSlowest requests (the server logs slow requests by id):')
+		for total, path, t in slowest:
+			lines.append('{}  {:<28} {:>8.0f} ms  {}  {}'.format(t['Id'], path, 1000 * total, t['Outcome'],
+				time.strftime('%H:%M:%S', time.localtime(t['Start']))))
+		return '\n'.join(lines)
+
+gemaSTATS = gemaConnectionStats(gemaStatsWindow)
+
+class gemaShowConnectionStats(sublime_plugin.ApplicationCommand):
+	def run(self):
+		info = gemaINFO.load()
+		if 'Folder' not in info:
+			gema_message("Please set a local folder to store working files.")
+			return
+		stats_file = os.path.join(info['Folder'], 'ConnectionStats.txt')
+		with open(stats_file, 'w', encoding='utf-8') as f:
+			f.write(gemaSTATS.summary() + '\n')
+		if sublime.active_window().id() == 0:
+			sublime.run_command('new_window')
+		sublime.active_window().open_file(stats_file)
+
+# ----------------------------------------------------------------------
+def gemaRequest(path, data, authenticated=True, method='POST', response_headers=None):
+	global gemaFOLDER
+
+	info = gemaINFO.load()
 
 	if 'Folder' not in info:
-		sublime.message_dialog("Please set a local folder for keeping working files.")
+		gema_message("Please set a local folder for keeping working files.")
 		return None
 
 	if 'CourseId' not in info:
-		sublime.message_dialog("Please set the course id.")
+		gema_message("Please set the course id.")
 		return None
 
 	if 'Server' not in info:
-		sublime.message_dialog("Please sett the server address.")
+		gema_message("Please sett the server address.")
 		return None
 
-	if gemaSERVER == '':
-		sublime.run_command('gema_connect')
-		if gemaSERVER == '':
-			sublime.message_dialog('Unable to connect. Check server address or course id.')
-			return
+	if not gema_server(info):
+		gema_message('Unable to connect. Check server address or course id.')
+		return
 
 	if authenticated:
 		if 'Name' not in info or 'Password' not in info:
-			sublime.message_dialog("Please ask to setup a new teacher account and register.")
+			gema_message("Please ask to setup a new teacher account and register.")
 			return None
 		data['name'] = info['Name']
 		data['password'] = info['Password']
@@ -64,28 +392,30 @@ def gemaRequest(path, data, authenticated=True, method='POST'):
 
 	url = urllib.parse.urljoin(gemaSERVER, path)
 	load = urllib.parse.urlencode(data).encode('utf-8')
-	req = urllib.request.Request(url, load, method=method)
+	request_id = gema_request_id()
 	try:
-		with urllib.request.urlopen(req, None, gemaTIMEOUT) as response:
-			return response.read().decode(encoding="utf-8")
+		return gema_urlopen(url, load, method, response_headers=response_headers, request_id=request_id).decode(encoding="utf-8")
 	except urllib.error.HTTPError as err:
-		sublime.message_dialog("{0}".format(err))
+		gema_message("{0}".format(err))
 	except urllib.error.URLError as err:
-		sublime.message_dialog("{0}\nCannot connect to server.".format(err))
-	print('Something is wrong')
+		gema_start_refresh(check=True)
+		gema_message("{0}\nCannot connect to server.".format(err))
+	print('Something is wrong with {} ({})'.format(path, request_id))
 	return None
 
 # ------------------------------------------------------------------
 class gemaViewBulletinBoard(sublime_plugin.ApplicationCommand):
 	def run(self):
-		response = gemaRequest('teacher_gets_passcode', {})
+		gema_async('teacher_gets_passcode', {}, self.open)
+
+	def open(self, response):
+		if response is None:
+			return
 		if response.startswith('Unauthorized'):
 			sublime.message_dialog('Unauthorized')
 		else:
 			global gemaSERVER
 			p = urllib.parse.urlencode({'pc' : response})
-			with open(gemaFILE, 'r') as f:
-				info = json.loads(f.read())
 			webbrowser.open(gemaSERVER + '/view_bulletin_board?' + p)
 
 # ------------------------------------------------------------------
@@ -100,7 +430,9 @@ class gemaAddBulletin(sublime_plugin.TextCommand):
 		if len(content) <= 20:
 			sublime.message_dialog('Select more text to show on the bulletin board.')
 			return
-		response = gemaRequest('teacher_adds_bulletin_page', {'content':content})
+		gema_async('teacher_adds_bulletin_page', {'content':content}, self.done)
+
+	def done(self, response):
 		if response:
 			sublime.message_dialog(response)
 
@@ -109,49 +441,180 @@ class gemaPutBack(sublime_plugin.TextCommand):
 	def run(self, edit):
 		fname = self.view.file_name()
 		sid = os.path.basename(os.path.dirname(fname))
-		response = gemaRequest('teacher_puts_back', {'sid':sid})
-		if response:
-			sublime.message_dialog(response)
-		if response != 'Unknown submission.':
-			self.view.window().run_command('close')
+		view = self.view
+		def done(response):
+			if response:
+				sublime.message_dialog(response)
+			if response != 'Unknown submission.':
+				gema_close_view(view)
+		gema_async('teacher_puts_back', {'sid':sid}, done)
 
 # ------------------------------------------------------------------
-def gema_grade(self, edit, decision):
-	fname = self.view.file_name()
+def gema_close_view(view):
+	window = view.window()
+	if window is not None:
+		window.focus_view(view)
+		window.run_command('close')
+
+# ------------------------------------------------------------------
+def remove_first_line(content):
+	lines = content.split('\n')
+	if len(lines) > 0:
+		return '\n'.join(lines[1:])
+	else:
+		return content
+
+# ------------------------------------------------------------------
+# The text of each opened submission is kept next to it, in <sid>/.original,
+# and only the hashes of recently used ones are kept in memory. Edit
+# detection therefore survives plugin reloads and memory stays bounded.
+# ------------------------------------------------------------------
+gemaOriginalFile = '.original'
+
+class gemaOriginals:
+	def __init__(self, size):
+		self.size = size
+		self.hashes = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	def remember(self, dir, digest):
+		with self.lock:
+			self.hashes.pop(dir, None)
+			self.hashes[dir] = digest
+			while len(self.hashes) > self.size:
+				self.hashes.popitem(last=False)
+
+	def put(self, dir, content):
+		path = os.path.join(dir, gemaOriginalFile)
+		tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+		with open(tmp, 'w', encoding='utf-8') as f:
+			f.write(content)
+		os.replace(tmp, path)
+		self.remember(dir, gema_normalized_hash(content))
+
+	def get(self, dir):
+		try:
+			with open(os.path.join(dir, gemaOriginalFile), 'r', encoding='utf-8') as f:
+				return f.read()
+		except OSError:
+			return None
+
+	def normalized_hash(self, dir):
+		with self.lock:
+			if dir in self.hashes:
+				self.hashes.move_to_end(dir)
+				return self.hashes[dir]
+		content = self.get(dir)
+		if content is None:
+			return None
+		digest = gema_normalized_hash(content)
+		self.remember(dir, digest)
+		return digest
+
+gemaORIGINALS = gemaOriginals(gemaOriginalsMax)
+
+# ------------------------------------------------------------------
+def gema_grade_data(view, decision):
+	fname = view.file_name()
 	changed = False
 	sid = os.path.basename(os.path.dirname(fname))
 	if decision=='dismissed':
 		content = ''
 	else:
-		content = self.view.substr(sublime.Region(0, self.view.size())).strip()
-		if sid in gemaStudentSubmissions:
-			if gemaStudentSubmissions[sid].strip() != content.strip():
-				changed = True
-
-	stop = False
-	if sid == '0':
-		stop = True
+		content = view.substr(sublime.Region(0, view.size())).strip()
+		original_hash = gemaORIGINALS.normalized_hash(os.path.dirname(fname))
+		if original_hash is not None:
+			changed = original_hash != gema_normalized_hash(content)
+	return dict(
+		sid = sid,
+		content = content,
+		decision = decision,
+		changed = changed,
+	)
+
+# ------------------------------------------------------------------
+# Edits are detected by comparing hashes of the normalised texts: the
+# header line, line endings and trailing whitespace are ignored.
+# ------------------------------------------------------------------
+def gema_hash(content):
+	return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def gema_normalized_hash(content):
+	lines = remove_first_line(content.strip().replace('\r\n', '\n')).split('\n')
+	return gema_hash('\n'.join(line.rstrip() for line in lines).strip())
+
+# ------------------------------------------------------------------
+# The graded content is sent as line deltas against the submission,
+# ["=", n] keep, ["-", n] drop, ["+", text] insert, when the server
+# supports it. It re-sends in full if the server's copy differs.
+# ------------------------------------------------------------------
+def gema_lines(text):
+	lines = [line + '\n' for line in text.split('\n')]
+	lines[-1] = lines[-1][:-1]
+	if lines[-1] == '':
+		lines.pop()
+	return lines
+
+def gema_delta(base, content):
+	a, b = gema_lines(base), gema_lines(content)
+	ops = []
+	for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+		if tag == 'equal':
+			ops.append(['=', i2 - i1])
+			continue
+		if i2 > i1:
+			ops.append(['-', i2 - i1])
+		if j2 > j1:
+			ops.append(['+', ''.join(b[j1:j2])])
+	return ops
+
+def gema_server_features():
+	parts = urllib.parse.urlsplit(gemaSERVER)
+	return gemaFeatures.get((parts.hostname, parts.port or 80), ())
+
+def gema_compact_grade(data, dir):
+	original = gemaORIGINALS.get(dir)
+	if original is None or data['decision'] == 'dismissed' or 'delta' not in gema_server_features():
+		return data
+	delta = json.dumps(gema_delta(original, data['content']))
+	if len(delta) >= len(data['content']):
+		return data
+	compact = dict(data, delta=delta, base_hash=gema_hash(original), content_hash=gema_hash(data['content']))
+	del compact['content']
+	return compact
+
+def gema_send_grade(data, dir):
+	headers = {}
+	compact = gema_compact_grade(data, dir)
+	response = gemaRequest('teacher_grades', dict(compact), response_headers=headers)
+	if compact is not data and headers.get('x-gem-delta') == 'mismatch':
+		response = gemaRequest('teacher_grades', dict(data))
+	return response
+
+# ------------------------------------------------------------------
+def gema_is_submission(sid):
 	try:
-		int(sid)
+		return int(sid) != 0
 	except:
-		stop = True
-	if stop:
+		return False
+
+# ------------------------------------------------------------------
+def gema_grade(self, edit, decision):
+	data = gema_grade_data(self.view, decision)
+	if not gema_is_submission(data['sid']):
 		if decision=='dismissed':
-			self.view.window().run_command('close')
+			gema_close_view(self.view)
 		else:
 			sublime.message_dialog('This is not a graded problem.')
 		return
 
-	data = dict(
-		sid = sid,
-		content = content,
-		decision = decision,
-		changed = changed,
-	)
-	response = gemaRequest('teacher_grades', data)
-	if response:
-		sublime.message_dialog(response)
-		self.view.window().run_command('close')
+	view = self.view
+	def done(response):
+		if response:
+			sublime.message_dialog(response)
+			gema_close_view(view)
+	dir = os.path.dirname(view.file_name())
+	gemaEXECUTOR.submit('teacher_grades', lambda: gema_send_grade(data, dir), done)
 
 # ------------------------------------------------------------------
 class gemaUngrade(sublime_plugin.TextCommand):
@@ -171,26 +634,92 @@ class gemaDismissed(sublime_plugin.TextCommand):
 		gema_grade(self, edit, "dismissed")
 
 # ------------------------------------------------------------------
-def gema_gets(self, index, priority):
-	global gemaStudentSubmissions
-	response = gemaRequest('teacher_gets', {'index':index, 'priority':priority})
+# Submission tabs can be marked now and graded together in one request.
+# ------------------------------------------------------------------
+def gema_mark(view, decision):
+	view.settings().set('gem_decision', decision)
+	view.set_status('gem_decision', 'GEM: {}'.format(decision))
+
+class gemaMarkCorrect(sublime_plugin.TextCommand):
+	def run(self, edit):
+		gema_mark(self.view, 'correct')
+
+class gemaMarkIncorrect(sublime_plugin.TextCommand):
+	def run(self, edit):
+		gema_mark(self.view, 'incorrect')
+
+class gemaMarkDismissed(sublime_plugin.TextCommand):
+	def run(self, edit):
+		gema_mark(self.view, 'dismissed')
+
+# ------------------------------------------------------------------
+class gemaGradeMarked(sublime_plugin.WindowCommand):
+	def run(self):
+		views, grades = [], []
+		for view in self.window.views():
+			decision = view.settings().get('gem_decision')
+			if decision is None or view.file_name() is None:
+				continue
+			data = gema_grade_data(view, decision)
+			if gema_is_submission(data['sid']):
+				data['sid'] = int(data['sid'])
+				views.append(view)
+				grades.append(gema_compact_grade(data, os.path.dirname(view.file_name())))
+		if len(grades) == 0:
+			sublime.message_dialog('No submission tabs are marked for grading.')
+			return
+
+		def done(response):
+			if response is None:
+				return
+			summary = json.loads(response)
+			graded = set(r['Sid'] for r in summary['Results'] if r['Graded'])
+			for view, data in zip(views, grades):
+				if data['sid'] in graded:
+					gema_close_view(view)
+			sublime.message_dialog(summary['Summary'])
+		gema_async('teacher_grades_batch', {'grades': json.dumps(grades)}, done)
+
+# ------------------------------------------------------------------
+def gema_gets(self, index, priority, key=0):
+	if index < 0 and key == 0:
+		sub = gema_take_prefetched(priority)
+		if sub is not None:
+			gema_async('teacher_opens', {'sid':sub['Sid']})
+			gema_show_submission(sub, gema_write_submission(sub))
+			gema_start_prefetch()
+			return
+	gema_async('teacher_gets', {'index':index, 'priority':priority, 'key':key},
+		lambda response: gema_open_submission(response, index, priority, key))
+
+# ------------------------------------------------------------------
+def gema_write_submission(sub):
+	dir = os.path.join(gemaFOLDER, str(sub['Sid']))
+	if not os.path.exists(dir):
+		os.mkdir(dir)
+	local_file = os.path.join(dir, sub['Filename'])
+	with open(local_file, 'w', encoding='utf-8') as fp:
+		fp.write(sub['Content'])
+	gemaORIGINALS.put(dir, sub['Content'])
+	return local_file
+
+# ------------------------------------------------------------------
+def gema_show_submission(sub, local_file):
+	if sublime.active_window().id() == 0:
+		sublime.run_command('new_window')
+	sublime.active_window().open_file(local_file)
+	if sub['Priority'] == 2:
+		sublime.message_dialog('This student asked for help.')
+
+# ------------------------------------------------------------------
+def gema_open_submission(response, index, priority, key=0):
 	if response is not None:
 		sub = json.loads(response)
 		if sub['Content'] != '':
-			filename = sub['Filename']
-			sid = str(sub['Sid'])
-			dir = os.path.join(gemaFOLDER, sid)
-			if not os.path.exists(dir):
-				os.mkdir(dir)
-			local_file = os.path.join(dir, filename)
-			with open(local_file, 'w', encoding='utf-8') as fp:
-				fp.write(sub['Content'])
-			gemaStudentSubmissions[sid] = sub['Content']
-			if sublime.active_window().id() == 0:
-				sublime.run_command('new_window')
-			sublime.active_window().open_file(local_file)
-			if sub['Priority'] == 2:
-				sublime.message_dialog('This student asked for help.')
+			gema_show_submission(sub, gema_write_submission(sub))
+			gema_start_prefetch()
+		elif key > 0:
+			sublime.message_dialog('This submission is no longer in the queue.')
 		elif priority == 0:
 			sublime.message_dialog('There are no submissions.')
 		elif priority > 0:
@@ -198,34 +727,157 @@ def gema_gets(self, index, priority):
 		elif index >= 0:
 			sublime.message_dialog('There are no submission with index {}.'.format(index))
 
+# ------------------------------------------------------------------
+# The next few submissions are claimed in the background and kept in
+# gemaPrefetched, so getting a submission opens a local file at once.
+# ------------------------------------------------------------------
+def gema_prefetch_depth():
+	try:
+		return int(gemaINFO.load().get('PrefetchDepth', gemaPrefetchDepth))
+	except ValueError:
+		return gemaPrefetchDepth
+
+# ------------------------------------------------------------------
+def gema_take_prefetched(priority):
+	with gemaPrefetchLock:
+		expired = [s for s in gemaPrefetched if time.time() - s['Fetched'] > gemaPrefetchLease]
+		for sub in expired:
+			gemaPrefetched.remove(sub)
+			gema_discard_prefetched(sub)
+		candidates = [s for s in gemaPrefetched if priority == 0 or s['Priority'] == priority]
+		if not candidates:
+			return None
+		sub = max(candidates, key=lambda s: s['Priority'])
+		gemaPrefetched.remove(sub)
+		return sub
+
+# ------------------------------------------------------------------
+def gema_start_prefetch():
+	global gemaPrefetching
+	with gemaPrefetchLock:
+		if gemaPrefetching or len(gemaPrefetched) >= gema_prefetch_depth():
+			return
+		gemaPrefetching = True
+	gemaEXECUTOR.submit('prefetch', gema_prefetch, None)
+
+# ------------------------------------------------------------------
+def gema_prefetch():
+	global gemaPrefetching
+	try:
+		while len(gemaPrefetched) < gema_prefetch_depth():
+			response = gemaRequest('teacher_gets', {'index':-1, 'priority':0, 'prefetch':1})
+			if response is None:
+				break
+			sub = json.loads(response)
+			if sub['Content'] == '':
+				break
+			if sub['Sid'] == 0:
+				# Shares of files that are not problems get no lease, so they
+				# are not held back; an older server may still hand one out.
+				local_file = gema_write_submission(sub)
+				sublime.set_timeout(functools.partial(gema_show_submission, sub, local_file), 0)
+				break
+			gema_write_submission(sub)
+			sub['Fetched'] = time.time()
+			with gemaPrefetchLock:
+				gemaPrefetched.append(sub)
+	finally:
+		with gemaPrefetchLock:
+			gemaPrefetching = False
+
+# ------------------------------------------------------------------
+def gema_put_back_prefetched():
+	with gemaPrefetchLock:
+		subs = list(gemaPrefetched)
+		del gemaPrefetched[:]
+	for sub in subs:
+		gemaRequest('teacher_puts_back', {'sid':sub['Sid'], 'prefetched':1})
+		gema_discard_prefetched(sub)
+	return len(subs)
+
+def gema_discard_prefetched(sub):
+	dir = os.path.join(gemaFOLDER, str(sub['Sid']))
+	try:
+		os.remove(os.path.join(dir, sub['Filename']))
+		os.remove(os.path.join(dir, gemaOriginalFile))
+		os.rmdir(dir)
+	except OSError:
+		pass
+
+# ------------------------------------------------------------------
+class gemaPutBackPrefetched(sublime_plugin.ApplicationCommand):
+	def run(self):
+		gemaEXECUTOR.submit('teacher_puts_back', gema_put_back_prefetched, self.done)
+
+	def done(self, n):
+		sublime.status_message('{} prefetched submission(s) put back.'.format(n))
+
+# ------------------------------------------------------------------
+class gemaSetPrefetchDepth(sublime_plugin.ApplicationCommand):
+	def run(self):
+		if sublime.active_window().id() == 0:
+			sublime.run_command('new_window')
+		sublime.active_window().show_input_panel("Number of submissions to prefetch (0 to disable).  Press Enter:",
+			str(gema_prefetch_depth()),
+			self.set,
+			None,
+			None)
+
+	def set(self, depth):
+		try:
+			depth = int(depth.strip())
+		except ValueError:
+			sublime.message_dialog("Prefetch depth must be a number.")
+			return
+		gemaINFO.update(PrefetchDepth=max(depth, 0))
+		sublime.message_dialog('Prefetch depth is set to {}.'.format(max(depth, 0)))
+
 # ------------------------------------------------------------------
 class gemaSeeQueue(sublime_plugin.ApplicationCommand):
 	def run(self):
-		response = gemaRequest('teacher_gets_queue', {})
+		gema_async('teacher_gets_queue', {'summary':1, 'since':gemaQueue['Version'], 'epoch':gemaQueue['Epoch']}, self.show)
+
+	def show(self, response):
 		if response is not None:
-			json_obj = json.loads(response)
-			if json_obj is None:
-				sublime.status_message("Queue is empty.")
+			listing = json.loads(response)
+			now = time.time()
+			for entry in listing['Entries']:
+				entry['Since'] = now - entry['WaitSeconds']
+			if listing['Full']:
+				entries = listing['Entries']
 			else:
-				users = []
-				for entry in json_obj:
-					if entry['Priority'] == 2:
-						status = '😥'
-					elif entry['Priority'] == 1:
-						status = '😎'
-					else:
-						status = ''
-					users.append( '{} {}'.format(entry['Name'], status))
-				if users:
-					sublime.active_window().active_view().show_popup_menu(users, self.request_entry)
+				removed = set(listing['Removed'])
+				entries = [e for e in gemaQueue['Entries'] if e['Key'] not in removed]
+				entries += listing['Entries']
+			gemaQueue.update(Epoch=listing.get('Epoch', 0), Version=listing['Version'], Entries=entries)
+			self.entries = list(entries)
+			users = []
+			for entry in self.entries:
+				if entry['Priority'] == 2:
+					status = '😥'
+				elif entry['Priority'] == 1:
+					status = '😎'
 				else:
-					sublime.status_message("Queue is empty.")
+					status = ''
+				users.append('{} {} {} ({})'.format(entry['Name'], status, entry['Filename'],
+					gema_wait_time(entry['Since'])))
+			if users:
+				sublime.active_window().active_view().show_popup_menu(users, self.request_entry)
+			else:
+				sublime.status_message("Queue is empty.")
 
 	# ---------------------------------------------------------
 	def request_entry(self, selected):
 		if selected < 0:
 			return
-		gema_gets(self, selected, 1)
+		gema_gets(self, -1, 1, key=self.entries[selected]['Key'])
+
+# ------------------------------------------------------------------
+def gema_wait_time(since):
+	seconds = int(time.time() - since)
+	if seconds < 60:
+		return '{}s'.format(seconds)
+	return '{}m'.format(seconds // 60)
 
 # ------------------------------------------------------------------
 # Priorities: 1 (I got it), 2 (I need help),
@@ -245,11 +897,7 @@ class gemaGetFromOk(sublime_plugin.ApplicationCommand):
 # ------------------------------------------------------------------
 class gemaSetLocalFolder(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemaFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemaINFO.load()
 		if 'Folder' not in info:
 			info['Folder'] = os.path.join(os.path.expanduser('~'), 'GEMA')
 		if sublime.active_window().id() == 0:
@@ -263,73 +911,125 @@ class gemaSetLocalFolder(sublime_plugin.ApplicationCommand):
 	def set(self, folder):
 		folder = folder.strip()
 		if len(folder) > 0:
-			try:
-				with open(gemaFILE, 'r') as f:
-					info = json.loads(f.read())
-			except:
-				info = dict()
-			info['Folder'] = folder
 			if not os.path.exists(folder):
 				try:
 					os.mkdir(folder)
-					with open(gemaFILE, 'w') as f:
-						f.write(json.dumps(info, indent=4))
+					gemaINFO.update(Folder=folder)
 				except:
 					sublime.message_dialog('Could not create {}.'.format(folder))
 			else:
-				with open(gemaFILE, 'w') as f:
-					f.write(json.dumps(info, indent=4))
+				gemaINFO.update(Folder=folder)
 				sublime.message_dialog('Folder exists. Will use it to store working files.')
 		else:
 			sublime.message_dialog("Folder name cannot be empty.")
 
 # ------------------------------------------------------------------
-class gemaConnect(sublime_plugin.ApplicationCommand):
-	def run(self):
-		try:
-			with open(gemaFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+# The course server's address from the name server is kept in info,
+# so clients start from it and refresh it in the background once it
+# is older than gemaAddressTTL, or when the server stops answering.
+# ------------------------------------------------------------------
+def gema_address_key(info):
+	return '{}|{}'.format(info.get('Server'), info.get('CourseId'))
 
-		if 'CourseId' not in info:
-			sublime.message_dialog("Please set the course id.")
-			return None
+def gema_cached_address(info):
+	if info.get('AddressFor') == gema_address_key(info):
+		return info.get('Address', ''), info.get('AddressTime', 0)
+	return '', 0
 
-		if 'Server' not in info:
-			sublime.message_dialog("Please set server address.")
-			return None
+def gema_resolve(info):
+	url = urllib.parse.urljoin(info['Server'], 'ask')
+	load = urllib.parse.urlencode({'who':info['CourseId']}).encode('utf-8')
+	server = gema_urlopen(url, load).decode(encoding="utf-8")
+	if not server.startswith('http://'):
+		return ''
+	gemaINFO.update(Address=server, AddressTime=time.time(), AddressFor=gema_address_key(info))
+	return server
 
-		global gemaSERVER
-		url = urllib.parse.urljoin(info['Server'], 'ask')
-		load = urllib.parse.urlencode({'who':info['CourseId']}).encode('utf-8')
-		req = urllib.request.Request(url, load)
-		try:
-			with urllib.request.urlopen(req, None, gemaTIMEOUT) as response:
-				server = response.read().decode(encoding="utf-8")
-				try:
-					with open(gemaFILE, 'r') as f:
-						info = json.loads(f.read())
-				except:
-					info = dict()
-				if not server.startswith('http://'):
-					sublime.message_dialog('Unable to get address.')
-					return
-				gemaSERVER = server
-				sublime.status_message('Connected')
-		except urllib.error.HTTPError as err:
-			sublime.message_dialog("{0}".format(err))
-		except urllib.error.URLError as err:
-			sublime.message_dialog("{0}\nCannot connect to server.".format(err))
+def gema_ping(server):
+	try:
+		return gema_urlopen(urllib.parse.urljoin(server, 'ping'), None, 'GET', timeout=gemaPingTIMEOUT) == b'pong'
+	except urllib.error.URLError:
+		return False
+
+def gema_refresh_address(check=False):
+	global gemaSERVER, gemaRefreshing
+	try:
+		info = gemaINFO.load()
+		if 'Server' not in info or 'CourseId' not in info:
+			return
+		address, at = gema_cached_address(info)
+		if address != '' and gemaSERVER == '':
+			gemaSERVER = address
+		if check and address != '' and time.time() - at < gemaAddressTTL and gema_ping(address):
+			return
+		server = gema_resolve(info)
+		if server != '':
+			gemaSERVER = server
+	except urllib.error.URLError as err:
+		print('Name server unavailable, keeping {}: {}'.format(gemaSERVER, err))
+	finally:
+		with gemaAddressLock:
+			gemaRefreshing = False
+
+def gema_start_refresh(check=False):
+	global gemaRefreshing
+	with gemaAddressLock:
+		if gemaRefreshing:
+			return
+		gemaRefreshing = True
+	threading.Thread(target=gema_refresh_address, args=(check,), daemon=True).start()
+
+def gema_server(info):
+	global gemaSERVER
+	address, at = gema_cached_address(info)
+	if address == '':
+		return gema_connect()
+	if gemaSERVER == '':
+		gemaSERVER = address
+	if time.time() - at > gemaAddressTTL:
+		gema_start_refresh()
+	return True
+
+# ------------------------------------------------------------------
+def gema_connect():
+	global gemaSERVER
+	info = gemaINFO.load()
+
+	if 'CourseId' not in info:
+		gema_message("Please set the course id.")
+		return False
+
+	if 'Server' not in info:
+		gema_message("Please set server address.")
+		return False
+
+	try:
+		server = gema_resolve(info)
+		if server == '':
+			gema_message('Unable to get address.')
+			return False
+		gemaSERVER = server
+		sublime.status_message('Connected')
+		return True
+	except urllib.error.HTTPError as err:
+		gema_message("{0}".format(err))
+	except urllib.error.URLError as err:
+		address, _ = gema_cached_address(info)
+		if address != '' and gema_ping(address):
+			gemaSERVER = address
+			sublime.status_message('Name server unavailable. Connected to {}'.format(address))
+			return True
+		gema_message("{0}\nCannot connect to server.".format(err))
+	return False
+
+class gemaConnect(sublime_plugin.ApplicationCommand):
+	def run(self):
+		gemaEXECUTOR.submit('connect', gema_connect)
 
 # ------------------------------------------------------------------
 class gemaCompleteRegistration(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemaFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemaINFO.load()
 
 		if 'CourseId' not in info:
 			sublime.message_dialog('Please enter course id.')
@@ -339,11 +1039,14 @@ class gemaCompleteRegistration(sublime_plugin.ApplicationCommand):
 			sublime.message_dialog('Please enter assigned username.')
 			return
 
-		response = gemaRequest(
+		gema_async(
 			'complete_registration',
 			{'role':'teacher', 'name':info['Name'], 'course_id':info['CourseId']},
+			lambda response: self.done(response, info),
 			authenticated=False,
 		)
+
+	def done(self, response, info):
 		if response is None:
 			sublime.message_dialog('Response is None. Failed to complete registration.')
 			return
@@ -352,20 +1055,13 @@ class gemaCompleteRegistration(sublime_plugin.ApplicationCommand):
 			sublime.message_dialog('Failed to complete registration.')
 		else:
 			uid, password = response.split(',')
-			info['Uid'] = int(uid)
-			info['Password'] = password.strip()
+			gemaINFO.update(Uid=int(uid), Password=password.strip())
 			sublime.message_dialog('{} is registered.'.format(info['Name']))
-		with open(gemaFILE, 'w') as f:
-			f.write(json.dumps(info, indent=4))
 
 # ------------------------------------------------------------------
 class gemaSetServerAddress(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemaFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemaINFO.load()
 		if 'Server' not in info:
 			info['Server'] = ''
 		if sublime.active_window().id() == 0:
@@ -379,27 +1075,16 @@ class gemaSetServerAddress(sublime_plugin.ApplicationCommand):
 	def set(self, addr):
 		addr = addr.strip()
 		if len(addr) > 0:
-			try:
-				with open(gemaFILE, 'r') as f:
-					info = json.loads(f.read())
-			except:
-				info = dict()
 			if not addr.startswith('http://'):
 				addr = 'http://' + addr
-			info['Server'] = addr
-			with open(gemaFILE, 'w') as f:
-				f.write(json.dumps(info, indent=4))
+			gemaINFO.update(Server=addr)
 		else:
 			sublime.message_dialog("Server address cannot be empty.")
 
 # ------------------------------------------------------------------
 class gemaSetCourseId(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemaFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemaINFO.load()
 		if 'CourseId' not in info:
 			info['CourseId'] = ''
 		if sublime.active_window().id() == 0:
@@ -413,14 +1098,7 @@ class gemaSetCourseId(sublime_plugin.ApplicationCommand):
 	def set(self, cid):
 		cid = cid.strip()
 		if len(cid) > 0:
-			try:
-				with open(gemaFILE, 'r') as f:
-					info = json.loads(f.read())
-			except:
-				info = dict()
-			info['CourseId'] = cid
-			with open(gemaFILE, 'w') as f:
-				f.write(json.dumps(info, indent=4))
+			gemaINFO.update(CourseId=cid)
 			sublime.message_dialog('Course id is set to ' + cid)
 		else:
 			sublime.message_dialog("Course id cannot be empty.")
@@ -428,11 +1106,7 @@ class gemaSetCourseId(sublime_plugin.ApplicationCommand):
 # ------------------------------------------------------------------
 class gemaSetName(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemaFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemaINFO.load()
 		if 'Name' not in info:
 			info['Name'] = ''
 		if sublime.active_window().id() == 0:
@@ -446,14 +1120,7 @@ class gemaSetName(sublime_plugin.ApplicationCommand):
 	def set(self, name):
 		name = name.strip()
 		if len(name) > 0:
-			try:
-				with open(gemaFILE, 'r') as f:
-					info = json.loads(f.read())
-			except:
-				info = dict()
-			info['Name'] = name
-			with open(gemaFILE, 'w') as f:
-				f.write(json.dumps(info, indent=4))
+			gemaINFO.update(Name=name)
 			sublime.message_dialog('Assigned name is set to ' + name)
 		else:
 			sublime.message_dialog("Name cannot be empty.")
@@ -490,5 +1157,12 @@ class gemaUpdate(sublime_plugin.WindowCommand):
 			sublime.message_dialog("GEM has been updated to version %s." % version)
 
 # ------------------------------------------------------------------
+def plugin_loaded():
+	gema_start_refresh(check=True)
 
+# ------------------------------------------------------------------
+def plugin_unloaded():
+	gema_put_back_prefetched()
+	gemaEXECUTOR.shutdown()
 
+# ------------------------------------------------------------------
@@ -4,23 +4,56 @@
 import sublime, sublime_plugin
 import urllib.parse
 import urllib.request
+import http.client
+import threading
+import functools
+import queue
+import collections
+import socket
+import select
+import gzip
 import os
 import json
+import hashlib
+import difflib
+import uuid
 import time
 import random
 import shutil
 import datetime
 import webbrowser
 
-gemsUpdateIntervalLong  = 20000		# Update interval
-gemsUpdateIntervalShort = 10000		# When submission is being looked at
+gemsUpdateInterval = 10			# Seconds between polls, until the server advises otherwise
+gemsUpdateIntervalMax = 60		# Polls back off up to this while nothing changes
+gemsUpdateJitter = 0.2			# Spread polls of a class by +/- 20%
 gemsFILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "info")
+gemsOUTBOX_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "outbox")
+gemsLEDGER_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "ledger")
+gemsOutboxDelay = 5			# First retry of a saved submission, doubling up to
+gemsOutboxDelayMax = 300		# this many seconds
 gemsFOLDER = ''
 gemsTIMEOUT = 7
+gemsStatsWindow = 500		# Requests per endpoint kept for connection stats
+gemsWaitTIMEOUT = 60		# student_waits_update is held up to 45 seconds
+gemsMaxIdleConnections = 4
+gemsConnections = {}
+gemsConnectionsLock = threading.Lock()
+gemsFeatures = {}
+gemsCompressMin = 512
+gemsCompressPaths = ('/student_shares',)
+gemsIdempotentPaths = ('/ask', '/ping', '/student_gets_report')	# safe to send again after any connection failure
+gemsWorkers = 4
+gemsSpinner = ['-', '\\', '|', '/']
 gemsAnswerTag = 'ANSWER:'
 gemsTracking = False
+gemsBoardsVersion = 0
 gemsSERVER = ''
-gemsSERVER_TIME = 0
+gemsAddressTTL = 5400		# Seconds before the course server's address is resolved again
+gemsPingTIMEOUT = 3
+gemsAddressLock = threading.Lock()
+gemsRefreshing = False
+gemsArchives = {}
+gemsLastShared = {}
 gemsConnected = False
 gemsUpdateMessage = {
 	1 : "Your submission is being looked at.",
@@ -32,14 +65,17 @@ gemsUpdateMessage = {
 # ------------------------------------------------------------------
 class gemsAttendanceReport(sublime_plugin.ApplicationCommand):
 	def run(self):
-		response = gemsRequest('student_checks_in', {})
+		gems_async('student_checks_in', {}, self.show)
+
+	def show(self, response):
+		if response is None:
+			return
 		json_obj = json.loads(response)
 		dates = set()
 		for d in json_obj:
 			dates.add(datetime.datetime.fromtimestamp(d).strftime('%Y-%m-%d'))
 
-		with open(gemsFILE, 'r') as f:
-			info = json.loads(f.read())
+		info = gemsINFO.load()
 		report_file = os.path.join(info['Folder'], 'Attendance.txt')
 		with open(report_file, 'w', encoding='utf-8') as f:
 			f.write('Your attendance was taken on these dates:\n')
@@ -51,40 +87,168 @@ class gemsAttendanceReport(sublime_plugin.ApplicationCommand):
 # ------------------------------------------------------------------
 class gemsPointsReport(sublime_plugin.ApplicationCommand):
 	def run(self):
-		response = gemsRequest('student_gets_report', {})
-		if response != None:
-			json_obj = json.loads(response)
-			report = {}
-			total_points = 0
-			for i in json_obj:
-				Date, Points, Filename = i['Date'], i['Points'], i['Filename']
-				if Date not in report:
-					report[Date] = []
-				if '.' in Filename:
-					prefix, ext = Filename.rsplit('.',1)
-				else:
-					prefix = Filename
-				report[Date].append((Points,prefix))
-				total_points += Points
-
-			with open(gemsFILE, 'r') as f:
-				info = json.loads(f.read())
-			report_file = os.path.join(info['Folder'], 'Points.txt')
-			with open(report_file, 'w', encoding='utf-8') as f:
-				f.write('Total points: {}\n'.format(total_points))
-				for d,v in reversed(sorted(report.items())):
-					date = datetime.datetime.fromtimestamp(d).strftime('%Y-%m-%d')
-					for entry in v:
-						f.write('{}\t{}\t{}\n'.format(date,entry[0],entry[1]))
+		gemsEXECUTOR.submit('student_gets_report', gems_sync_points, self.show)
 
-			sublime.run_command('new_window')
-			sublime.active_window().open_file(report_file)
+	def show(self, scores):
+		if scores is None:
+			return
+		report = {}
+		total_points = 0
+		for i in scores:
+			Date, Points, Filename = i['Date'], i['Points'], i['Filename']
+			if Date not in report:
+				report[Date] = []
+			if '.' in Filename:
+				prefix, ext = Filename.rsplit('.',1)
+			else:
+				prefix = Filename
+			report[Date].append((Points,prefix))
+			total_points += Points
+
+		info = gemsINFO.load()
+		report_file = os.path.join(info['Folder'], 'Points.txt')
+		with open(report_file, 'w', encoding='utf-8') as f:
+			f.write('Total points: {}\n'.format(total_points))
+			for d,v in reversed(sorted(report.items())):
+				date = datetime.datetime.fromtimestamp(d).strftime('%Y-%m-%d')
+				for entry in v:
+					f.write('{}\t{}\t{}\n'.format(date,entry[0],entry[1]))
+
+		sublime.run_command('new_window')
+		sublime.active_window().open_file(report_file)
+
+# ------------------------------------------------------------------
+# Scores are kept in a local ledger file; each report only fetches
+# scores changed since the previous one. (Sublime's Python does not
+# ship with sqlite3, so the ledger is a JSON file.)
+# ------------------------------------------------------------------
+class gemsLedger:
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+
+	def load(self, owner):
+		try:
+			with open(self.path, 'r', encoding='utf-8') as f:
+				ledger = json.loads(f.read())
+			if ledger.get('For') == owner:
+				return ledger
+		except (OSError, ValueError):
+			pass
+		return dict(For=owner, Since=0, Scores={})
+
+	def save(self, ledger):
+		tmp = '{}.{}.tmp'.format(self.path, threading.get_ident())
+		with open(tmp, 'w', encoding='utf-8') as f:
+			f.write(json.dumps(ledger))
+		os.replace(tmp, self.path)
+
+	def sync(self, owner, changes):
+		with self.lock:
+			ledger = self.load(owner)
+			for score in changes['Scores']:
+				ledger['Scores'][str(score['Id'])] = score
+			ledger['Since'] = changes['Now']
+			self.save(ledger)
+			return list(ledger['Scores'].values())
+
+gemsLEDGER = gemsLedger(gemsLEDGER_FILE)
+
+def gems_sync_points():
+	info = gemsINFO.load()
+	owner = '{}|{}'.format(gems_address_key(info), info.get('Uid'))
+	since = gemsLEDGER.load(owner)['Since']
+	response = gemsRequest('student_gets_report', dict(since=since))
+	if response is None:
+		return None
+	changes = json.loads(response)
+	if not isinstance(changes, dict):
+		return changes		# server without incremental reports
+	return gemsLEDGER.sync(owner, changes)
+
+# ------------------------------------------------------------------
+# Polling intervals back off exponentially while nothing changes, are
+# jittered per client, and never exceed the interval advised by the server.
+# ------------------------------------------------------------------
+class gemsPollScheduler:
+	def __init__(self, base, maximum, jitter):
+		self.base = base
+		self.maximum = maximum
+		self.jitter = jitter
+		self.interval = base
+
+	def next_delay(self, changed, advised=None, retry_after=None):
+		cap = self.maximum if advised is None else advised		# e.g. 5s while being graded
+		if changed:
+			self.interval = self.base
+		else:
+			self.interval = self.interval * 2
+		self.interval = min(self.interval, cap)
+		delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+		if retry_after is not None:
+			delay = max(delay, retry_after)
+		return int(delay * 1000)
+
+gemsPoll = gemsPollScheduler(gemsUpdateInterval, gemsUpdateIntervalMax, gemsUpdateJitter)
+
+# ------------------------------------------------------------------
+def gems_header_seconds(headers, name):
+	try:
+		return max(0, int(headers[name]))
+	except (KeyError, ValueError):
+		return None
+
+# ------------------------------------------------------------------
+def gems_show_update(submission_stat, board_stat):
+	mesg = ""
+	if submission_stat > 0 and submission_stat in gemsUpdateMessage:
+		mesg = gemsUpdateMessage[submission_stat]
+	if board_stat == 1:
+		mesg += "\nTeacher placed new material on your board."
+	mesg = mesg.strip()
+	if mesg != "":
+		sublime.set_timeout(lambda: sublime.message_dialog(mesg), 0)
+
+# ------------------------------------------------------------------
+# Subscribe to updates: the server holds each request until something
+# changes. Network errors and 5xx replies subscribe again after a
+# backoff; fall back to polling when the server does not support it.
+# ------------------------------------------------------------------
+def gems_wait_updates():
+	global gemsTracking, gemsBoardsVersion
+	while gemsTracking:
+		try:
+			response = gemsRequest('student_waits_update', {'version':gemsBoardsVersion},
+				verbal=False, timeout=gemsWaitTIMEOUT, raise_network_errors=True)
+		except urllib.error.URLError as err:
+			delay = gemsPoll.next_delay(False)
+			print('Update subscription failed ({}). Subscribing again in {}s.'.format(err, delay // 1000))
+			time.sleep(delay / 1000.0)
+			continue
+		try:
+			submission_stat, board_stat, version = [int(v) for v in response.split(';')]
+		except (AttributeError, ValueError):
+			# None is a 4xx reply, e.g. 404 from a server without the endpoint.
+			print('Update subscription unavailable. Checking periodically.')
+			sublime.set_timeout_async(gems_periodic_update, gemsPoll.next_delay(True))
+			return
+		gemsPoll.next_delay(True)	# reset the backoff
+		if version == gemsBoardsVersion:
+			board_stat = 0		# material on the board was already announced
+		# A lower version means the server restarted and counts anew.
+		gemsBoardsVersion = version
+		gems_show_update(submission_stat, board_stat)
 
 # ------------------------------------------------------------------
 def gems_periodic_update():
 	global gemsTracking
-	response = gemsRequest('student_periodic_update', {}, verbal=False)
+	headers = {}
+	response = gemsRequest('student_periodic_update', {}, verbal=False, response_headers=headers)
+	retry_after = gems_header_seconds(headers, 'retry-after')
 	if response is None:
+		if retry_after is not None:
+			sublime.set_timeout_async(gems_periodic_update, gemsPoll.next_delay(False, None, retry_after))
+			return
 		print('Response is None. Stop tracking.')
 		gemsTracking = False
 		return
@@ -94,14 +258,7 @@ def gems_periodic_update():
 		board_stat = int(board_stat)
 
 		# Display messages if necessary
-		mesg = ""
-		if submission_stat > 0 and submission_stat in gemsUpdateMessage:
-			mesg = gemsUpdateMessage[submission_stat]
-		if board_stat == 1:
-			mesg += "\nTeacher placed new material on your board."
-		mesg = mesg.strip()
-		if mesg != "":
-			sublime.message_dialog(mesg)
+		gems_show_update(submission_stat, board_stat)
 
 		# Open board pages and feedback automatically
 		# if board_stat == 1:
@@ -110,9 +267,9 @@ def gems_periodic_update():
 		# 	sublime.active_window().run_command('gems_get_board_content')
 
 		# Keep checking periodically
-		update_timeout = gemsUpdateIntervalLong
-		if submission_stat == 1:
-			update_timeout = gemsUpdateIntervalShort
+		changed = submission_stat > 0 or board_stat == 1
+		advised = gems_header_seconds(headers, 'x-poll-interval')
+		update_timeout = gemsPoll.next_delay(changed, advised, retry_after)
 		# print('checking', submission_stat, board_stat, update_timeout)
 		sublime.set_timeout_async(gems_periodic_update, update_timeout)
 	except:
@@ -120,7 +277,6 @@ def gems_periodic_update():
 
 # ------------------------------------------------------------------
 def gems_share(self, edit, priority):
-	global gemsTracking
 	fname = self.view.file_name()
 	if fname is None:
 		sublime.message_dialog('Cannot share unsaved content.')
@@ -132,16 +288,163 @@ def gems_share(self, edit, priority):
 	else:
 		answer = ''
 	data = dict(
-		content=content,
 		answer=answer,
 		filename=os.path.basename(fname),
 		priority=priority,
+		key=uuid.uuid4().hex,
 	)
-	response = gemsRequest('student_shares', data)
+	gemsEXECUTOR.submit('student_shares', lambda: gems_upload(data, content), gems_shared)
+
+# ------------------------------------------------------------------
+# Resubmissions are sent as line deltas against the last accepted
+# submission of the same file, when the server supports it. If the
+# server's copy does not match, the full content is sent instead.
+# ------------------------------------------------------------------
+def gems_hash(content):
+	return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def gems_lines(text):
+	lines = [line + '\n' for line in text.split('\n')]
+	lines[-1] = lines[-1][:-1]
+	if lines[-1] == '':
+		lines.pop()
+	return lines
+
+def gems_delta(base, content):
+	a, b = gems_lines(base), gems_lines(content)
+	ops = []
+	for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+		if tag == 'equal':
+			ops.append(['=', i2 - i1])
+			continue
+		if i2 > i1:
+			ops.append(['-', i2 - i1])
+		if j2 > j1:
+			ops.append(['+', ''.join(b[j1:j2])])
+	return ops
+
+def gems_server_features():
+	parts = urllib.parse.urlsplit(gemsSERVER)
+	return gemsFeatures.get((parts.hostname, parts.port or 80), ())
+
+def gems_upload(data, content):
+	try:
+		return gems_send(data, content)
+	except urllib.error.URLError as err:
+		gemsOUTBOX.add(dict(data, content=content))
+		return 'The server cannot be reached ({}).\nYour submission is saved and will be sent automatically.'.format(err.reason)
+
+def gems_send(data, content):
+	filename = data['filename']
+	base = gemsLastShared.get(filename)
+	if base is not None and 'delta' in gems_server_features():
+		delta = json.dumps(gems_delta(base, content))
+		if len(delta) < len(content):
+			headers = {}
+			response = gemsRequest('student_shares', dict(data, delta=delta,
+				base_hash=gems_hash(base), content_hash=gems_hash(content)), response_headers=headers,
+				raise_network_errors=True)
+			if response is None:
+				return None
+			if headers.get('x-gem-delta') != 'mismatch':
+				gemsLastShared[filename] = content
+				return response
+	response = gemsRequest('student_shares', dict(data, content=content), raise_network_errors=True)
+	if response is not None:
+		gemsLastShared[filename] = content
+	return response
+
+# ------------------------------------------------------------------
+# Submissions that could not reach the server are kept in the outbox
+# file and retried with backoff. A newer submission of the same file
+# replaces a pending one. The key lets the server drop duplicates.
+# ------------------------------------------------------------------
+class gemsOutbox:
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+		self.entries = self.load()
+		self.running = False
+		self.stopped = False
+
+	def load(self):
+		try:
+			with open(self.path, 'r', encoding='utf-8') as f:
+				return json.loads(f.read())
+		except (OSError, ValueError):
+			return []
+
+	def save(self):
+		tmp = '{}.{}.tmp'.format(self.path, threading.get_ident())
+		with open(tmp, 'w', encoding='utf-8') as f:
+			f.write(json.dumps(self.entries))
+		os.replace(tmp, self.path)
+
+	def add(self, data):
+		with self.lock:
+			self.entries = [e for e in self.entries if e['Data']['filename'] != data['filename']]
+			self.entries.append(dict(Data=data, Attempts=0, Next=time.time() + gemsOutboxDelay))
+			self.save()
+		self.start()
+
+	def start(self):
+		with self.lock:
+			if self.running or not self.entries:
+				return
+			self.running, self.stopped = True, False
+		threading.Thread(target=self.run, daemon=True).start()
+
+	def stop(self):
+		self.stopped = True
+
+	def run(self):
+		while not self.stopped:
+			with self.lock:
+				if not self.entries:
+					self.running = False
+					return
+				entry = min(self.entries, key=lambda e: e['Next'])
+			delay = entry['Next'] - time.time()
+			if delay > 0:
+				time.sleep(min(delay, 1))
+				continue
+			data = dict(entry['Data'])
+			retry = False
+			try:
+				response = gemsRequest('student_shares', data, verbal=False, raise_network_errors=True)
+			except urllib.error.URLError:
+				response, retry = None, True		# unreachable, or a 5xx reply
+			with self.lock:
+				if retry:
+					entry['Attempts'] += 1
+					backoff = min(gemsOutboxDelayMax, gemsOutboxDelay * 2 ** entry['Attempts'])
+					entry['Next'] = time.time() + backoff * random.uniform(0.8, 1.2)
+				elif entry in self.entries:
+					self.entries.remove(entry)
+				self.save()
+			if retry:
+				continue
+			if response is not None:
+				gemsLastShared[data['filename']] = entry['Data']['content']
+				mesg = 'Your saved submission of {} was sent.\n{}'.format(data['filename'], response)
+				sublime.set_timeout(functools.partial(gems_shared, mesg), 0)
+			else:
+				# Rejected (4xx) or not sendable as things are set up; retrying will not help.
+				gems_message('Your saved submission of {} could not be sent and was discarded. Please share it again.'.format(data['filename']))
+		with self.lock:
+			self.running = False
+
+gemsOUTBOX = gemsOutbox(gemsOUTBOX_FILE)
+
+# ------------------------------------------------------------------
+def gems_shared(response):
+	global gemsTracking
+	if response is None:
+		return
 	sublime.message_dialog(response)
 	if gemsTracking==False:
 		gemsTracking = True
-		sublime.set_timeout_async(gems_periodic_update, 5000)
+		threading.Thread(target=gems_wait_updates, daemon=True).start()
 
 # ------------------------------------------------------------------
 class gemsNeedHelp(sublime_plugin.TextCommand):
@@ -153,84 +456,516 @@ class gemsGotIt(sublime_plugin.TextCommand):
 	def run(self, edit):
 		gems_share(self, edit, priority=1)
 
+# ------------------------------------------------------------------
+def gems_write_file(path, content):
+	tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+	with open(tmp, 'w', encoding='utf-8') as f:
+		f.write(content)
+	os.replace(tmp, path)
+
+# ------------------------------------------------------------------
+def gems_hash_file(path):
+	h = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(65536), b''):
+			h.update(chunk)
+	return h.hexdigest()
+
+# ------------------------------------------------------------------
+# Every archived version is kept once in OLD/objects, named by its hash.
+# OLD/index.json lists the versions of each filename, oldest first.
+# ------------------------------------------------------------------
+class gemsArchive:
+	def __init__(self, folder):
+		self.dir = os.path.join(folder, 'OLD')
+		self.objects = os.path.join(self.dir, 'objects')
+		self.index_file = os.path.join(self.dir, 'index.json')
+		self.lock = threading.RLock()
+
+	def load(self):
+		try:
+			with open(self.index_file, 'r', encoding='utf-8') as f:
+				return json.loads(f.read())
+		except (OSError, ValueError):
+			return {}
+
+	def save(self, index):
+		tmp = '{}.{}.tmp'.format(self.index_file, threading.get_ident())
+		with open(tmp, 'w', encoding='utf-8') as f:
+			f.write(json.dumps(index, indent=4))
+		os.replace(tmp, self.index_file)
+
+	def add(self, path, filename):
+		with self.lock:
+			os.makedirs(self.objects, exist_ok=True)
+			digest = gems_hash_file(path)
+			obj = os.path.join(self.objects, digest)
+			if os.path.exists(obj):
+				os.remove(path)
+			else:
+				os.replace(path, obj)
+			index = self.load()
+			versions = index.setdefault(filename, [])
+			if not versions or versions[-1]['Hash'] != digest:
+				versions.append(dict(Hash=digest, At=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+				self.save(index)
+			return digest
+
+	def versions(self, filename):
+		return self.load().get(filename, [])
+
+	def restore(self, filename, digest, path):
+		with self.lock:
+			if os.path.exists(path):
+				if gems_hash_file(path) == digest:
+					return
+				self.add(path, filename)
+			tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+			shutil.copyfile(os.path.join(self.objects, digest), tmp)
+			os.replace(tmp, path)
+
+def gems_archive(folder):
+	if folder not in gemsArchives:
+		gemsArchives[folder] = gemsArchive(folder)
+	return gemsArchives[folder]
+
+# ------------------------------------------------------------------
+# Boards are written off the UI thread. Existing files are archived
+# by renaming them into OLD, never by copying them through memory.
+# Files whose content is unchanged are left alone.
+# ------------------------------------------------------------------
+def gems_write_boards(boards):
+	feedback_dir = os.path.join(gemsFOLDER, 'FEEDBACK')
+	os.makedirs(feedback_dir, exist_ok=True)
+	archive = gems_archive(gemsFOLDER)
+
+	files, feedback, archived = [], 0, []
+	for board in boards:
+		filename = board['Filename']
+		if board['Type'] == 'feedback':
+			local_file = os.path.join(feedback_dir, filename)
+			feedback += 1
+		else:
+			local_file = os.path.join(gemsFOLDER, filename)
+			if os.path.exists(local_file):
+				encoded = board['Content'].replace('\n', os.linesep).encode('utf-8')
+				if gems_hash_file(local_file) == hashlib.sha1(encoded).hexdigest():
+					if local_file not in files:
+						files.append(local_file)
+					continue
+				archive.add(local_file, filename)
+				archived.append(filename)
+		gems_write_file(local_file, board['Content'])
+		if local_file not in files:
+			files.append(local_file)
+	return files, feedback, archived
+
 # ------------------------------------------------------------------
 class gemsGetBoardContent(sublime_plugin.ApplicationCommand):
 	def run(self):
+		gemsEXECUTOR.submit('student_gets', self.fetch, self.open)
+
+	def fetch(self):
 		response = gemsRequest('student_gets', {})
 		if response is None:
+			return None
+		boards = json.loads(response)
+		if not boards:
+			return [], 0, []
+		return gems_write_boards(boards)
+
+	def open(self, result):
+		if result is None:
 			return
-		json_obj = json.loads(response)
-		if json_obj == []:
+		files, feedback, archived = result
+		if not files:
 			sublime.message_dialog("Whiteboard is empty.")
 			return
+		if sublime.active_window().id() == 0:
+			sublime.run_command('new_window')
+		window = sublime.active_window()
+		for local_file in files:
+			window.open_file(local_file)
 
-		feedback_dir = os.path.join(gemsFOLDER, 'FEEDBACK')
-		if not os.path.exists(feedback_dir):
-			os.mkdir(feedback_dir)
-		old_dir = os.path.join(gemsFOLDER, 'OLD')
-		if not os.path.exists(old_dir):
-			os.mkdir(old_dir)
-
-		for board in json_obj:
-			content = board['Content']
-			filename = board['Filename']
-			mesg = ''
-			if board['Type'] == 'feedback':
-				local_file = os.path.join(feedback_dir, filename)
-				mesg = 'Teacher has some feedback for you.'
-			else:
-				local_file = os.path.join(gemsFOLDER, filename)
-				if os.path.exists(local_file):
-					with open(local_file) as f:
-						moved_file = os.path.join(old_dir, filename)
-						with open(moved_file, 'w', encoding='utf-8') as newf:
-							newf.write(f.read())
-					mesg = 'Move existing file, {}, to {}.'.format(filename,old_dir)
-			with open(local_file, 'w', encoding='utf-8') as f:
-				f.write(content)
-			if sublime.active_window().id() == 0:
-				sublime.run_command('new_window')
-			sublime.active_window().open_file(local_file)
-			if mesg != '':
-				sublime.message_dialog(mesg)
+		mesg = []
+		if feedback > 0:
+			mesg.append('Teacher has some feedback for you.')
+		if archived:
+			mesg.append('Archived existing file(s), {}. Use "Restore an archived file" to get them back.'.format(
+				', '.join(archived)))
+		if mesg:
+			sublime.message_dialog('\n'.join(mesg))
+		else:
+			sublime.status_message('{} file(s) from your white board.'.format(len(files)))
+
+# ------------------------------------------------------------------
+class gemsRestoreArchived(sublime_plugin.WindowCommand):
+	def run(self):
+		folder = gemsINFO.load().get('Folder')
+		if folder is None:
+			sublime.message_dialog("Please set a local folder for keeping working files.")
+			return
+		self.archive = gems_archive(folder)
+		self.folder = folder
+		self.filenames = sorted(self.archive.load())
+		if not self.filenames:
+			sublime.message_dialog('There are no archived files.')
+			return
+		self.window.show_quick_panel(self.filenames, self.pick_file)
+
+	def pick_file(self, index):
+		if index < 0:
+			return
+		self.filename = self.filenames[index]
+		self.versions = list(reversed(self.archive.versions(self.filename)))
+		items = [[v['At'], v['Hash'][:10]] for v in self.versions]
+		sublime.set_timeout(lambda: self.window.show_quick_panel(items, self.pick_version), 0)
+
+	def pick_version(self, index):
+		if index < 0:
+			return
+		local_file = os.path.join(self.folder, self.filename)
+		self.archive.restore(self.filename, self.versions[index]['Hash'], local_file)
+		self.window.open_file(local_file)
+		sublime.status_message('Restored {} from {}.'.format(self.filename, self.versions[index]['At']))
 
 # ------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------
 # These functionalities below are identical to those of teachers
 # ------------------------------------------------------------------------------
-# ------------------------------------------------------------------------------
-def gemsRequest(path, data, authenticated=True, method='POST', verbal=True):
-	global gemsFOLDER, gemsSERVER, gemsSERVER_TIME
+# ------------------------------------------------------------------
+# The info file, cached in memory and revalidated by mtime/size.
+# Writes go to a temporary file that is renamed over the original.
+# ------------------------------------------------------------------
+class gemsInfoFile:
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.RLock()
+		self.stamp = None
+		self.info = {}
 
+	def refresh(self):
+		try:
+			st = os.stat(self.path)
+		except OSError:
+			self.stamp, self.info = None, {}
+			return
+		stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+		if stamp != self.stamp:
+			try:
+				with open(self.path, 'r') as f:
+					self.info = json.loads(f.read())
+			except ValueError:
+				self.info = {}
+			self.stamp = stamp
+
+	def load(self):
+		with self.lock:
+			self.refresh()
+			return dict(self.info)
+
+	def save(self, info):
+		with self.lock:
+			tmp = '{}.{}.tmp'.format(self.path, threading.get_ident())
+			with open(tmp, 'w') as f:
+				f.write(json.dumps(info, indent=4))
+			os.replace(tmp, self.path)
+			st = os.stat(self.path)
+			self.info = dict(info)
+			self.stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+
+	def update(self, **changes):
+		with self.lock:
+			self.refresh()
+			info = dict(self.info)
+			info.update(changes)
+			self.save(info)
+			return info
+
+gemsINFO = gemsInfoFile(gemsFILE)
+
+# ------------------------------------------------------------------
+# Persistent HTTP/1.1 connections, kept idle per server and reused.
+# ------------------------------------------------------------------
+def gems_checkout_connection(server, timeout):
+	with gemsConnectionsLock:
+		idle = gemsConnections.get(server, [])
+		while idle:
+			conn = idle.pop()
+			if conn.sock is None or select.select([conn.sock], [], [], 0)[0]:
+				conn.close()		# closed by the server while idle
+				continue
+			conn.timeout = timeout
+			conn.sock.settimeout(timeout)
+			return conn, True
+	conn = http.client.HTTPConnection(server[0], server[1], timeout=timeout)
+	conn.connect()
+	conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	return conn, False
+
+def gems_checkin_connection(server, conn):
+	with gemsConnectionsLock:
+		idle = gemsConnections.setdefault(server, [])
+		if len(idle) < gemsMaxIdleConnections:
+			idle.append(conn)
+			return
+	conn.close()
+
+def gems_urlopen(url, load=None, method='POST', timeout=gemsTIMEOUT, response_headers=None, request_id=None):
+	trace = dict(Id=request_id or gems_request_id(), Start=time.time(), Sent=0, Received=0)
+	outcome = 'error'
 	try:
-		with open(gemsFILE, 'r') as f:
-			info = json.loads(f.read())
-	except:
-		info = dict()
+		body = gems_exchange(url, load, method, timeout, response_headers, trace)
+		outcome = 'ok'
+		return body
+	except urllib.error.HTTPError as err:
+		outcome = str(err.code)
+		raise
+	finally:
+		trace['Total'] = time.time() - trace['Start']
+		trace['Outcome'] = outcome
+		gemsSTATS.add(urllib.parse.urlsplit(url).path.strip('/'), trace)
+
+def gems_exchange(url, load, method, timeout, response_headers, trace):
+	parts = urllib.parse.urlsplit(url)
+	server = (parts.hostname, parts.port or 80)
+	path = parts.path or '/'
+	if parts.query:
+		path += '?' + parts.query
+	headers = {'Connection': 'keep-alive', 'Accept-Encoding': 'gzip', 'X-Gem-Request-Id': trace['Id']}
+	if load is not None:
+		headers['Content-Type'] = 'application/x-www-form-urlencoded'
+		# Only servers that advertised gzip get compressed request bodies.
+		if path in gemsCompressPaths and len(load) >= gemsCompressMin and 'gzip' in gemsFeatures.get(server, ()):
+			load = gzip.compress(load)
+			headers['Content-Encoding'] = 'gzip'
+		trace['Sent'] = len(load)
+	while True:
+		try:
+			conn, reused = gems_checkout_connection(server, timeout)
+		except OSError as err:
+			raise urllib.error.URLError(err)
+		sent = False
+		try:
+			conn.request(method, path, load, headers)
+			sent = True
+			response = conn.getresponse()
+			trace['FirstByte'] = time.time() - trace['Start']
+			body = response.read()
+			trace['Received'] = len(body)
+		except (http.client.BadStatusLine, ConnectionError) as err:
+			conn.close()
+			# A request that was not sent in full cannot have been applied.
+			# Once sent, it may have been, so only requests that change
+			# nothing are sent again.
+			if reused and (not sent or parts.path in gemsIdempotentPaths):
+				continue
+			raise urllib.error.URLError(err)
+		except (http.client.HTTPException, OSError) as err:
+			conn.close()
+			raise urllib.error.URLError(err)
+		if response.will_close:
+			conn.close()
+		else:
+			gems_checkin_connection(server, conn)
+		features = response.getheader('X-Gem-Features')
+		if features is not None:
+			gemsFeatures[server] = features.split(',')
+		if response.getheader('Content-Encoding') == 'gzip':
+			body = gzip.decompress(body)
+		if response_headers is not None:
+			response_headers.update((k.lower(), v) for k, v in response.getheaders())
+		if response.status >= 400:
+			raise urllib.error.HTTPError(url, response.status, response.reason, response.msg, None)
+		return body
+
+# ------------------------------------------------------------------
+# Network requests run on a small pool of worker threads so that the
+# editor stays responsive. Callbacks are run on the UI thread.
+# ------------------------------------------------------------------
+class gemsTask:
+	def __init__(self, label, fn, callback):
+		self.label = label
+		self.fn = fn
+		self.callback = callback
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+class gemsExecutor:
+	def __init__(self, workers):
+		self.workers = workers
+		self.threads = []
+		self.tasks = queue.Queue()
+		self.pending = []
+		self.lock = threading.Lock()
+		self.ticking = False
+		self.frame = 0
+
+	def submit(self, label, fn, callback=None):
+		task = gemsTask(label, fn, callback)
+		with self.lock:
+			if len(self.threads) < self.workers:
+				t = threading.Thread(target=self.work, daemon=True)
+				self.threads.append(t)
+				t.start()
+			self.pending.append(task)
+			start_ticking, self.ticking = not self.ticking, True
+		self.tasks.put(task)
+		if start_ticking:
+			sublime.set_timeout(self.show_progress, 0)
+		return task
+
+	def work(self):
+		while True:
+			task = self.tasks.get()
+			if task is None:
+				return
+			result = None
+			if not task.cancelled:
+				try:
+					result = task.fn()
+				except Exception as err:
+					print('{} failed: {}'.format(task.label, err))
+			with self.lock:
+				self.pending.remove(task)
+			if task.callback is not None and not task.cancelled:
+				sublime.set_timeout(functools.partial(self.finish, task, result), 0)
+
+	def finish(self, task, result):
+		if not task.cancelled:
+			task.callback(result)
+
+	def cancel_all(self):
+		with self.lock:
+			for task in self.pending:
+				task.cancel()
+			return len(self.pending)
+
+	def shutdown(self):
+		self.cancel_all()
+		for t in self.threads:
+			self.tasks.put(None)
+
+	def show_progress(self):
+		with self.lock:
+			labels = [t.label for t in self.pending if not t.cancelled]
+			if not labels:
+				self.ticking = False
+		if not labels:
+			sublime.status_message('')
+			return
+		self.frame = (self.frame + 1) % len(gemsSpinner)
+		sublime.status_message('GEM {} {}'.format(gemsSpinner[self.frame], ', '.join(labels)))
+		sublime.set_timeout(self.show_progress, 100)
+
+gemsEXECUTOR = gemsExecutor(gemsWorkers)
+
+# ------------------------------------------------------------------
+def gems_async(path, data, callback=None, **kwargs):
+	return gemsEXECUTOR.submit(path, lambda: gemsRequest(path, data, **kwargs), callback)
+
+# ------------------------------------------------------------------
+def gems_message(mesg):
+	sublime.set_timeout(lambda: sublime.message_dialog(mesg), 0)
+
+# ------------------------------------------------------------------
+class gemsCancelRequests(sublime_plugin.ApplicationCommand):
+	def run(self):
+		n = gemsEXECUTOR.cancel_all()
+		sublime.status_message('{} pending request(s) cancelled.'.format(n))
+
+# ------------------------------------------------------------------
+# Every request carries an id in X-Gem-Request-Id, which the server
+# logs for slow or failed requests. The latest gemsStatsWindow requests
+# to each endpoint are kept for "Show connection stats".
+# ------------------------------------------------------------------
+def gems_request_id():
+	return '{:016x}'.format(random.getrandbits(64))
+
+def gems_percentile(values, p):
+	if not values:
+		return 0
+	return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+class gemsConnectionStats:
+	def __init__(self, window):
+		self.window = window
+		self.lock = threading.Lock()
+		self.samples = {}
+
+	def add(self, path, trace):
+		with self.lock:
+			if path not in self.samples:
+				self.samples[path] = collections.deque(maxlen=self.window)
+			self.samples[path].append(trace)
+
+	def summary(self):
+		with self.lock:
+			samples = dict((path, list(traces)) for path, traces in self.samples.items())
+		lines = ['{:<28} {:>6} {:>6} {:>8} {:>8} {:>8} {:>10} {:>9} {:>9}'.format(
+			'endpoint', 'count', 'failed', 'p50 ms', 'p95 ms', 'p99 ms', 'TTFB p50', 'KB out', 'KB in')]
+		for path, traces in sorted(samples.items()):
+			totals = sorted(t['Total'] for t in traces)
+			firsts = sorted(t['FirstByte'] for t in traces if 'FirstByte' in t)
+			lines.append('{:<28} {:>6} {:>6} {:>8.0f} {:>8.0f} {:>8.0f} {:>10.0f} {:>9.1f} {:>9.1f}'.format(
+				path, len(traces), sum(1 for t in traces if t['Outcome'] != 'ok'),
+				1000 * gems_percentile(totals, 50), 1000 * gems_percentile(totals, 95),
+				1000 * gems_percentile(totals, 99), 1000 * gems_percentile(firsts, 50),
+				sum(t['Sent'] for t in traces) / 1024.0, sum(t['Received'] for t in traces) / 1024.0))
+		slowest = sorted(((t['Total'], path, t) for path, traces in samples.items() for t in traces),
+			key=lambda s: s[0], reverse=True)[:10]
+		lines.append('\nSlowest requests (the server logs slow requests by id):')
+		for total, path, t in slowest:
+			lines.append('{}  {:<28} {:>8.0f} ms  {}  {}'.format(t['Id'], path, 1000 * total, t['Outcome'],
+				time.strftime('%H:%M:%S', time.localtime(t['Start']))))
+		return '\n'.join(lines)
+
+gemsSTATS = gemsConnectionStats(gemsStatsWindow)
+
+class gemsShowConnectionStats(sublime_plugin.ApplicationCommand):
+	def run(self):
+		info = gemsINFO.load()
+		if 'Folder' not in info:
+			gems_message("Please set a local folder to store working files.")
+			return
+		stats_file = os.path.join(info['Folder'], 'ConnectionStats.txt')
+		with open(stats_file, 'w', encoding='utf-8') as f:
+			f.write(gemsSTATS.summary() + '\n')
+		if sublime.active_window().id() == 0:
+			sublime.run_command('new_window')
+		sublime.active_window().open_file(stats_file)
+
+# ------------------------------------------------------------------------------
+def gemsRequest(path, data, authenticated=True, method='POST', verbal=True, timeout=gemsTIMEOUT, response_headers=None, raise_network_errors=False):
+	global gemsFOLDER
+
+	info = gemsINFO.load()
 
 	if 'Folder' not in info:
 		if verbal:
-			sublime.message_dialog("Please set a local folder to store working files.")
+			gems_message("Please set a local folder to store working files.")
 		return None
 
 	if 'CourseId' not in info:
-		sublime.message_dialog("Please set the course id.")
+		gems_message("Please set the course id.")
 		return None
 
 	if 'Server' not in info:
 		if verbal:
-			sublime.message_dialog("Please connect to the server first.")
+			gems_message("Please connect to the server first.")
 		return None
 
-	if gemsSERVER == '' or time.time() - gemsSERVER_TIME > 5400:
-		sublime.run_command('gems_connect')
-		if gemsSERVER == '':
-			sublime.message_dialog('Unable to connect. Check server address or course id.')
-			return
+	if not gems_server(info):
+		if raise_network_errors:
+			raise urllib.error.URLError('unable to connect')
+		gems_message('Unable to connect. Check server address or course id.')
+		return
 
 	if authenticated:
 		if 'Uid' not in info:
-			sublime.message_dialog("Please register.")
+			gems_message("Please register.")
 			return None
 		data['name'] = info['Name']
 		data['password'] = info['Password']
@@ -239,27 +974,27 @@ def gemsRequest(path, data, authenticated=True, method='POST', verbal=True):
 
 	url = urllib.parse.urljoin(gemsSERVER, path)
 	load = urllib.parse.urlencode(data).encode('utf-8')
-	req = urllib.request.Request(url, load, method=method)
+	request_id = gems_request_id()
 	try:
-		with urllib.request.urlopen(req, None, gemsTIMEOUT) as response:
-			return response.read().decode(encoding="utf-8")
+		return gems_urlopen(url, load, method, timeout, response_headers, request_id).decode(encoding="utf-8")
 	except urllib.error.HTTPError as err:
+		if raise_network_errors and err.code >= 500:
+			raise
 		if verbal:
-			sublime.message_dialog("{0}".format(err))
+			gems_message("{0}".format(err))
 	except urllib.error.URLError as err:
+		gems_start_refresh(check=True)
+		if raise_network_errors:
+			raise
 		if verbal:
-			sublime.message_dialog("{0}\nCannot connect to server.".format(err))
-	print('Error making request')
+			gems_message("{0}\nCannot connect to server.".format(err))
+	print('Error making request {} ({})'.format(path, request_id))
 	return None
 
 # ------------------------------------------------------------------
 class gemsSetLocalFolder(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemsFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemsINFO.load()
 		if 'Folder' not in info:
 			info['Folder'] = os.path.join(os.path.expanduser('~'), 'GEM')
 		if sublime.active_window().id() == 0:
@@ -273,75 +1008,126 @@ class gemsSetLocalFolder(sublime_plugin.ApplicationCommand):
 	def set(self, folder):
 		folder = folder.strip()
 		if len(folder) > 0:
-			try:
-				with open(gemsFILE, 'r') as f:
-					info = json.loads(f.read())
-			except:
-				info = dict()
-			info['Folder'] = folder
 			if not os.path.exists(folder):
 				try:
 					os.mkdir(folder)
 					os.mkdir(os.path.join(folder,'FEEDBACK'))
-					with open(gemsFILE, 'w') as f:
-						f.write(json.dumps(info, indent=4))
+					gemsINFO.update(Folder=folder)
 				except:
 					sublime.message_dialog('Could not create {}.'.format(folder))
 			else:
-				with open(gemsFILE, 'w') as f:
-					f.write(json.dumps(info, indent=4))
+				gemsINFO.update(Folder=folder)
 				sublime.message_dialog('Folder exists. Will use it to store working files.')
 		else:
 			sublime.message_dialog("Folder name cannot be empty.")
 
 # ------------------------------------------------------------------
-class gemsConnect(sublime_plugin.ApplicationCommand):
-	def run(self):
-		try:
-			with open(gemsFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+# The course server's address from the name server is kept in info,
+# so clients start from it and refresh it in the background once it
+# is older than gemsAddressTTL, or when the server stops answering.
+# ------------------------------------------------------------------
+def gems_address_key(info):
+	return '{}|{}'.format(info.get('Server'), info.get('CourseId'))
 
-		if 'CourseId' not in info:
-			sublime.message_dialog("Please set the course id.")
-			return None
+def gems_cached_address(info):
+	if info.get('AddressFor') == gems_address_key(info):
+		return info.get('Address', ''), info.get('AddressTime', 0)
+	return '', 0
 
-		if 'Server' not in info:
-			sublime.message_dialog("Please set server address.")
-			return None
+def gems_resolve(info):
+	url = urllib.parse.urljoin(info['Server'], 'ask')
+	load = urllib.parse.urlencode({'who':info['CourseId']}).encode('utf-8')
+	server = gems_urlopen(url, load).decode(encoding="utf-8")
+	if not server.startswith('http://'):
+		return ''
+	gemsINFO.update(Address=server, AddressTime=time.time(), AddressFor=gems_address_key(info))
+	return server
 
-		global gemsSERVER, gemsSERVER_TIME
-		url = urllib.parse.urljoin(info['Server'], 'ask')
-		load = urllib.parse.urlencode({'who':info['CourseId']}).encode('utf-8')
-		req = urllib.request.Request(url, load)
-		try:
-			with urllib.request.urlopen(req, None, gemsTIMEOUT) as response:
-				server = response.read().decode(encoding="utf-8")
-				try:
-					with open(gemsFILE, 'r') as f:
-						info = json.loads(f.read())
-				except:
-					info = dict()
-				if not server.startswith('http://'):
-					sublime.message_dialog('Unable to get address.')
-					return
-				gemsSERVER = server
-				gemsSERVER_TIME = time.time()
-				sublime.status_message('Connected')
-		except urllib.error.HTTPError as err:
-			sublime.message_dialog("{0}".format(err))
-		except urllib.error.URLError as err:
-			sublime.message_dialog("{0}\nCannot connect to server.".format(err))
+def gems_ping(server):
+	try:
+		return gems_urlopen(urllib.parse.urljoin(server, 'ping'), None, 'GET', timeout=gemsPingTIMEOUT) == b'pong'
+	except urllib.error.URLError:
+		return False
+
+def gems_refresh_address(check=False):
+	global gemsSERVER, gemsRefreshing
+	try:
+		info = gemsINFO.load()
+		if 'Server' not in info or 'CourseId' not in info:
+			return
+		address, at = gems_cached_address(info)
+		if address != '' and gemsSERVER == '':
+			gemsSERVER = address
+		if check and address != '' and time.time() - at < gemsAddressTTL and gems_ping(address):
+			return
+		server = gems_resolve(info)
+		if server != '':
+			gemsSERVER = server
+	except urllib.error.URLError as err:
+		print('Name server unavailable, keeping {}: {}'.format(gemsSERVER, err))
+	finally:
+		with gemsAddressLock:
+			gemsRefreshing = False
+
+def gems_start_refresh(check=False):
+	global gemsRefreshing
+	with gemsAddressLock:
+		if gemsRefreshing:
+			return
+		gemsRefreshing = True
+	threading.Thread(target=gems_refresh_address, args=(check,), daemon=True).start()
+
+def gems_server(info):
+	global gemsSERVER
+	address, at = gems_cached_address(info)
+	if address == '':
+		return gems_connect()
+	if gemsSERVER == '':
+		gemsSERVER = address
+	if time.time() - at > gemsAddressTTL:
+		gems_start_refresh()
+	return True
+
+# ------------------------------------------------------------------
+def gems_connect():
+	global gemsSERVER
+	info = gemsINFO.load()
+
+	if 'CourseId' not in info:
+		gems_message("Please set the course id.")
+		return False
+
+	if 'Server' not in info:
+		gems_message("Please set server address.")
+		return False
+
+	try:
+		server = gems_resolve(info)
+		if server == '':
+			gems_message('Unable to get address.')
+			return False
+		gemsSERVER = server
+		sublime.status_message('Connected')
+		return True
+	except urllib.error.HTTPError as err:
+		gems_message("{0}".format(err))
+	except urllib.error.URLError as err:
+		address, _ = gems_cached_address(info)
+		if address != '' and gems_ping(address):
+			gemsSERVER = address
+			sublime.status_message('Name server unavailable. Connected to {}'.format(address))
+			return True
+		gems_message("{0}\nCannot connect to server.".format(err))
+	return False
+
+class gemsConnect(sublime_plugin.ApplicationCommand):
+	def run(self):
+		gemsEXECUTOR.submit('connect', gems_connect)
 
 # ------------------------------------------------------------------
 class gemsCompleteRegistration(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemsFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemsINFO.load()
 
 		if 'CourseId' not in info:
 			sublime.message_dialog('Please enter course id.')
@@ -351,11 +1137,14 @@ class gemsCompleteRegistration(sublime_plugin.ApplicationCommand):
 			sublime.message_dialog('Please enter assigned username.')
 			return
 
-		response = gemsRequest(
+		gems_async(
 			'complete_registration',
 			{'role':'student', 'name':info['Name'], 'course_id':info['CourseId']},
+			lambda response: self.done(response, info),
 			authenticated=False,
 		)
+
+	def done(self, response, info):
 		if response is None:
 			sublime.message_dialog('Response is None. Failed to complete registration.')
 			return
@@ -364,20 +1153,13 @@ class gemsCompleteRegistration(sublime_plugin.ApplicationCommand):
 			sublime.message_dialog('Failed to complete registration.')
 		else:
 			uid, password = response.split(',')
-			info['Uid'] = int(uid)
-			info['Password'] = password.strip()
+			gemsINFO.update(Uid=int(uid), Password=password.strip())
 			sublime.message_dialog('{} is registered.'.format(info['Name']))
-		with open(gemsFILE, 'w') as f:
-			f.write(json.dumps(info, indent=4))
 
 # ------------------------------------------------------------------
 class gemsSetServerAddress(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemsFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemsINFO.load()
 
 		if 'Server' not in info:
 			info['Server'] = ''
@@ -392,27 +1174,16 @@ class gemsSetServerAddress(sublime_plugin.ApplicationCommand):
 	def set(self, addr):
 		addr = addr.strip()
 		if len(addr) > 0:
-			try:
-				with open(gemsFILE, 'r') as f:
-					info = json.loads(f.read())
-			except:
-				info = dict()
 			if not addr.startswith('http://'):
 				addr = 'http://' + addr
-			info['Server'] = addr
-			with open(gemsFILE, 'w') as f:
-				f.write(json.dumps(info, indent=4))
+			gemsINFO.update(Server=addr)
 		else:
 			sublime.message_dialog("Server address cannot be empty.")
 
 # ------------------------------------------------------------------
 class gemsSetCourseId(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemsFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemsINFO.load()
 
 		if 'CourseId' not in info:
 			info['CourseId'] = ''
@@ -427,14 +1198,7 @@ class gemsSetCourseId(sublime_plugin.ApplicationCommand):
 	def set(self, cid):
 		cid = cid.strip()
 		if len(cid) > 0:
-			try:
-				with open(gemsFILE, 'r') as f:
-					info = json.loads(f.read())
-			except:
-				info = dict()
-			info['CourseId'] = cid
-			with open(gemsFILE, 'w') as f:
-				f.write(json.dumps(info, indent=4))
+			gemsINFO.update(CourseId=cid)
 			sublime.message_dialog('Course id is set to ' + cid)
 		else:
 			sublime.message_dialog("Server address cannot be empty.")
@@ -442,11 +1206,7 @@ class gemsSetCourseId(sublime_plugin.ApplicationCommand):
 # ------------------------------------------------------------------
 class gemsSetName(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemsFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemsINFO.load()
 		if 'Name' not in info:
 			info['Name'] = ''
 		if sublime.active_window().id() == 0:
@@ -460,14 +1220,7 @@ class gemsSetName(sublime_plugin.ApplicationCommand):
 	def set(self, name):
 		name = name.strip()
 		if len(name) > 0:
-			try:
-				with open(gemsFILE, 'r') as f:
-					info = json.loads(f.read())
-			except:
-				info = dict()
-			info['Name'] = name
-			with open(gemsFILE, 'w') as f:
-				f.write(json.dumps(info, indent=4))
+			gemsINFO.update(Name=name)
 			sublime.message_dialog('Assigned name is set to ' + name)
 		else:
 			sublime.message_dialog("Name cannot be empty.")
@@ -502,3 +1255,15 @@ class gemsUpdate(sublime_plugin.WindowCommand):
 			sublime.message_dialog("GEM has been updated to version {}.".format(version))
 
 # ------------------------------------------------------------------
+def plugin_loaded():
+	gems_start_refresh(check=True)
+	gemsOUTBOX.start()
+
+# ------------------------------------------------------------------
+def plugin_unloaded():
+	global gemsTracking
+	gemsTracking = False
+	gemsOUTBOX.stop()
+	gemsEXECUTOR.shutdown()
+
+# ------------------------------------------------------------------
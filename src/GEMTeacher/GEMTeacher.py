@@ -5,19 +5,53 @@
 import sublime, sublime_plugin
 import urllib.parse
 import urllib.request
+import http.client
+import threading
+import functools
+import queue
+import collections
 import os
 import json
 import socket
+import select
+import hashlib
+import difflib
+import gzip
+import time
 import webbrowser
 import random
 import re
+import concurrent.futures
 
 gemtAnswerTag = 'ANSWER:'
+gemtHeaderRE = re.compile('(\d+)\s+(\d+)\s+(\d+)(\s+(\w.*))?')
+gemtBankFile = '.gem_bank'
+gemtBanks = {}
 gemtFOLDER = ''
 gemtTIMEOUT = 7
-gemtStudentSubmissions = {}
+gemtStatsWindow = 500		# Requests per endpoint kept for connection stats
+gemtMaxIdleConnections = 4
+gemtConnections = {}
+gemtConnectionsLock = threading.Lock()
+gemtFeatures = {}
+gemtCompressMin = 512
+gemtCompressPaths = ('/teacher_broadcasts', '/teacher_grades', '/teacher_grades_batch')
+gemtIdempotentPaths = ('/ask', '/ping', '/teacher_gets_passcode', '/teacher_gets_queue')	# safe to send again after any connection failure
+gemtWorkers = 4
+gemtSpinner = ['-', '\\', '|', '/']
+gemtOriginalsMax = 256
+gemtPrefetchDepth = 5
+gemtPrefetched = []
+gemtPrefetchLease = 240		# Seconds a prefetched submission is kept; the server takes it back after 300
+gemtPrefetchLock = threading.Lock()
+gemtPrefetching = False
+gemtQueue = dict(Epoch=0, Version=-1, Entries=[])
 gemtFILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "info")
 gemtSERVER = ''
+gemtAddressTTL = 5400		# Seconds before the course server's address is resolved again
+gemtPingTIMEOUT = 3
+gemtAddressLock = threading.Lock()
+gemtRefreshing = False
 
 # ------------------------------------------------------------------
 # ------------------------------------------------------------------
@@ -28,84 +62,74 @@ gemtSERVER = ''
 # ------------------------------------------------------------------
 class gemtStatistics(sublime_plugin.WindowCommand):
 	def run(self):
-		global gemtSERVER
-		if gemtSERVER == '':
-			sublime.run_command('gemt_connect')
-			if gemtSERVER == '':
-				sublime.message_dialog('Unable to connect. Check server address.')
-				return
-		passcode = gemtRequest('teacher_gets_passcode', {})
-		with open(gemtFILE, 'r') as f:
-			info = json.loads(f.read())
-		data = urllib.parse.urlencode({'pc' : passcode, 'pid': 0})
-		webbrowser.open(gemtSERVER + '/statistics?' + data)
+		gemt_async('teacher_gets_passcode', {}, self.open)
+
+	def open(self, passcode):
+		if passcode is not None:
+			data = urllib.parse.urlencode({'pc' : passcode, 'pid': 0})
+			webbrowser.open(gemtSERVER + '/statistics?' + data)
 
 # ------------------------------------------------------------------
 class gemtReport(sublime_plugin.WindowCommand):
 	def run(self):
-		global gemtSERVER
-		if gemtSERVER == '':
-			sublime.run_command('gemt_connect')
-			if gemtSERVER == '':
-				sublime.message_dialog('Unable to connect. Check server address.')
-				return
+		gemt_async('teacher_gets_passcode', {}, self.open)
 
-		passcode = gemtRequest('teacher_gets_passcode', {})
-		with open(gemtFILE, 'r') as f:
-			info = json.loads(f.read())
-		data = urllib.parse.urlencode({'pc' : passcode})
-		webbrowser.open(gemtSERVER + '/report?' + data)
+	def open(self, passcode):
+		if passcode is not None:
+			data = urllib.parse.urlencode({'pc' : passcode})
+			webbrowser.open(gemtSERVER + '/report?' + data)
 
 # ------------------------------------------------------------------
 class gemtViewActivities(sublime_plugin.WindowCommand):
 	def run(self):
-		global gemtSERVER
-		if gemtSERVER == '':
-			sublime.run_command('gemt_connect')
-			if gemtSERVER == '':
-				sublime.message_dialog('Unable to connect. Check server address.')
-				return
-		passcode = gemtRequest('teacher_gets_passcode', {})
-		with open(gemtFILE, 'r') as f:
-			info = json.loads(f.read())
-		data = urllib.parse.urlencode({'pc' : passcode})
-		webbrowser.open(gemtSERVER + '/view_activities?' + data)
+		gemt_async('teacher_gets_passcode', {}, self.open)
 
+	def open(self, passcode):
+		if passcode is not None:
+			data = urllib.parse.urlencode({'pc' : passcode})
+			webbrowser.open(gemtSERVER + '/view_activities?' + data)
 
 # ------------------------------------------------------------------
-def gemt_get_problem_info(fname):
-	basename = os.path.basename(fname)
-	with open(fname, 'r', encoding='utf-8') as fp:
-		content = fp.read()
-	items = content.split('\n',1)
-	if len(items)==0 or (not items[0].startswith('#') and not items[0].startswith('//')):
-		return content, '', 0, 0, 0, '', basename, False
-
-	merit, effort, attempts, tag, exact_answer = 0, 0, 0, '', True
-	first_line, body = items[0], items[1]
+# Returns prefix, merit, effort, attempts, tag, exact_answer, or None
+# if the first line is not the header of a graded problem.
+# ------------------------------------------------------------------
+def gemt_parse_header(first_line):
 	if first_line.startswith('#'):
 		prefix = '#'
 		first_line = first_line.strip('# ')
-	else:
+	elif first_line.startswith('//'):
 		prefix = '//'
 		first_line = first_line.strip('/ ')
-	try:
-		items = re.match('(\d+)\s+(\d+)\s+(\d+)(\s+(\w.*))?', first_line).groups()
-		merit, effort, attempts, tag = int(items[0]), int(items[1]), int(items[2]), items[4]
-		if tag is None:
-			tag = ''
-		tag = tag.strip()
-		if tag.startswith('_manual_'):
-			exact_answer = False
-			tag = tag.split('_manual_')[1].strip()
-	except:
-		return content, '', 0, 0, 0, '', basename, False
-
+	else:
+		return None
+	m = gemtHeaderRE.match(first_line)
+	if m is None:
+		return None
+	merit, effort, attempts, tag = int(m.group(1)), int(m.group(2)), int(m.group(3)), m.group(5)
+	if tag is None:
+		tag = ''
+	tag = tag.strip()
+	exact_answer = True
+	if tag.startswith('_manual_'):
+		exact_answer = False
+		tag = tag.split('_manual_')[1].strip()
 	if merit < effort:
+		return None
+	return prefix, merit, effort, attempts, tag, exact_answer
+
+# ------------------------------------------------------------------
+def gemt_get_problem_info(fname):
+	basename = os.path.basename(fname)
+	with open(fname, 'r', encoding='utf-8') as fp:
+		content = fp.read()
+	items = content.split('\n',1)
+	header = gemt_parse_header(items[0])
+	if header is None:
 		return content, '', 0, 0, 0, '', basename, False
 
+	prefix, merit, effort, attempts, tag, exact_answer = header
 	body = '{} {} points, {} for effort. Maximum attempts: {}.\n{}'.format(
-		prefix, merit, effort, attempts, body)
+		prefix, merit, effort, attempts, items[1] if len(items) > 1 else '')
 	answer = ''
 	if os.path.exists(fname + '.answer'):
 		with open(fname + '.answer', 'r', encoding='utf-8') as fp:
@@ -144,14 +168,197 @@ class gemtShare(sublime_plugin.TextCommand):
 			'filename':		name,
 			'exact_answer':	exact_answer,
 		}
-		response = gemtRequest('teacher_broadcasts', data)
-		if response is not None:
-			if merit==0:
-				mesg = 'Sharing not-graded content. '
+		def done(response):
+			if response is not None:
+				if merit==0:
+					mesg = 'Sharing not-graded content. '
+				else:
+					mesg = 'Sharing graded content. '
+				mesg += response
+				sublime.message_dialog(mesg)
+		gemt_async('teacher_broadcasts', data, done)
+
+# ------------------------------------------------------------------
+# Broadcast several problem files (or folders of them) in one request.
+# Without paths, the folder of the current file is broadcast.
+# ------------------------------------------------------------------
+def gemt_problem_files(paths):
+	files = []
+	for path in paths:
+		if os.path.isdir(path):
+			files.extend(os.path.join(path, f) for f in os.listdir(path))
+		else:
+			files.append(path)
+	return sorted(f for f in set(files) if os.path.isfile(f) and
+		not os.path.basename(f).startswith('.') and not f.endswith('.answer'))
+
+class gemtShareFiles(sublime_plugin.WindowCommand):
+	def run(self, paths=[]):
+		if not paths:
+			fname = self.window.active_view() and self.window.active_view().file_name()
+			if fname is None:
+				sublime.message_dialog('Select files or a folder to broadcast.')
+				return
+			paths = [os.path.dirname(fname)]
+		files = gemt_problem_files(paths)
+		if not files:
+			sublime.message_dialog('There are no files to broadcast.')
+			return
+		if not sublime.ok_cancel_dialog('Broadcast {} file(s) to white boards?'.format(len(files))):
+			return
+		gemtEXECUTOR.submit('teacher_broadcasts_batch', lambda: self.share(files), self.done)
+
+	# Files that cannot be read are skipped and reported; the rest are broadcast.
+	def share(self, files):
+		with concurrent.futures.ThreadPoolExecutor(max_workers=gemtWorkers) as pool:
+			infos = [(fname, pool.submit(gemt_get_problem_info, fname)) for fname in files]
+		problems, skipped = [], []
+		for fname, info in infos:
+			try:
+				content, answer, merit, effort, attempts, tag, name, exact_answer = info.result()
+			except (OSError, ValueError) as err:
+				skipped.append('{}: {}'.format(os.path.basename(fname), err))
+				continue
+			problems.append(dict(
+				Description = content,
+				Answer = answer,
+				Merit = merit,
+				Effort = effort,
+				Attempts = attempts,
+				Tag = tag,
+				Filename = name,
+				ExactAnswer = exact_answer,
+			))
+		if not problems:
+			return None, skipped
+		return gemtRequest('teacher_broadcasts_batch', {'problems': json.dumps(problems)}), skipped
+
+	def done(self, result):
+		if result is None:
+			return
+		response, skipped = result
+		mesg = response or ''
+		if skipped:
+			mesg += '\n\n{} file(s) could not be read and were not broadcast:\n{}'.format(len(skipped), '\n'.join(skipped))
+		if mesg.strip():
+			sublime.message_dialog(mesg.strip())
+
+# ------------------------------------------------------------------
+# An index of the problem files in a folder, kept in the folder itself.
+# Files are keyed by path, mtime and size; only new or changed files
+# are read again, and only their first line.
+# ------------------------------------------------------------------
+class gemtProblemBank:
+	def __init__(self, folder):
+		self.folder = folder
+		self.path = os.path.join(folder, gemtBankFile)
+		self.lock = threading.Lock()
+		self.entries = None
+
+	def load(self):
+		try:
+			with open(self.path, 'r', encoding='utf-8') as f:
+				return json.loads(f.read())
+		except (OSError, ValueError):
+			return {}
+
+	def save(self):
+		tmp = '{}.{}.tmp'.format(self.path, threading.get_ident())
+		with open(tmp, 'w', encoding='utf-8') as f:
+			f.write(json.dumps(self.entries))
+		os.replace(tmp, self.path)
+
+	def read(self, path, st):
+		entry = dict(Mtime=st.st_mtime_ns, Size=st.st_size, Merit=0, Effort=0, Attempts=0, Tag='')
+		try:
+			with open(path, 'r', encoding='utf-8', errors='replace') as fp:
+				header = gemt_parse_header(fp.readline().rstrip('\n'))
+		except OSError:
+			header = None
+		if header is not None:
+			prefix, merit, effort, attempts, tag, exact_answer = header
+			entry.update(Merit=merit, Effort=effort, Attempts=attempts, Tag=tag)
+		return entry
+
+	def scan(self):
+		with self.lock:
+			if self.entries is None:
+				self.entries = self.load()
+			entries, changed = {}, False
+			for root, dirs, files in os.walk(self.folder):
+				dirs[:] = [d for d in dirs if not d.startswith('.')]
+				rel_root = os.path.relpath(root, self.folder)
+				for f in files:
+					if f.startswith('.') or f.endswith('.answer'):
+						continue
+					path = os.path.join(root, f)
+					try:
+						st = os.stat(path)
+					except OSError:
+						continue
+					rel = f if rel_root == '.' else os.path.join(rel_root, f)
+					entry = self.entries.get(rel)
+					if entry is None or entry['Mtime'] != st.st_mtime_ns or entry['Size'] != st.st_size:
+						entry = self.read(path, st)
+						changed = True
+					entries[rel] = entry
+			if changed or len(entries) != len(self.entries):
+				self.entries = entries
+				self.save()
+			return sorted(self.entries.items())
+
+def gemt_problem_bank(folder):
+	if folder not in gemtBanks:
+		gemtBanks[folder] = gemtProblemBank(folder)
+	return gemtBanks[folder]
+
+# ------------------------------------------------------------------
+class gemtSearchProblemBank(sublime_plugin.WindowCommand):
+	def run(self):
+		folder = gemtINFO.load().get('ProblemBank')
+		if folder is None or not os.path.isdir(folder):
+			sublime.message_dialog('Please set the problem bank folder.')
+			return
+		self.folder = folder
+		gemtEXECUTOR.submit('problem bank', gemt_problem_bank(folder).scan, self.show)
+
+	def show(self, entries):
+		if not entries:
+			sublime.message_dialog('The problem bank is empty.')
+			return
+		self.paths, items = [], []
+		for rel, entry in entries:
+			self.paths.append(os.path.join(self.folder, rel))
+			if entry['Merit'] > 0:
+				items.append(['{}  {}'.format(rel, entry['Tag']),
+					'{} points, {} for effort, {} attempts'.format(entry['Merit'], entry['Effort'], entry['Attempts'])])
 			else:
-				mesg = 'Sharing graded content. '
-			mesg += response
-			sublime.message_dialog(mesg)
+				items.append([rel, 'not graded'])
+		self.window.show_quick_panel(items, self.share)
+
+	def share(self, index):
+		if index >= 0:
+			self.window.run_command('gemt_share_files', {'paths': [self.paths[index]]})
+
+# ------------------------------------------------------------------
+class gemtSetProblemBank(sublime_plugin.ApplicationCommand):
+	def run(self):
+		info = gemtINFO.load()
+		if sublime.active_window().id() == 0:
+			sublime.run_command('new_window')
+		sublime.active_window().show_input_panel("Specify the folder that holds your problem files.",
+			info.get('ProblemBank', ''),
+			self.set,
+			None,
+			None)
+
+	def set(self, folder):
+		folder = folder.strip()
+		if os.path.isdir(folder):
+			gemtINFO.update(ProblemBank=folder)
+			sublime.message_dialog('Problem bank is set to ' + folder)
+		else:
+			sublime.message_dialog('{} is not a folder.'.format(folder))
 
 # ------------------------------------------------------------------
 class gemtDeactivateProblems(sublime_plugin.TextCommand):
@@ -161,24 +368,27 @@ class gemtDeactivateProblems(sublime_plugin.TextCommand):
 			return
 		filename = os.path.basename(self.view.file_name())
 		if sublime.ok_cancel_dialog('Submission for this problem will no longer be possible. Click OK to confirm.'):
-			response = gemtRequest('teacher_deactivates_problems', {'filename':filename})
-			if response == '-1':
-				sublime.message_dialog('Unknown or inactive problem!')
-			elif response == '0':
-				sublime.message_dialog('Problem is now inactive.')
-			elif response == '1':
-				global gemtSERVER
-				with open(gemtFILE, 'r') as f:
-					info = json.loads(f.read())
-				passcode = gemtRequest('teacher_gets_passcode', {})
-				p = urllib.parse.urlencode({'pc' : passcode, 'filename':filename})
-				webbrowser.open(gemtSERVER + '/view_answers?' + p)
+			def view_answers(passcode):
+				if passcode is not None:
+					p = urllib.parse.urlencode({'pc' : passcode, 'filename':filename})
+					webbrowser.open(gemtSERVER + '/view_answers?' + p)
+			def done(response):
+				if response == '-1':
+					sublime.message_dialog('Unknown or inactive problem!')
+				elif response == '0':
+					sublime.message_dialog('Problem is now inactive.')
+				elif response == '1':
+					gemt_async('teacher_gets_passcode', {}, view_answers)
+			gemt_async('teacher_deactivates_problems', {'filename':filename}, done)
 
 # ------------------------------------------------------------------
 class gemtClearSubmissions(sublime_plugin.ApplicationCommand):
 	def run(self):
 		if sublime.ok_cancel_dialog('Do you want to clear all submissions and white boards?'):
-			response = gemtRequest('teacher_clears_submissions', {})
+			gemt_async('teacher_clears_submissions', {}, self.done)
+
+	def done(self, response):
+		if response is not None:
 			sublime.message_dialog(response)
 # ----------------------------------------------------------------------
 
@@ -187,37 +397,335 @@ class gemtClearSubmissions(sublime_plugin.ApplicationCommand):
 # ----------------------------------------------------------------------
 # These functionalities below are identical to the GEMAssistant module
 # ----------------------------------------------------------------------
-# ----------------------------------------------------------------------
-def gemtRequest(path, data, authenticated=True, method='POST'):
-	global gemtFOLDER, gemtSERVER
+# ------------------------------------------------------------------
+# The info file, cached in memory and revalidated by mtime/size.
+# Writes go to a temporary file that is renamed over the original.
+# ------------------------------------------------------------------
+class gemtInfoFile:
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.RLock()
+		self.stamp = None
+		self.info = {}
+
+	def refresh(self):
+		try:
+			st = os.stat(self.path)
+		except OSError:
+			self.stamp, self.info = None, {}
+			return
+		stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+		if stamp != self.stamp:
+			try:
+				with open(self.path, 'r') as f:
+					self.info = json.loads(f.read())
+			except ValueError:
+				self.info = {}
+			self.stamp = stamp
+
+	def load(self):
+		with self.lock:
+			self.refresh()
+			return dict(self.info)
+
+	def save(self, info):
+		with self.lock:
+			tmp = '{}.{}.tmp'.format(self.path, threading.get_ident())
+			with open(tmp, 'w') as f:
+				f.write(json.dumps(info, indent=4))
+			os.replace(tmp, self.path)
+			st = os.stat(self.path)
+			self.info = dict(info)
+			self.stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+
+	def update(self, **changes):
+		with self.lock:
+			self.refresh()
+			info = dict(self.info)
+			info.update(changes)
+			self.save(info)
+			return info
 
+gemtINFO = gemtInfoFile(gemtFILE)
+
+# ------------------------------------------------------------------
+# Persistent HTTP/1.1 connections, kept idle per server and reused.
+# ------------------------------------------------------------------
+def gemt_checkout_connection(server, timeout):
+	with gemtConnectionsLock:
+		idle = gemtConnections.get(server, [])
+		while idle:
+			conn = idle.pop()
+			if conn.sock is None or select.select([conn.sock], [], [], 0)[0]:
+				conn.close()		# closed by the server while idle
+				continue
+			conn.timeout = timeout
+			conn.sock.settimeout(timeout)
+			return conn, True
+	conn = http.client.HTTPConnection(server[0], server[1], timeout=timeout)
+	conn.connect()
+	conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	return conn, False
+
+def gemt_checkin_connection(server, conn):
+	with gemtConnectionsLock:
+		idle = gemtConnections.setdefault(server, [])
+		if len(idle) < gemtMaxIdleConnections:
+			idle.append(conn)
+			return
+	conn.close()
+
+def gemt_urlopen(url, load=None, method='POST', timeout=gemtTIMEOUT, response_headers=None, request_id=None):
+	trace = dict(Id=request_id or gemt_request_id(), Start=time.time(), Sent=0, Received=0)
+	outcome = 'error'
 	try:
-		with open(gemtFILE, 'r') as f:
-			info = json.loads(f.read())
-	except:
-		info = dict()
+		body = gemt_exchange(url, load, method, timeout, response_headers, trace)
+		outcome = 'ok'
+		return body
+	except urllib.error.HTTPError as err:
+		outcome = str(err.code)
+		raise
+	finally:
+		trace['Total'] = time.time() - trace['Start']
+		trace['Outcome'] = outcome
+		gemtSTATS.add(urllib.parse.urlsplit(url).path.strip('/'), trace)
+
+def gemt_exchange(url, load, method, timeout, response_headers, trace):
+	parts = urllib.parse.urlsplit(url)
+	server = (parts.hostname, parts.port or 80)
+	path = parts.path or '/'
+	if parts.query:
+		path += '?' + parts.query
+	headers = {'Connection': 'keep-alive', 'Accept-Encoding': 'gzip', 'X-Gem-Request-Id': trace['Id']}
+	if load is not None:
+		headers['Content-Type'] = 'application/x-www-form-urlencoded'
+		# Only servers that advertised gzip get compressed request bodies.
+		if path in gemtCompressPaths and len(load) >= gemtCompressMin and 'gzip' in gemtFeatures.get(server, ()):
+			load = gzip.compress(load)
+			headers['Content-Encoding'] = 'gzip'
+		trace['Sent'] = len(load)
+	while True:
+		try:
+			conn, reused = gemt_checkout_connection(server, timeout)
+		except OSError as err:
+			raise urllib.error.URLError(err)
+		sent = False
+		try:
+			conn.request(method, path, load, headers)
+			sent = True
+			response = conn.getresponse()
+			trace['FirstByte'] = time.time() - trace['Start']
+			body = response.read()
+			trace['Received'] = len(body)
+		except (http.client.BadStatusLine, ConnectionError) as err:
+			conn.close()
+			# A request that was not sent in full cannot have been applied.
+			# Once sent, it may have been, so only requests that change
+			# nothing are sent again.
+			if reused and (not sent or parts.path in gemtIdempotentPaths):
+				continue
+			raise urllib.error.URLError(err)
+		except (http.client.HTTPException, OSError) as err:
+			conn.close()
+			raise urllib.error.URLError(err)
+		if response.will_close:
+			conn.close()
+		else:
+			gemt_checkin_connection(server, conn)
+		features = response.getheader('X-Gem-Features')
+		if features is not None:
+			gemtFeatures[server] = features.split(',')
+		if response.getheader('Content-Encoding') == 'gzip':
+			body = gzip.decompress(body)
+		if response_headers is not None:
+			response_headers.update((k.lower(), v) for k, v in response.getheaders())
+		if response.status >= 400:
+			raise urllib.error.HTTPError(url, response.status, response.reason, response.msg, None)
+		return body
+
+# ------------------------------------------------------------------
+# Network requests run on a small pool of worker threads so that the
+# editor stays responsive. Callbacks are run on the UI thread.
+# ------------------------------------------------------------------
+class gemtTask:
+	def __init__(self, label, fn, callback):
+		self.label = label
+		self.fn = fn
+		self.callback = callback
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+class gemtExecutor:
+	def __init__(self, workers):
+		self.workers = workers
+		self.threads = []
+		self.tasks = queue.Queue()
+		self.pending = []
+		self.lock = threading.Lock()
+		self.ticking = False
+		self.frame = 0
+
+	def submit(self, label, fn, callback=None):
+		task = gemtTask(label, fn, callback)
+		with self.lock:
+			if len(self.threads) < self.workers:
+				t = threading.Thread(target=self.work, daemon=True)
+				self.threads.append(t)
+				t.start()
+			self.pending.append(task)
+			start_ticking, self.ticking = not self.ticking, True
+		self.tasks.put(task)
+		if start_ticking:
+			sublime.set_timeout(self.show_progress, 0)
+		return task
+
+	def work(self):
+		while True:
+			task = self.tasks.get()
+			if task is None:
+				return
+			result = None
+			if not task.cancelled:
+				try:
+					result = task.fn()
+				except Exception as err:
+					print('{} failed: {}'.format(task.label, err))
+			with self.lock:
+				self.pending.remove(task)
+			if task.callback is not None and not task.cancelled:
+				sublime.set_timeout(functools.partial(self.finish, task, result), 0)
+
+	def finish(self, task, result):
+		if not task.cancelled:
+			task.callback(result)
+
+	def cancel_all(self):
+		with self.lock:
+			for task in self.pending:
+				task.cancel()
+			return len(self.pending)
+
+	def shutdown(self):
+		self.cancel_all()
+		for t in self.threads:
+			self.tasks.put(None)
+
+	def show_progress(self):
+		with self.lock:
+			labels = [t.label for t in self.pending if not t.cancelled]
+			if not labels:
+				self.ticking = False
+		if not labels:
+			sublime.status_message('')
+			return
+		self.frame = (self.frame + 1) % len(gemtSpinner)
+		sublime.status_message('GEM {} {}'.format(gemtSpinner[self.frame], ', '.join(labels)))
+		sublime.set_timeout(self.show_progress, 100)
+
+gemtEXECUTOR = gemtExecutor(gemtWorkers)
+
+# ------------------------------------------------------------------
+def gemt_async(path, data, callback=None, **kwargs):
+	return gemtEXECUTOR.submit(path, lambda: gemtRequest(path, data, **kwargs), callback)
+
+# ------------------------------------------------------------------
+def gemt_message(mesg):
+	sublime.set_timeout(lambda: sublime.message_dialog(mesg), 0)
+
+# ------------------------------------------------------------------
+class gemtCancelRequests(sublime_plugin.ApplicationCommand):
+	def run(self):
+		n = gemtEXECUTOR.cancel_all()
+		sublime.status_message('{} pending request(s) cancelled.'.format(n))
+
+# ------------------------------------------------------------------
+# Every request carries an id in X-Gem-Request-Id, which the server
+# logs for slow or failed requests. The latest gemtStatsWindow requests
+# to each endpoint are kept for "Show connection stats".
+# ------------------------------------------------------------------
+def gemt_request_id():
+	return '{:016x}'.format(random.getrandbits(64))
+
+def gemt_percentile(values, p):
+	if not values:
+		return 0
+	return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+class gemtConnectionStats:
+	def __init__(self, window):
+		self.window = window
+		self.lock = threading.Lock()
+		self.samples = {}
+
+	def add(self, path, trace):
+		with self.lock:
+			if path not in self.samples:
+				self.samples[path] = collections.deque(maxlen=self.window)
+			self.samples[path].append(trace)
+
+	def summary(self):
+		with self.lock:
+			samples = dict((path, list(traces)) for path, traces in self.samples.items())
+		lines = ['{:<28} {:>6} {:>6} {:>8} {:>8} {:>8} {:>10} {:>9} {:>9}'.format(
+			'endpoint', 'count', 'failed', 'p50 ms', 'p95 ms', 'p99 ms', 'TTFB p50', 'KB out', 'KB in')]
+		for path, traces in sorted(samples.items()):
+			totals = sorted(t['Total'] for t in traces)
+			firsts = sorted(t['FirstByte'] for t in traces if 'FirstByte' in t)
+			lines.append('{:<28} {:>6} {:>6} {:>8.0f} {:>8.0f} {:>8.0f} {:>10.0f} {:>9.1f} {:>9.1f}'.format(
+				path, len(traces), sum(1 for t in traces if t['Outcome'] != 'ok'),
+				1000 * gemt_percentile(totals, 50), 1000 * gemt_percentile(totals, 95),
+				1000 * gemt_percentile(totals, 99), 1000 * gemt_percentile(firsts, 50),
+				sum(t['Sent'] for t in traces) / 1024.0, sum(t['Received'] for t in traces) / 1024.0))
+		slowest = sorted(((t['Total'], path, t) for path, traces in samples.items() for t in traces),
+			key=lambda s: s[0], reverse=True)[:10]
+		lines.append('\nSlowest requests (the server logs slow requests by id):')
+		for total, path, t in slowest:
+			lines.append('{}  {:<28} {:>8.0f} ms  {}  {}'.format(t['Id'], path, 1000 * total, t['Outcome'],
+				time.strftime('%H:%M:%S', time.localtime(t['Start']))))
+		return '\n'.join(lines)
+
+gemtSTATS = gemtConnectionStats(gemtStatsWindow)
+
+class gemtShowConnectionStats(sublime_plugin.ApplicationCommand):
+	def run(self):
+		info = gemtINFO.load()
+		if 'Folder' not in info:
+			gemt_message("Please set a local folder to store working files.")
+			return
+		stats_file = os.path.join(info['Folder'], 'ConnectionStats.txt')
+		with open(stats_file, 'w', encoding='utf-8') as f:
+			f.write(gemtSTATS.summary() + '\n')
+		if sublime.active_window().id() == 0:
+			sublime.run_command('new_window')
+		sublime.active_window().open_file(stats_file)
+
+# ----------------------------------------------------------------------
+def gemtRequest(path, data, authenticated=True, method='POST', response_headers=None):
+	global gemtFOLDER
+
+	info = gemtINFO.load()
 
 	if 'Folder' not in info:
-		sublime.message_dialog("Please set a local folder for keeping working files.")
+		gemt_message("Please set a local folder for keeping working files.")
 		return None
 
 	if 'CourseId' not in info:
-		sublime.message_dialog("Please set the course id.")
+		gemt_message("Please set the course id.")
 		return None
 
 	if 'Server' not in info:
-		sublime.message_dialog("Please set server address.")
+		gemt_message("Please set server address.")
 		return None
 
-	if gemtSERVER == '':
-		sublime.run_command('gemt_connect')
-		if gemtSERVER == '':
-			sublime.message_dialog('Unable to connect. Check server address or course id.')
-			return
+	if not gemt_server(info):
+		gemt_message('Unable to connect. Check server address or course id.')
+		return
 
 	if authenticated:
 		if 'Name' not in info or 'Password' not in info:
-			sublime.message_dialog("Please ask to setup a new teacher account and register.")
+			gemt_message("Please ask to setup a new teacher account and register.")
 			return None
 		data['name'] = info['Name']
 		data['password'] = info['Password']
@@ -227,28 +735,30 @@ def gemtRequest(path, data, authenticated=True, method='POST'):
 
 	url = urllib.parse.urljoin(gemtSERVER, path)
 	load = urllib.parse.urlencode(data).encode('utf-8')
-	req = urllib.request.Request(url, load, method=method)
+	request_id = gemt_request_id()
 	try:
-		with urllib.request.urlopen(req, None, gemtTIMEOUT) as response:
-			return response.read().decode(encoding="utf-8")
+		return gemt_urlopen(url, load, method, response_headers=response_headers, request_id=request_id).decode(encoding="utf-8")
 	except urllib.error.HTTPError as err:
-		sublime.message_dialog("{0}".format(err))
+		gemt_message("{0}".format(err))
 	except urllib.error.URLError as err:
-		sublime.message_dialog("{0}\nCannot connect to server.".format(err))
-	print('Something is wrong')
+		gemt_start_refresh(check=True)
+		gemt_message("{0}\nCannot connect to server.".format(err))
+	print('Something is wrong with {} ({})'.format(path, request_id))
 	return None
 
 # ------------------------------------------------------------------
 class gemtViewBulletinBoard(sublime_plugin.ApplicationCommand):
 	def run(self):
-		response = gemtRequest('teacher_gets_passcode', {})
+		gemt_async('teacher_gets_passcode', {}, self.open)
+
+	def open(self, response):
+		if response is None:
+			return
 		if response.startswith('Unauthorized'):
 			sublime.message_dialog('Unauthorized')
 		else:
 			global gemtSERVER
 			p = urllib.parse.urlencode({'pc' : response})
-			with open(gemtFILE, 'r') as f:
-				info = json.loads(f.read())
 			webbrowser.open(gemtSERVER + '/view_bulletin_board?' + p)
 
 # ------------------------------------------------------------------
@@ -263,7 +773,9 @@ class gemtAddBulletin(sublime_plugin.TextCommand):
 		if len(content) <= 20:
 			sublime.message_dialog('Select more text to show on the bulletin board.')
 			return
-		response = gemtRequest('teacher_adds_bulletin_page', {'content':content})
+		gemt_async('teacher_adds_bulletin_page', {'content':content}, self.done)
+
+	def done(self, response):
 		if response:
 			sublime.message_dialog(response)
 
@@ -272,11 +784,20 @@ class gemtPutBack(sublime_plugin.TextCommand):
 	def run(self, edit):
 		fname = self.view.file_name()
 		sid = os.path.basename(os.path.dirname(fname))
-		response = gemtRequest('teacher_puts_back', {'sid':sid})
-		if response:
-			sublime.message_dialog(response)
-		if response != 'Unknown submission.':
-			self.view.window().run_command('close')
+		view = self.view
+		def done(response):
+			if response:
+				sublime.message_dialog(response)
+			if response != 'Unknown submission.':
+				gemt_close_view(view)
+		gemt_async('teacher_puts_back', {'sid':sid}, done)
+
+# ------------------------------------------------------------------
+def gemt_close_view(view):
+	window = view.window()
+	if window is not None:
+		window.focus_view(view)
+		window.run_command('close')
 
 # ------------------------------------------------------------------
 def remove_first_line(content):
@@ -287,44 +808,156 @@ def remove_first_line(content):
 		return content
 
 # ------------------------------------------------------------------
-def gemt_grade(self, edit, decision):
-	fname = self.view.file_name()
+# The text of each opened submission is kept next to it, in <sid>/.original,
+# and only the hashes of recently used ones are kept in memory. Edit
+# detection therefore survives plugin reloads and memory stays bounded.
+# ------------------------------------------------------------------
+gemtOriginalFile = '.original'
+
+class gemtOriginals:
+	def __init__(self, size):
+		self.size = size
+		self.hashes = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	def remember(self, dir, digest):
+		with self.lock:
+			self.hashes.pop(dir, None)
+			self.hashes[dir] = digest
+			while len(self.hashes) > self.size:
+				self.hashes.popitem(last=False)
+
+	def put(self, dir, content):
+		path = os.path.join(dir, gemtOriginalFile)
+		tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+		with open(tmp, 'w', encoding='utf-8') as f:
+			f.write(content)
+		os.replace(tmp, path)
+		self.remember(dir, gemt_normalized_hash(content))
+
+	def get(self, dir):
+		try:
+			with open(os.path.join(dir, gemtOriginalFile), 'r', encoding='utf-8') as f:
+				return f.read()
+		except OSError:
+			return None
+
+	def normalized_hash(self, dir):
+		with self.lock:
+			if dir in self.hashes:
+				self.hashes.move_to_end(dir)
+				return self.hashes[dir]
+		content = self.get(dir)
+		if content is None:
+			return None
+		digest = gemt_normalized_hash(content)
+		self.remember(dir, digest)
+		return digest
+
+gemtORIGINALS = gemtOriginals(gemtOriginalsMax)
+
+# ------------------------------------------------------------------
+def gemt_grade_data(view, decision):
+	fname = view.file_name()
 	changed = False
 	sid = os.path.basename(os.path.dirname(fname))
 	if decision=='dismissed':
 		content = ''
 	else:
-		content = self.view.substr(sublime.Region(0, self.view.size())).strip()
-		if sid in gemtStudentSubmissions:
-			v1 = gemtStudentSubmissions[sid].strip()
-			v2 = content.strip()
-			if remove_first_line(v1) != remove_first_line(v2):
-				changed = True
-
-	stop = False
-	if sid == '0':
-		stop = True
+		content = view.substr(sublime.Region(0, view.size())).strip()
+		original_hash = gemtORIGINALS.normalized_hash(os.path.dirname(fname))
+		if original_hash is not None:
+			changed = original_hash != gemt_normalized_hash(content)
+	return dict(
+		sid = sid,
+		content = content,
+		decision = decision,
+		changed = changed,
+	)
+
+# ------------------------------------------------------------------
+# Edits are detected by comparing hashes of the normalised texts: the
+# header line, line endings and trailing whitespace are ignored.
+# ------------------------------------------------------------------
+def gemt_hash(content):
+	return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def gemt_normalized_hash(content):
+	lines = remove_first_line(content.strip().replace('\r\n', '\n')).split('\n')
+	return gemt_hash('\n'.join(line.rstrip() for line in lines).strip())
+
+# ------------------------------------------------------------------
+# The graded content is sent as line deltas against the submission,
+# ["=", n] keep, ["-", n] drop, ["+", text] insert, when the server
+# supports it. It re-sends in full if the server's copy differs.
+# ------------------------------------------------------------------
+def gemt_lines(text):
+	lines = [line + '\n' for line in text.split('\n')]
+	lines[-1] = lines[-1][:-1]
+	if lines[-1] == '':
+		lines.pop()
+	return lines
+
+def gemt_delta(base, content):
+	a, b = gemt_lines(base), gemt_lines(content)
+	ops = []
+	for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+		if tag == 'equal':
+			ops.append(['=', i2 - i1])
+			continue
+		if i2 > i1:
+			ops.append(['-', i2 - i1])
+		if j2 > j1:
+			ops.append(['+', ''.join(b[j1:j2])])
+	return ops
+
+def gemt_server_features():
+	parts = urllib.parse.urlsplit(gemtSERVER)
+	return gemtFeatures.get((parts.hostname, parts.port or 80), ())
+
+def gemt_compact_grade(data, dir):
+	original = gemtORIGINALS.get(dir)
+	if original is None or data['decision'] == 'dismissed' or 'delta' not in gemt_server_features():
+		return data
+	delta = json.dumps(gemt_delta(original, data['content']))
+	if len(delta) >= len(data['content']):
+		return data
+	compact = dict(data, delta=delta, base_hash=gemt_hash(original), content_hash=gemt_hash(data['content']))
+	del compact['content']
+	return compact
+
+def gemt_send_grade(data, dir):
+	headers = {}
+	compact = gemt_compact_grade(data, dir)
+	response = gemtRequest('teacher_grades', dict(compact), response_headers=headers)
+	if compact is not data and headers.get('x-gem-delta') == 'mismatch':
+		response = gemtRequest('teacher_grades', dict(data))
+	return response
+
+# ------------------------------------------------------------------
+def gemt_is_submission(sid):
 	try:
-		int(sid)
+		return int(sid) != 0
 	except:
-		stop = True
-	if stop:
+		return False
+
+# ------------------------------------------------------------------
+def gemt_grade(self, edit, decision):
+	data = gemt_grade_data(self.view, decision)
+	if not gemt_is_submission(data['sid']):
 		if decision=='dismissed':
-			self.view.window().run_command('close')
+			gemt_close_view(self.view)
 		else:
 			sublime.message_dialog('This is not a graded problem.')
 		return
 
-	data = dict(
-		sid = sid,
-		content = content,
-		decision = decision,
-		changed = changed,
-	)
-	response = gemtRequest('teacher_grades', data)
-	if response:
-		sublime.message_dialog(response)
-		self.view.window().run_command('close')
+	view = self.view
+	def done(response):
+		if response:
+			sublime.message_dialog(response)
+			gemt_close_view(view)
+	dir = os.path.dirname(view.file_name())
+	gemtEXECUTOR.submit('teacher_grades', lambda: gemt_send_grade(data, dir), done)
 
 # ------------------------------------------------------------------
 class gemtUngrade(sublime_plugin.TextCommand):
@@ -344,61 +977,250 @@ class gemtDismissed(sublime_plugin.TextCommand):
 		gemt_grade(self, edit, "dismissed")
 
 # ------------------------------------------------------------------
-def gemt_gets(self, index, priority):
-	global gemtStudentSubmissions
-	response = gemtRequest('teacher_gets', {'index':index, 'priority':priority})
+# Submission tabs can be marked now and graded together in one request.
+# ------------------------------------------------------------------
+def gemt_mark(view, decision):
+	view.settings().set('gem_decision', decision)
+	view.set_status('gem_decision', 'GEM: {}'.format(decision))
+
+class gemtMarkCorrect(sublime_plugin.TextCommand):
+	def run(self, edit):
+		gemt_mark(self.view, 'correct')
+
+class gemtMarkIncorrect(sublime_plugin.TextCommand):
+	def run(self, edit):
+		gemt_mark(self.view, 'incorrect')
+
+class gemtMarkDismissed(sublime_plugin.TextCommand):
+	def run(self, edit):
+		gemt_mark(self.view, 'dismissed')
+
+# ------------------------------------------------------------------
+class gemtGradeMarked(sublime_plugin.WindowCommand):
+	def run(self):
+		views, grades = [], []
+		for view in self.window.views():
+			decision = view.settings().get('gem_decision')
+			if decision is None or view.file_name() is None:
+				continue
+			data = gemt_grade_data(view, decision)
+			if gemt_is_submission(data['sid']):
+				data['sid'] = int(data['sid'])
+				views.append(view)
+				grades.append(gemt_compact_grade(data, os.path.dirname(view.file_name())))
+		if len(grades) == 0:
+			sublime.message_dialog('No submission tabs are marked for grading.')
+			return
+
+		def done(response):
+			if response is None:
+				return
+			summary = json.loads(response)
+			graded = set(r['Sid'] for r in summary['Results'] if r['Graded'])
+			for view, data in zip(views, grades):
+				if data['sid'] in graded:
+					gemt_close_view(view)
+			sublime.message_dialog(summary['Summary'])
+		gemt_async('teacher_grades_batch', {'grades': json.dumps(grades)}, done)
+
+# ------------------------------------------------------------------
+def gemt_gets(self, index, priority, key=0):
+	if index < 0 and key == 0:
+		sub = gemt_take_prefetched(priority)
+		if sub is not None:
+			gemt_async('teacher_opens', {'sid':sub['Sid']})
+			gemt_show_submission(sub, gemt_write_submission(sub))
+			gemt_start_prefetch()
+			return
+	gemt_async('teacher_gets', {'index':index, 'priority':priority, 'key':key},
+		lambda response: gemt_open_submission(response, index, priority, key))
+
+# ------------------------------------------------------------------
+def gemt_write_submission(sub):
+	dir = os.path.join(gemtFOLDER, str(sub['Sid']))
+	if not os.path.exists(dir):
+		os.mkdir(dir)
+	local_file = os.path.join(dir, sub['Filename'])
+	with open(local_file, 'w', encoding='utf-8') as fp:
+		fp.write(sub['Content'])
+	gemtORIGINALS.put(dir, sub['Content'])
+	return local_file
+
+# ------------------------------------------------------------------
+def gemt_show_submission(sub, local_file):
+	if sublime.active_window().id() == 0:
+		sublime.run_command('new_window')
+	sublime.active_window().open_file(local_file)
+	if sub['Priority'] == 2:
+		sublime.message_dialog('This student asked for help.')
+
+# ------------------------------------------------------------------
+def gemt_open_submission(response, index, priority, key=0):
 	if response is not None:
 		sub = json.loads(response)
 		if sub['Content'] != '':
-			filename = sub['Filename']
-			sid = str(sub['Sid'])
-			dir = os.path.join(gemtFOLDER, sid)
-			if not os.path.exists(dir):
-				os.mkdir(dir)
-			local_file = os.path.join(dir, filename)
-			with open(local_file, 'w', encoding='utf-8') as fp:
-				fp.write(sub['Content'])
-			gemtStudentSubmissions[sid] = sub['Content']
-			if sublime.active_window().id() == 0:
-				sublime.run_command('new_window')
-			sublime.active_window().open_file(local_file)
-			if sub['Priority'] == 2:
-				sublime.message_dialog('This student asked for help.')
+			gemt_show_submission(sub, gemt_write_submission(sub))
+			gemt_start_prefetch()
+		elif key > 0:
+			sublime.message_dialog('This submission is no longer in the queue.')
 		elif priority == 0:
 			sublime.message_dialog('There are no submissions.')
 		elif priority > 0:
 			sublime.message_dialog('There are no submissions with priority {}.'.format(priority))
 		elif index >= 0:
 			sublime.message_dialog('There are no submission with index {}.'.format(index))
-		
+
+# ------------------------------------------------------------------
+# The next few submissions are claimed in the background and kept in
+# gemtPrefetched, so getting a submission opens a local file at once.
+# ------------------------------------------------------------------
+def gemt_prefetch_depth():
+	try:
+		return int(gemtINFO.load().get('PrefetchDepth', gemtPrefetchDepth))
+	except ValueError:
+		return gemtPrefetchDepth
+
+# ------------------------------------------------------------------
+def gemt_take_prefetched(priority):
+	with gemtPrefetchLock:
+		expired = [s for s in gemtPrefetched if time.time() - s['Fetched'] > gemtPrefetchLease]
+		for sub in expired:
+			gemtPrefetched.remove(sub)
+			gemt_discard_prefetched(sub)
+		candidates = [s for s in gemtPrefetched if priority == 0 or s['Priority'] == priority]
+		if not candidates:
+			return None
+		sub = max(candidates, key=lambda s: s['Priority'])
+		gemtPrefetched.remove(sub)
+		return sub
+
+# ------------------------------------------------------------------
+def gemt_start_prefetch():
+	global gemtPrefetching
+	with gemtPrefetchLock:
+		if gemtPrefetching or len(gemtPrefetched) >= gemt_prefetch_depth():
+			return
+		gemtPrefetching = True
+	gemtEXECUTOR.submit('prefetch', gemt_prefetch, None)
+
+# ------------------------------------------------------------------
+def gemt_prefetch():
+	global gemtPrefetching
+	try:
+		while len(gemtPrefetched) < gemt_prefetch_depth():
+			response = gemtRequest('teacher_gets', {'index':-1, 'priority':0, 'prefetch':1})
+			if response is None:
+				break
+			sub = json.loads(response)
+			if sub['Content'] == '':
+				break
+			if sub['Sid'] == 0:
+				# Shares of files that are not problems get no lease, so they
+				# are not held back; an older server may still hand one out.
+				local_file = gemt_write_submission(sub)
+				sublime.set_timeout(functools.partial(gemt_show_submission, sub, local_file), 0)
+				break
+			gemt_write_submission(sub)
+			sub['Fetched'] = time.time()
+			with gemtPrefetchLock:
+				gemtPrefetched.append(sub)
+	finally:
+		with gemtPrefetchLock:
+			gemtPrefetching = False
+
+# ------------------------------------------------------------------
+def gemt_put_back_prefetched():
+	with gemtPrefetchLock:
+		subs = list(gemtPrefetched)
+		del gemtPrefetched[:]
+	for sub in subs:
+		gemtRequest('teacher_puts_back', {'sid':sub['Sid'], 'prefetched':1})
+		gemt_discard_prefetched(sub)
+	return len(subs)
+
+def gemt_discard_prefetched(sub):
+	dir = os.path.join(gemtFOLDER, str(sub['Sid']))
+	try:
+		os.remove(os.path.join(dir, sub['Filename']))
+		os.remove(os.path.join(dir, gemtOriginalFile))
+		os.rmdir(dir)
+	except OSError:
+		pass
+
+# ------------------------------------------------------------------
+class gemtPutBackPrefetched(sublime_plugin.ApplicationCommand):
+	def run(self):
+		gemtEXECUTOR.submit('teacher_puts_back', gemt_put_back_prefetched, self.done)
+
+	def done(self, n):
+		sublime.status_message('{} prefetched submission(s) put back.'.format(n))
+
+# ------------------------------------------------------------------
+class gemtSetPrefetchDepth(sublime_plugin.ApplicationCommand):
+	def run(self):
+		if sublime.active_window().id() == 0:
+			sublime.run_command('new_window')
+		sublime.active_window().show_input_panel("Number of submissions to prefetch (0 to disable).  Press Enter:",
+			str(gemt_prefetch_depth()),
+			self.set,
+			None,
+			None)
+
+	def set(self, depth):
+		try:
+			depth = int(depth.strip())
+		except ValueError:
+			sublime.message_dialog("Prefetch depth must be a number.")
+			return
+		gemtINFO.update(PrefetchDepth=max(depth, 0))
+		sublime.message_dialog('Prefetch depth is set to {}.'.format(max(depth, 0)))
+
 # ------------------------------------------------------------------
 class gemtSeeQueue(sublime_plugin.ApplicationCommand):
 	def run(self):
-		response = gemtRequest('teacher_gets_queue', {})
+		gemt_async('teacher_gets_queue', {'summary':1, 'since':gemtQueue['Version'], 'epoch':gemtQueue['Epoch']}, self.show)
+
+	def show(self, response):
 		if response is not None:
-			json_obj = json.loads(response)
-			if json_obj is None:
-				sublime.status_message("Queue is empty.")
+			listing = json.loads(response)
+			now = time.time()
+			for entry in listing['Entries']:
+				entry['Since'] = now - entry['WaitSeconds']
+			if listing['Full']:
+				entries = listing['Entries']
 			else:
-				users = []
-				for entry in json_obj:
-					if entry['Priority'] == 2:
-						status = '😥'
-					elif entry['Priority'] == 1:
-						status = '😎'
-					else:
-						status = ''
-					users.append( '{} {}'.format(entry['Name'], status))
-				if users:
-					sublime.active_window().active_view().show_popup_menu(users, self.request_entry)
+				removed = set(listing['Removed'])
+				entries = [e for e in gemtQueue['Entries'] if e['Key'] not in removed]
+				entries += listing['Entries']
+			gemtQueue.update(Epoch=listing.get('Epoch', 0), Version=listing['Version'], Entries=entries)
+			self.entries = list(entries)
+			users = []
+			for entry in self.entries:
+				if entry['Priority'] == 2:
+					status = '😥'
+				elif entry['Priority'] == 1:
+					status = '😎'
 				else:
-					sublime.status_message("Queue is empty.")
+					status = ''
+				users.append('{} {} {} ({})'.format(entry['Name'], status, entry['Filename'],
+					gemt_wait_time(entry['Since'])))
+			if users:
+				sublime.active_window().active_view().show_popup_menu(users, self.request_entry)
+			else:
+				sublime.status_message("Queue is empty.")
 
 	# ---------------------------------------------------------
 	def request_entry(self, selected):
 		if selected < 0:
 			return
-		gemt_gets(self, selected, 1)
+		gemt_gets(self, -1, 1, key=self.entries[selected]['Key'])
+
+# ------------------------------------------------------------------
+def gemt_wait_time(since):
+	seconds = int(time.time() - since)
+	if seconds < 60:
+		return '{}s'.format(seconds)
+	return '{}m'.format(seconds // 60)
 
 # ------------------------------------------------------------------
 # Priorities: 1 (I got it), 2 (I need help),
@@ -418,11 +1240,7 @@ class gemtGetFromOk(sublime_plugin.ApplicationCommand):
 # ------------------------------------------------------------------
 class gemtSetLocalFolder(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemtFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemtINFO.load()
 		if 'Folder' not in info:
 			info['Folder'] = os.path.join(os.path.expanduser('~'), 'GEMT')
 		if sublime.active_window().id() == 0:
@@ -436,73 +1254,125 @@ class gemtSetLocalFolder(sublime_plugin.ApplicationCommand):
 	def set(self, folder):
 		folder = folder.strip()
 		if len(folder) > 0:
-			try:
-				with open(gemtFILE, 'r') as f:
-					info = json.loads(f.read())
-			except:
-				info = dict()
-			info['Folder'] = folder
 			if not os.path.exists(folder):
 				try:
 					os.mkdir(folder)
-					with open(gemtFILE, 'w') as f:
-						f.write(json.dumps(info, indent=4))
+					gemtINFO.update(Folder=folder)
 				except:
 					sublime.message_dialog('Could not create {}.'.format(folder))
 			else:
-				with open(gemtFILE, 'w') as f:
-					f.write(json.dumps(info, indent=4))
+				gemtINFO.update(Folder=folder)
 				sublime.message_dialog('Folder exists. Will use it to store working files.')
 		else:
 			sublime.message_dialog("Folder name cannot be empty.")
 
 # ------------------------------------------------------------------
-class gemtConnect(sublime_plugin.ApplicationCommand):
-	def run(self):
-		try:
-			with open(gemtFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+# The course server's address from the name server is kept in info,
+# so clients start from it and refresh it in the background once it
+# is older than gemtAddressTTL, or when the server stops answering.
+# ------------------------------------------------------------------
+def gemt_address_key(info):
+	return '{}|{}'.format(info.get('Server'), info.get('CourseId'))
+
+def gemt_cached_address(info):
+	if info.get('AddressFor') == gemt_address_key(info):
+		return info.get('Address', ''), info.get('AddressTime', 0)
+	return '', 0
+
+def gemt_resolve(info):
+	url = urllib.parse.urljoin(info['Server'], 'ask')
+	load = urllib.parse.urlencode({'who':info['CourseId']}).encode('utf-8')
+	server = gemt_urlopen(url, load).decode(encoding="utf-8")
+	if not server.startswith('http://'):
+		return ''
+	gemtINFO.update(Address=server, AddressTime=time.time(), AddressFor=gemt_address_key(info))
+	return server
+
+def gemt_ping(server):
+	try:
+		return gemt_urlopen(urllib.parse.urljoin(server, 'ping'), None, 'GET', timeout=gemtPingTIMEOUT) == b'pong'
+	except urllib.error.URLError:
+		return False
 
-		if 'CourseId' not in info:
-			sublime.message_dialog("Please set the course id.")
-			return None
+def gemt_refresh_address(check=False):
+	global gemtSERVER, gemtRefreshing
+	try:
+		info = gemtINFO.load()
+		if 'Server' not in info or 'CourseId' not in info:
+			return
+		address, at = gemt_cached_address(info)
+		if address != '' and gemtSERVER == '':
+			gemtSERVER = address
+		if check and address != '' and time.time() - at < gemtAddressTTL and gemt_ping(address):
+			return
+		server = gemt_resolve(info)
+		if server != '':
+			gemtSERVER = server
+	except urllib.error.URLError as err:
+		print('Name server unavailable, keeping {}: {}'.format(gemtSERVER, err))
+	finally:
+		with gemtAddressLock:
+			gemtRefreshing = False
+
+def gemt_start_refresh(check=False):
+	global gemtRefreshing
+	with gemtAddressLock:
+		if gemtRefreshing:
+			return
+		gemtRefreshing = True
+	threading.Thread(target=gemt_refresh_address, args=(check,), daemon=True).start()
+
+def gemt_server(info):
+	global gemtSERVER
+	address, at = gemt_cached_address(info)
+	if address == '':
+		return gemt_connect()
+	if gemtSERVER == '':
+		gemtSERVER = address
+	if time.time() - at > gemtAddressTTL:
+		gemt_start_refresh()
+	return True
 
-		if 'Server' not in info:
-			sublime.message_dialog("Please set server address.")
-			return None
+# ------------------------------------------------------------------
+def gemt_connect():
+	global gemtSERVER
+	info = gemtINFO.load()
 
-		global gemtSERVER
-		url = urllib.parse.urljoin(info['Server'], 'ask')
-		load = urllib.parse.urlencode({'who':info['CourseId']}).encode('utf-8')
-		req = urllib.request.Request(url, load)
-		try:
-			with urllib.request.urlopen(req, None, gemtTIMEOUT) as response:
-				server = response.read().decode(encoding="utf-8")
-				try:
-					with open(gemtFILE, 'r') as f:
-						info = json.loads(f.read())
-				except:
-					info = dict()
-				if not server.startswith('http://'):
-					sublime.message_dialog('Unable to get address.')
-					return
-				gemtSERVER = server
-				sublime.status_message('Connected')
-		except urllib.error.HTTPError as err:
-			sublime.message_dialog("{0}".format(err))
-		except urllib.error.URLError as err:
-			sublime.message_dialog("{0}\nCannot connect to server.".format(err))
+	if 'CourseId' not in info:
+		gemt_message("Please set the course id.")
+		return False
+
+	if 'Server' not in info:
+		gemt_message("Please set server address.")
+		return False
+
+	try:
+		server = gemt_resolve(info)
+		if server == '':
+			gemt_message('Unable to get address.')
+			return False
+		gemtSERVER = server
+		sublime.status_message('Connected')
+		return True
+	except urllib.error.HTTPError as err:
+		gemt_message("{0}".format(err))
+	except urllib.error.URLError as err:
+		address, _ = gemt_cached_address(info)
+		if address != '' and gemt_ping(address):
+			gemtSERVER = address
+			sublime.status_message('Name server unavailable. Connected to {}'.format(address))
+			return True
+		gemt_message("{0}\nCannot connect to server.".format(err))
+	return False
+
+class gemtConnect(sublime_plugin.ApplicationCommand):
+	def run(self):
+		gemtEXECUTOR.submit('connect', gemt_connect)
 
 # ------------------------------------------------------------------
 class gemtCompleteRegistration(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemtFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemtINFO.load()
 
 		if 'CourseId' not in info:
 			sublime.message_dialog('Please enter course id.')
@@ -512,11 +1382,14 @@ class gemtCompleteRegistration(sublime_plugin.ApplicationCommand):
 			sublime.message_dialog('Please enter assigned username.')
 			return
 
-		response = gemtRequest(
+		gemt_async(
 			'complete_registration',
 			{'role':'teacher', 'name':info['Name'], 'course_id':info['CourseId']},
+			lambda response: self.done(response, info),
 			authenticated=False,
 		)
+
+	def done(self, response, info):
 		if response is None:
 			sublime.message_dialog('Response is None. Failed to complete registration.')
 			return
@@ -525,20 +1398,13 @@ class gemtCompleteRegistration(sublime_plugin.ApplicationCommand):
 			sublime.message_dialog('Failed to complete registration.')
 		else:
 			uid, password = response.split(',')
-			info['Uid'] = int(uid)
-			info['Password'] = password.strip()
+			gemtINFO.update(Uid=int(uid), Password=password.strip())
 			sublime.message_dialog('{} is registered.'.format(info['Name']))
-		with open(gemtFILE, 'w') as f:
-			f.write(json.dumps(info, indent=4))
 
 # ------------------------------------------------------------------
 class gemtSetServerAddress(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemtFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemtINFO.load()
 		if 'Server' not in info:
 			info['Server'] = ''
 		if sublime.active_window().id() == 0:
@@ -552,16 +1418,9 @@ class gemtSetServerAddress(sublime_plugin.ApplicationCommand):
 	def set(self, addr):
 		addr = addr.strip()
 		if len(addr) > 0:
-			try:
-				with open(gemtFILE, 'r') as f:
-					info = json.loads(f.read())
-			except:
-				info = dict()
 			if not addr.startswith('http://'):
 				addr = 'http://' + addr
-			info['Server'] = addr
-			with open(gemtFILE, 'w') as f:
-				f.write(json.dumps(info, indent=4))
+			gemtINFO.update(Server=addr)
 			sublime.message_dialog('Server address is set to ' + addr)
 		else:
 			sublime.message_dialog("Server address cannot be empty.")
@@ -569,11 +1428,7 @@ class gemtSetServerAddress(sublime_plugin.ApplicationCommand):
 # ------------------------------------------------------------------
 class gemtSetCourseId(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemtFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemtINFO.load()
 
 		if 'CourseId' not in info:
 			info['CourseId'] = ''
@@ -588,14 +1443,7 @@ class gemtSetCourseId(sublime_plugin.ApplicationCommand):
 	def set(self, cid):
 		cid = cid.strip()
 		if len(cid) > 0:
-			try:
-				with open(gemtFILE, 'r') as f:
-					info = json.loads(f.read())
-			except:
-				info = dict()
-			info['CourseId'] = cid
-			with open(gemtFILE, 'w') as f:
-				f.write(json.dumps(info, indent=4))
+			gemtINFO.update(CourseId=cid)
 			sublime.message_dialog('Course id is set to ' + cid)
 		else:
 			sublime.message_dialog("Course id cannot be empty.")
@@ -603,11 +1451,7 @@ class gemtSetCourseId(sublime_plugin.ApplicationCommand):
 # ------------------------------------------------------------------
 class gemtSetName(sublime_plugin.ApplicationCommand):
 	def run(self):
-		try:
-			with open(gemtFILE, 'r') as f:
-				info = json.loads(f.read())
-		except:
-			info = dict()
+		info = gemtINFO.load()
 		if 'Name' not in info:
 			info['Name'] = ''
 		if sublime.active_window().id() == 0:
@@ -621,14 +1465,7 @@ class gemtSetName(sublime_plugin.ApplicationCommand):
 	def set(self, name):
 		name = name.strip()
 		if len(name) > 0:
-			try:
-				with open(gemtFILE, 'r') as f:
-					info = json.loads(f.read())
-			except:
-				info = dict()
-			info['Name'] = name
-			with open(gemtFILE, 'w') as f:
-				f.write(json.dumps(info, indent=4))
+			gemtINFO.update(Name=name)
 			sublime.message_dialog('Assigned name is set to ' + name)
 		else:
 			sublime.message_dialog("Name cannot be empty.")
@@ -647,10 +1484,12 @@ class gemtUpdate(sublime_plugin.WindowCommand):
 			module_file = os.path.join(package_path, "GEMTeacher.py")
 			menu_file = os.path.join(package_path, "Main.sublime-menu")
 			keymap_file = os.path.join(package_path, "Default.sublime-keymap")
+			sidebar_file = os.path.join(package_path, "Side Bar.sublime-menu")
 			version_file = os.path.join(package_path, "version.go")
 			urllib.request.urlretrieve("https://raw.githubusercontent.com/vtphan/GEM/master/src/GEMTeacher/GEMTeacher.py", module_file)
 			urllib.request.urlretrieve("https://raw.githubusercontent.com/vtphan/GEM/master/src/GEMTeacher/Main.sublime-menu", menu_file)
 			urllib.request.urlretrieve("https://raw.githubusercontent.com/vtphan/GEM/master/src/GEMTeacher/Default.sublime-keymap", keymap_file)
+			urllib.request.urlretrieve("https://raw.githubusercontent.com/vtphan/GEM/master/src/GEMTeacher/Side%20Bar.sublime-menu", sidebar_file)
 			urllib.request.urlretrieve("https://raw.githubusercontent.com/vtphan/GEM/master/src/version.go", version_file)
 			with open(version_file) as f:
 				lines = f.readlines()
@@ -665,5 +1504,12 @@ class gemtUpdate(sublime_plugin.WindowCommand):
 			sublime.message_dialog("GEM has been updated to version %s." % version)
 
 # ------------------------------------------------------------------
+def plugin_loaded():
+	gemt_start_refresh(check=True)
 
+# ------------------------------------------------------------------
+def plugin_unloaded():
+	gemt_put_back_prefetched()
+	gemtEXECUTOR.shutdown()
 
+# ------------------------------------------------------------------
@@ -21,10 +21,12 @@ type AnswersBoardMessage struct {
 func view_answersHandler(w http.ResponseWriter, r *http.Request) {
 	filename := r.FormValue("filename")
 	passcode := r.FormValue("pc")
-	if prob, ok := ActiveProblems[filename]; ok && passcode == Passcode {
+	if prob, ok := get_problem(filename); ok && passcode == Passcode {
 		t, err := template.New("").Parse(VIEW_ANSWERS_TEMPLATE)
 		if err == nil {
-			answers := prob.Answers
+			prob.Sem.Lock()
+			answers := append([]string(nil), prob.Answers...)
+			prob.Sem.Unlock()
 			counts := make(map[string]int)
 			total := 0
 			for i := 0; i < len(answers); i++ {
@@ -37,10 +37,11 @@ func Authorize(fn func(http.ResponseWriter, *http.Request, string, int)) http.Ha
 					ok = false
 				}
 			} else {
-				_, ok = Students[uid]
+				var st *StudenInfo
+				st, ok = get_student(uid)
 				if !ok {
 					ok = load_and_authorize_student(uid, r.FormValue("password"))
-				} else if Students[uid].Password != r.FormValue("password") {
+				} else if st.Password != r.FormValue("password") {
 					ok = false
 				}
 			}
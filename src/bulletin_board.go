@@ -7,7 +7,6 @@ import (
 	"encoding/json"
 	"fmt"
 	"html/template"
-	"log"
 	"net/http"
 	"sort"
 	"strconv"
@@ -71,9 +70,11 @@ func get_bulletin_board_data(i int, passcode string) *BulletinBoardMessage {
 
 	// Get priority counts
 	priority := []int{0, 0, 0}
+	QueueSem.Lock()
 	for j := 0; j < len(WorkingSubs); j++ {
 		priority[WorkingSubs[j].Priority]++
 	}
+	QueueSem.Unlock()
 	next_i, prev_i := 0, 0
 	if len(BulletinBoard) > 0 {
 		next_i = (i + 1 + len(BulletinBoard)) % len(BulletinBoard)
@@ -81,14 +82,21 @@ func get_bulletin_board_data(i int, passcode string) *BulletinBoardMessage {
 	}
 	answers := 0
 	keys := make([]string, 0)
-	for key := range ActiveProblems {
+	problems := make(map[string]*ActiveProblem)
+	ProblemsSem.RLock()
+	for key, p := range ActiveProblems {
 		keys = append(keys, key)
+		problems[key] = p
 	}
+	ProblemsSem.RUnlock()
 	sort.Strings(keys)
 	submissions := make([]string, 0)
 	for i, key := range keys {
-		p := ActiveProblems[key]
-		if p.Active {
+		p := problems[key]
+		p.Sem.Lock()
+		active, subs, answered := p.Active, len(p.Attempts), len(p.Answers)
+		p.Sem.Unlock()
+		if active {
 			rows, err := Database.Query("select at from problem where id = ?", p.Info.Pid)
 			if err != nil {
 				fmt.Println("Error retrieving problem starting time", err)
@@ -99,10 +107,9 @@ func get_bulletin_board_data(i int, passcode string) *BulletinBoardMessage {
 				rows.Scan(&starting_time)
 			}
 			duration := time.Since(starting_time).Minutes()
-			subs := len(p.Attempts)
 			label := fmt.Sprintf("P%d: %d subs after %.0fm", i+1, subs, duration)
 			submissions = append(submissions, label)
-			answers += len(p.Answers)
+			answers += answered
 		}
 	}
 	active_problems := strings.Join(submissions, ". ")
@@ -128,7 +135,7 @@ func get_bulletin_board_data(i int, passcode string) *BulletinBoardMessage {
 		// ActiveProblems: len(ActiveProblems),
 		BulletinItems: len(BulletinBoard),
 		AnswerCount:   answers,
-		Attendance:    len(Students),
+		Attendance:    student_count(),
 		Address:       Config.Address,
 		Authenticated: passcode == Passcode,
 	}
@@ -155,7 +162,9 @@ func view_bulletin_boardHandler(w http.ResponseWriter, r *http.Request) {
 	temp := template.New("")
 	t, err2 := temp.Parse(TEACHER_MESSAGING_TEMPLATE)
 	if err2 != nil {
-		log.Fatal(err2)
+		writeLog(Config.LogFile, fmt.Sprintf("Unable to parse bulletin board template: %s", err2))
+		http.Error(w, err2.Error(), http.StatusInternalServerError)
+		return
 	}
 	data := get_bulletin_board_data(i, passcode)
 	w.Header().Set("Content-Type", "text/html")
@@ -0,0 +1,56 @@
+package main
+
+import (
+	"compress/gzip"
+	"io"
+	"net/http"
+	"strings"
+)
+
+//-----------------------------------------------------------------
+// Clients only compress request bodies or send deltas after seeing
+// this header, so plain form posts from old clients keep working.
+//-----------------------------------------------------------------
+const Features = "gzip,delta"
+
+type gzipResponseWriter struct {
+	http.ResponseWriter
+	gz io.Writer
+}
+
+func (w *gzipResponseWriter) Write(b []byte) (int, error) {
+	if w.Header().Get("Content-Type") == "" {
+		w.Header().Set("Content-Type", http.DetectContentType(b))
+	}
+	return w.gz.Write(b)
+}
+
+//-----------------------------------------------------------------
+// Accept gzip-encoded request bodies and gzip responses for clients
+// that ask for it.
+//-----------------------------------------------------------------
+func Compressed(fn http.HandlerFunc) http.HandlerFunc {
+	return func(w http.ResponseWriter, r *http.Request) {
+		w.Header().Set("X-Gem-Features", Features)
+		if r.Header.Get("Content-Encoding") == "gzip" {
+			body, err := gzip.NewReader(r.Body)
+			if err != nil {
+				http.Error(w, "Unable to read compressed request.", http.StatusBadRequest)
+				return
+			}
+			defer body.Close()
+			r.Body = body
+			r.Header.Del("Content-Encoding")
+			r.ContentLength = -1
+		}
+		if !strings.Contains(r.Header.Get("Accept-Encoding"), "gzip") {
+			fn(w, r)
+			return
+		}
+		w.Header().Set("Content-Encoding", "gzip")
+		w.Header().Add("Vary", "Accept-Encoding")
+		gz := gzip.NewWriter(w)
+		defer gz.Close()
+		fn(&gzipResponseWriter{ResponseWriter: w, gz: gz}, r)
+	}
+}
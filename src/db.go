@@ -26,10 +26,41 @@ func create_tables() {
 	execSQL("create table if not exists problem (id integer primary key, tid integer, content blob, answer text, filename text, merit integer, effort integer, attempts integer, tag integer, at timestamp)")
 	execSQL("create table if not exists submission (id integer primary key, pid integer, sid integer, content blob, priority integer, at timestamp, completed timestamp)")
 	execSQL("create table if not exists score (id integer primary key, pid integer, stid integer, tid integer, points integer, attempts integer, at timestamp, unique(pid,stid))")
+	// updated orders score changes for clients syncing their points
+	// incrementally.  It is one more than the largest so far, assigned while
+	// the write holds the database's write lock, so it follows commit order.
+	if !has_column("score", "updated") {
+		execSQL("alter table score add column updated integer")
+	}
+	execSQL("create index if not exists score_updated on score (updated)")
 	execSQL("create table if not exists feedback (id integer primary key, tid integer, stid integer, content text, date timestamp)")
 	// foreign key example: http://www.sqlitetutorial.net/sqlite-foreign-key/
 }
 
+// The version given to a score as it is added or updated; see create_tables.
+const NextScoreVersion = "(select coalesce(max(updated), 0) + 1 from score)"
+
+//-----------------------------------------------------------------
+// Whether a table has a column, for migrating existing databases.
+//-----------------------------------------------------------------
+func has_column(table, column string) bool {
+	rows, err := Database.Query(fmt.Sprintf("pragma table_info(%s)", table))
+	if err != nil {
+		log.Fatal(err)
+	}
+	defer rows.Close()
+	var cid, notnull, pk int
+	var name, ctype string
+	var dflt sql.NullString
+	for rows.Next() {
+		rows.Scan(&cid, &name, &ctype, &notnull, &dflt, &pk)
+		if name == column {
+			return true
+		}
+	}
+	return false
+}
+
 //-----------------------------------------------------------------
 func init_database(db_name string) {
 	var err error
@@ -41,7 +72,12 @@ func init_database(db_name string) {
 		return stmt
 	}
 
-	Database, err = sql.Open("sqlite3", db_name)
+	// WAL lets the queries of reports and handlers run while writes are
+	// committed; busy_timeout makes a writer wait instead of failing.
+	// Transactions take the write lock when they begin (_txlock=immediate),
+	// so one that reads before writing, such as a batch of grades, waits
+	// for the write-behind writer instead of failing with a stale snapshot.
+	Database, err = sql.Open("sqlite3", db_name+"?_journal_mode=WAL&_synchronous=NORMAL&_busy_timeout=5000&_txlock=immediate")
 	if err != nil {
 		log.Fatal(err)
 	}
@@ -52,28 +88,46 @@ func init_database(db_name string) {
 	AddSubmissionSQL = prepare("insert into submission (pid, sid, content, priority, at) values (?, ?, ?, ?, ?)")
 	AddSubmissionCompleteSQL = prepare("insert into submission (pid, sid, content, priority, at, completed) values (?, ?, ?, ?, ?, ?)")
 	CompleteSubmissionSQL = prepare("update submission set completed=? where id=?")
-	AddScoreSQL = prepare("insert into score (pid, stid, tid, points, attempts, at) values (?, ?, ?, ?, ?, ?)")
+	AddScoreSQL = prepare("insert into score (pid, stid, tid, points, attempts, at, updated) values (?, ?, ?, ?, ?, ?, " + NextScoreVersion + ")")
 	AddFeedbackSQL = prepare("insert into feedback (tid, stid, content, date) values (?, ?, ?, ?)")
-	UpdateScoreSQL = prepare("update score set tid=?, points=?, attempts=? where id=?")
+	UpdateScoreSQL = prepare("update score set tid=?, points=?, attempts=?, updated=" + NextScoreVersion + " where id=?")
 	AddAttendanceSQL = prepare("insert into attendance (stid, at) values (?, ?)")
 	AddTagSQL = prepare("insert into tag (description) values (?)")
-	// Initialize passcode for current session and default board
+	go db_writer()
+	// Initialize passcode for current session
 	Passcode = RandStringRunes(12)
-	Students[0] = &StudenInfo{
-		Boards: make([]*Board, 0),
+}
+
+//-----------------------------------------------------------------
+// Statements run inside tx when one is given, else directly.
+//-----------------------------------------------------------------
+func in_tx(tx *sql.Tx, stmt *sql.Stmt) *sql.Stmt {
+	if tx == nil {
+		return stmt
 	}
+	return tx.Stmt(stmt)
 }
 
 //-----------------------------------------------------------------
 // Add or update score based on a decision. If decision is "correct"
-// a new problem, if there's one, is added to student's board.
+// a new problem, if there's one, is added to student's board.  The
+// error is set if the score could not be read or written.
 //-----------------------------------------------------------------
-func add_or_update_score(decision string, pid, stid, tid, partial_credits int) string {
+func add_or_update_score(tx *sql.Tx, decision string, pid, stid, tid, partial_credits int) (string, error) {
 	mesg := ""
+	query := Database.Query
+	if tx != nil {
+		query = tx.Query
+	}
 
 	// Find score information for this student (stid) for this problem (pid)
 	score_id, current_points, current_attempts, current_tid := 0, 0, 0, 0
-	rows, _ := Database.Query("select id, points, attempts, tid from score where pid=? and stid=?", pid, stid)
+	rows, err := query("select id, points, attempts, tid from score where pid=? and stid=?", pid, stid)
+	if err != nil {
+		mesg = fmt.Sprintf("Unable to read score: %d %d", pid, stid)
+		writeLog(Config.LogFile, mesg)
+		return mesg, err
+	}
 	for rows.Next() {
 		rows.Scan(&score_id, &current_points, &current_attempts, &current_tid)
 		break
@@ -82,7 +136,12 @@ func add_or_update_score(decision string, pid, stid, tid, partial_credits int) s
 
 	// Find merit points and effort points for this problem (pid)
 	merit, effort := 0, 0
-	rows, _ = Database.Query("select merit, effort from problem where id=?", pid)
+	rows, err = query("select merit, effort from problem where id=?", pid)
+	if err != nil {
+		mesg = fmt.Sprintf("Unable to read problem: %d", pid)
+		writeLog(Config.LogFile, mesg)
+		return mesg, err
+	}
 	for rows.Next() {
 		rows.Scan(&merit, &effort)
 		break
@@ -114,21 +173,21 @@ func add_or_update_score(decision string, pid, stid, tid, partial_credits int) s
 
 	// Add a new score or update a current score for this student & problem
 	if score_id == 0 {
-		_, err := AddScoreSQL.Exec(pid, stid, tid, points, current_attempts+1, time.Now())
+		_, err := in_tx(tx, AddScoreSQL).Exec(pid, stid, tid, points, current_attempts+1, time.Now())
 		if err != nil {
 			mesg = fmt.Sprintf("Unable to add score: %d %d %d", pid, stid, tid)
 			writeLog(Config.LogFile, mesg)
-			return mesg
+			return mesg, err
 		}
 	} else {
-		_, err := UpdateScoreSQL.Exec(teacher, points, current_attempts+1, score_id)
+		_, err := in_tx(tx, UpdateScoreSQL).Exec(teacher, points, current_attempts+1, score_id)
 		if err != nil {
 			mesg = fmt.Sprintf("Unable to update score: %d %d", teacher, score_id)
 			writeLog(Config.LogFile, mesg)
-			return mesg
+			return mesg, err
 		}
 	}
-	return mesg
+	return mesg, nil
 }
 
 //-----------------------------------------------------------------
@@ -140,14 +199,17 @@ func init_teacher(id int, password string) {
 // initialize once per session
 //-----------------------------------------------------------------
 func init_student(stid int, password string) {
-	AddAttendanceSQL.Exec(stid, time.Now())
-
-	BoardsSem.Lock()
-	defer BoardsSem.Unlock()
-
-	Students[stid] = &StudenInfo{
+	StudentsSem.Lock()
+	if _, ok := Students[stid]; ok {
+		// Initialized by a concurrent request
+		StudentsSem.Unlock()
+		return
+	}
+	// The cursor starts at 0, so the student gets all boards of the session.
+	st := &StudenInfo{
 		Password:         password,
-		Boards:           make([]*Board, 0),
+		Feedback:         make([]*Board, 0),
+		Updated:          make(chan bool, 1),
 		SubmissionStatus: 0,
 	}
 
@@ -155,17 +217,10 @@ func init_student(stid int, password string) {
 	// MessageBoards[stid] = ""
 	// Boards[stid] = make([]*Board, 0)
 
-	for i := 0; i < len(Students[0].Boards); i++ {
-		b := &Board{
-			Content:      Students[0].Boards[i].Content,
-			Answer:       Students[0].Boards[i].Answer,
-			Attempts:     Students[0].Boards[i].Attempts,
-			Filename:     Students[0].Boards[i].Filename,
-			Pid:          Students[0].Boards[i].Pid,
-			StartingTime: time.Now(),
-		}
-		Students[stid].Boards = append(Students[stid].Boards, b)
-	}
+	Students[stid] = st
+	StudentsSem.Unlock()
+
+	db_write(AddAttendanceSQL, stid, time.Now())
 }
 
 //-----------------------------------------------------------------
@@ -0,0 +1,142 @@
+package main
+
+import (
+	"database/sql"
+	"fmt"
+	"time"
+)
+
+//-----------------------------------------------------------------
+// Write-behind: inserts and updates queued with db_write are run by a
+// single goroutine, batched into short transactions so that many writes
+// share one commit.  A batch takes whatever is queued, waiting up to
+// Config.WriteDelay milliseconds for more, and at most WriteBatchMax
+// statements.  A negative WriteDelay runs every write directly.
+//-----------------------------------------------------------------
+var WriteBatchMax = 200
+var WriteQueue = make(chan *DBWrite, 4096)
+
+type DBWrite struct {
+	Stmt   *sql.Stmt
+	Args   []interface{}
+	Result chan *DBResult // nil if nobody waits for the write
+}
+
+type DBResult struct {
+	Id  int64 // last insert id
+	Err error
+}
+
+//-----------------------------------------------------------------
+// Queue a write.  Errors are logged by the writer.
+//-----------------------------------------------------------------
+func db_write(stmt *sql.Stmt, args ...interface{}) {
+	w := &DBWrite{Stmt: stmt, Args: args}
+	if Config.WriteDelay < 0 {
+		log_write_error(w, exec_write(nil, w))
+		return
+	}
+	WriteQueue <- w
+}
+
+//-----------------------------------------------------------------
+// Queue a write and wait until it is committed.
+//-----------------------------------------------------------------
+func db_write_wait(stmt *sql.Stmt, args ...interface{}) (int64, error) {
+	w := &DBWrite{Stmt: stmt, Args: args, Result: make(chan *DBResult, 1)}
+	if Config.WriteDelay < 0 {
+		res := exec_write(nil, w)
+		return res.Id, res.Err
+	}
+	WriteQueue <- w
+	res := <-w.Result
+	return res.Id, res.Err
+}
+
+//-----------------------------------------------------------------
+// Run a write inside tx when one is given, else queue it.
+//-----------------------------------------------------------------
+func db_write_in(tx *sql.Tx, stmt *sql.Stmt, args ...interface{}) {
+	if tx == nil {
+		db_write(stmt, args...)
+		return
+	}
+	w := &DBWrite{Stmt: stmt, Args: args}
+	log_write_error(w, exec_write(tx, w))
+}
+
+//-----------------------------------------------------------------
+func db_writer() {
+	delay := time.Duration(Config.WriteDelay) * time.Millisecond
+	for w := range WriteQueue {
+		batch := []*DBWrite{w}
+		deadline := time.After(delay)
+	collect:
+		for len(batch) < WriteBatchMax {
+			select {
+			case w := <-WriteQueue:
+				batch = append(batch, w)
+			default:
+				if delay == 0 {
+					break collect
+				}
+				select {
+				case w := <-WriteQueue:
+					batch = append(batch, w)
+				case <-deadline:
+					break collect
+				}
+			}
+		}
+		run_batch(batch)
+	}
+}
+
+//-----------------------------------------------------------------
+func run_batch(batch []*DBWrite) {
+	results, err := exec_batch(batch)
+	if err != nil {
+		// One bad statement must not lose the others; run them one by one.
+		writeLog(Config.LogFile, fmt.Sprintf("Batch of %d writes failed, writing them singly: %s", len(batch), err))
+		for i, w := range batch {
+			results[i] = exec_write(nil, w)
+		}
+	}
+	for i, w := range batch {
+		log_write_error(w, results[i])
+		if w.Result != nil {
+			w.Result <- results[i]
+		}
+	}
+}
+
+func exec_batch(batch []*DBWrite) ([]*DBResult, error) {
+	results := make([]*DBResult, len(batch))
+	tx, err := Database.Begin()
+	if err != nil {
+		return results, err
+	}
+	for i, w := range batch {
+		results[i] = exec_write(tx, w)
+		if results[i].Err != nil {
+			tx.Rollback()
+			return results, results[i].Err
+		}
+	}
+	return results, tx.Commit()
+}
+
+func exec_write(tx *sql.Tx, w *DBWrite) *DBResult {
+	result, err := in_tx(tx, w.Stmt).Exec(w.Args...)
+	if err != nil {
+		return &DBResult{Err: err}
+	}
+	id, err := result.LastInsertId()
+	return &DBResult{Id: id, Err: err}
+}
+
+func log_write_error(w *DBWrite, res *DBResult) {
+	if res.Err != nil {
+		writeLog(Config.LogFile, fmt.Sprintf("Unable to write %.80v: %s", w.Args, res.Err))
+	}
+}
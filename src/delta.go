@@ -0,0 +1,192 @@
+package main
+
+import (
+	"bytes"
+	"crypto/sha1"
+	"encoding/hex"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"strings"
+	"sync"
+)
+
+//-----------------------------------------------------------------
+// A delta is a JSON list of line operations against a base text:
+//   ["=", n] keeps the next n lines, ["-", n] drops them,
+//   ["+", text] inserts text.
+//-----------------------------------------------------------------
+func content_hash(content string) string {
+	h := sha1.Sum([]byte(content))
+	return hex.EncodeToString(h[:])
+}
+
+//-----------------------------------------------------------------
+// Lines keep their "\n", so joining them gives back the text.
+//-----------------------------------------------------------------
+func split_lines(text string) []string {
+	lines := strings.SplitAfter(text, "\n")
+	if len(lines) > 0 && lines[len(lines)-1] == "" {
+		lines = lines[:len(lines)-1]
+	}
+	return lines
+}
+
+//-----------------------------------------------------------------
+func apply_delta(base, delta string) (string, error) {
+	ops := make([][]interface{}, 0)
+	if err := json.Unmarshal([]byte(delta), &ops); err != nil {
+		return "", err
+	}
+	lines := split_lines(base)
+	var out bytes.Buffer
+	i := 0
+	for _, op := range ops {
+		if len(op) != 2 {
+			return "", errors.New("malformed delta")
+		}
+		code, _ := op[0].(string)
+		switch code {
+		case "=", "-":
+			n, ok := op[1].(float64)
+			if !ok || n < 0 || i+int(n) > len(lines) {
+				return "", errors.New("delta does not match base")
+			}
+			if code == "=" {
+				out.WriteString(strings.Join(lines[i:i+int(n)], ""))
+			}
+			i += int(n)
+		case "+":
+			text, ok := op[1].(string)
+			if !ok {
+				return "", errors.New("malformed delta")
+			}
+			out.WriteString(text)
+		default:
+			return "", fmt.Errorf("unknown delta operation %q", code)
+		}
+	}
+	if i != len(lines) {
+		return "", errors.New("delta does not cover base")
+	}
+	return out.String(), nil
+}
+
+//-----------------------------------------------------------------
+// The last content each student shared for each file, the base for
+// delta-encoded resubmissions.
+//-----------------------------------------------------------------
+var LastShared = make(map[string]string)
+var LastSharedSem sync.Mutex
+
+func remember_shared(uid int, filename, content string) {
+	LastSharedSem.Lock()
+	defer LastSharedSem.Unlock()
+	LastShared[fmt.Sprintf("%d/%s", uid, filename)] = content
+}
+
+//-----------------------------------------------------------------
+// Rebuild a resubmission from its delta; false if the client's base
+// is not what the server has, or the result fails verification.
+//-----------------------------------------------------------------
+func rebuild_shared(uid int, filename, base_hash, delta, want_hash string) (string, bool) {
+	LastSharedSem.Lock()
+	base, ok := LastShared[fmt.Sprintf("%d/%s", uid, filename)]
+	LastSharedSem.Unlock()
+	if !ok || content_hash(base) != base_hash {
+		return "", false
+	}
+	content, err := apply_delta(base, delta)
+	if err != nil || content_hash(content) != want_hash {
+		return "", false
+	}
+	return content, true
+}
+
+//-----------------------------------------------------------------
+// Render the changes from original to revised as an annotated patch:
+// hunks of removed (-) and added (+) lines, with a line of context.
+// Trailing whitespace is ignored, as graders' edit detection does.
+// Very large inputs are not diffed; the revised text is returned.
+//-----------------------------------------------------------------
+const MaxDiffCells = 4000000
+
+type patchLine struct {
+	Code byte
+	Text string
+	At   int
+}
+
+func feedback_patch(filename, original, revised string) string {
+	a, b := split_lines(original), split_lines(revised)
+	if len(a)*len(b) > MaxDiffCells {
+		return revised
+	}
+	for i := range a {
+		a[i] = strings.TrimRight(a[i], " \t\r\n")
+	}
+	for j := range b {
+		b[j] = strings.TrimRight(b[j], " \t\r\n")
+	}
+
+	// lcs[i][j] is the length of the longest common subsequence of a[i:] and b[j:]
+	lcs := make([][]int32, len(a)+1)
+	for i := range lcs {
+		lcs[i] = make([]int32, len(b)+1)
+	}
+	for i := len(a) - 1; i >= 0; i-- {
+		for j := len(b) - 1; j >= 0; j-- {
+			if a[i] == b[j] {
+				lcs[i][j] = lcs[i+1][j+1] + 1
+			} else if lcs[i+1][j] >= lcs[i][j+1] {
+				lcs[i][j] = lcs[i+1][j]
+			} else {
+				lcs[i][j] = lcs[i][j+1]
+			}
+		}
+	}
+	lines := make([]patchLine, 0, len(a)+len(b))
+	i, j := 0, 0
+	for i < len(a) || j < len(b) {
+		if i < len(a) && j < len(b) && a[i] == b[j] {
+			lines = append(lines, patchLine{' ', a[i], i + 1})
+			i, j = i+1, j+1
+		} else if i < len(a) && (j == len(b) || lcs[i+1][j] >= lcs[i][j+1]) {
+			lines = append(lines, patchLine{'-', a[i], i + 1})
+			i++
+		} else {
+			lines = append(lines, patchLine{'+', b[j], i + 1})
+			j++
+		}
+	}
+
+	var out bytes.Buffer
+	write := func(code byte, text string) {
+		out.WriteByte(code)
+		out.WriteByte(' ')
+		out.WriteString(text)
+		out.WriteByte('\n')
+	}
+	fmt.Fprintf(&out, "Feedback on %s: lines marked - were removed and lines marked + were added by your teacher.\n", filename)
+	for k := 0; k < len(lines); {
+		if lines[k].Code == ' ' {
+			k++
+			continue
+		}
+		start := k
+		for k < len(lines) && lines[k].Code != ' ' {
+			k++
+		}
+		fmt.Fprintf(&out, "\n@@ line %d @@\n", lines[start].At)
+		if start > 0 {
+			write(' ', lines[start-1].Text)
+		}
+		for m := start; m < k; m++ {
+			write(lines[m].Code, lines[m].Text)
+		}
+		if k < len(lines) {
+			write(' ', lines[k].Text)
+		}
+	}
+	return out.String()
+}
@@ -5,6 +5,7 @@ package main
 
 import (
 	"database/sql"
+	"fmt"
 	"log"
 	"math/rand"
 	"os"
@@ -21,6 +22,7 @@ type Configuration struct {
 	Database   string
 	Address    string
 	LogFile    string
+	WriteDelay int // milliseconds a write may wait to be batched; negative writes at once
 }
 
 var Config *Configuration
@@ -51,10 +53,19 @@ var Passcode string
 
 //---------------------------------------------------------
 // Semaphores
+//
+// StudentsSem guards the Students map and ProblemsSem the ActiveProblems
+// map.  Each student's boards and status, and each problem's attempts
+// and answers, are guarded by the student's or problem's own Sem, so
+// requests of different students do not wait for each other.  QueueSem
+// guards WorkingSubs, Submissions and the queue log.  Locks are taken in
+// this order: QueueSem, then StudentsSem or ProblemsSem, then a student's
+// or a problem's Sem.
 //---------------------------------------------------------
 
-var BoardsSem sync.Mutex
-var SubSem sync.Mutex
+var StudentsSem sync.RWMutex
+var ProblemsSem sync.RWMutex
+var QueueSem sync.Mutex
 var BulletinSem sync.Mutex
 
 //---------------------------------------------------------
@@ -73,7 +84,12 @@ type Board struct {
 
 type StudenInfo struct {
 	Password         string
-	Boards           []*Board
+	Sem              sync.Mutex // guards the fields below
+	Cursor           int        // boards of BoardLog already delivered to the student
+	Feedback         []*Board   // boards for this student only, not yet delivered
+	FeedbackVersion  int        // incremented whenever feedback is added
+	Updated          chan bool  // signalled when SubmissionStatus or Feedback change
+	Grading          int        // submissions taken by a teacher but not yet graded
 	SubmissionStatus int
 	/*
 		1 submission being looked at.
@@ -85,6 +101,86 @@ type StudenInfo struct {
 
 var Students = make(map[int]*StudenInfo)
 
+//---------------------------------------------------------
+// Broadcast boards are appended once to BoardLog, shared by all students,
+// who each keep a cursor into it.  The log only grows, so a slice of it
+// can be read after BoardLogSem is released.  BoardLogChanged is closed,
+// and replaced, whenever the log grows; this wakes up every pending
+// student_waits_update at once.  BoardLogSem is taken last: a student's
+// cursor is compared with the log while holding the student's Sem.
+//---------------------------------------------------------
+var BoardLog = make([]*Board, 0)
+var BoardLogChanged = make(chan bool)
+var BoardLogSem sync.RWMutex
+
+func append_board_log(boards []*Board) {
+	BoardLogSem.Lock()
+	defer BoardLogSem.Unlock()
+	BoardLog = append(BoardLog, boards...)
+	close(BoardLogChanged)
+	BoardLogChanged = make(chan bool)
+}
+
+// The board log so far and a channel closed when it next grows.
+func board_log() ([]*Board, chan bool) {
+	BoardLogSem.RLock()
+	defer BoardLogSem.RUnlock()
+	return BoardLog, BoardLogChanged
+}
+
+// A student's boards version counts broadcasts and the student's feedback.
+func boards_version(st *StudenInfo, log []*Board) int {
+	return len(log) + st.FeedbackVersion
+}
+
+func get_student(stid int) (*StudenInfo, bool) {
+	StudentsSem.RLock()
+	defer StudentsSem.RUnlock()
+	st, ok := Students[stid]
+	return st, ok
+}
+
+func student_count() int {
+	StudentsSem.RLock()
+	defer StudentsSem.RUnlock()
+	return len(Students)
+}
+
+//---------------------------------------------------------
+// Set a student's submission status and wake up their pending update.
+//---------------------------------------------------------
+func set_submission_status(stid, status int) {
+	if st, ok := get_student(stid); ok {
+		st.Sem.Lock()
+		st.SubmissionStatus = status
+		st.Sem.Unlock()
+		notify(st)
+	}
+}
+
+//---------------------------------------------------------
+// Change the number of a student's submissions being graded.
+//---------------------------------------------------------
+func add_grading(stid, n int) {
+	if st, ok := get_student(stid); ok {
+		st.Sem.Lock()
+		defer st.Sem.Unlock()
+		if st.Grading+n >= 0 {
+			st.Grading += n
+		}
+	}
+}
+
+// How long student_waits_update holds a request when nothing changes.
+var StudentWaitTimeout = 45 * time.Second
+
+// Polling intervals (seconds) advised to clients of student_periodic_update.
+const (
+	PollIntervalGrading = 5
+	PollIntervalMin     = 10
+	PollIntervalMax     = 60
+)
+
 //---------------------------------------------------------
 
 var BulletinBoard = make([]string, 0)
@@ -92,6 +188,7 @@ var BulletinBoard = make([]string, 0)
 //---------------------------------------------------------
 type Submission struct {
 	Sid      int // submission id
+	Key      int // queue key, unique even for shares that are not problems (Sid 0)
 	Uid      int // student id
 	Pid      int // problem id
 	Content  string
@@ -104,6 +201,111 @@ type Submission struct {
 var WorkingSubs = make([]*Submission, 0)
 var Submissions = make(map[int]*Submission)
 
+func find_submission(sid int) (*Submission, bool) {
+	QueueSem.Lock()
+	defer QueueSem.Unlock()
+	sub, ok := Submissions[sid]
+	return sub, ok
+}
+
+//---------------------------------------------------------
+// A prefetched submission is leased to its grader until teacher_opens
+// confirms it.  Unconfirmed ones go back to the queue when the lease runs
+// out, so a grader who quits the editor does not strand them.
+//---------------------------------------------------------
+const PrefetchLease = 5 * time.Minute
+
+var Prefetched = make(map[int]time.Time) // sid -> end of lease, guarded by QueueSem
+
+// Put submissions whose lease ran out back in the queue.  QueueSem must be held.
+func reclaim_prefetched() {
+	now := time.Now()
+	for sid, end := range Prefetched {
+		if now.After(end) {
+			delete(Prefetched, sid)
+			if sub, ok := Submissions[sid]; ok {
+				WorkingSubs = append(WorkingSubs, sub)
+				queue_changed(sub.Key, false)
+			}
+		}
+	}
+}
+
+//---------------------------------------------------------
+// Every change to WorkingSubs bumps QueueVersion and is logged, so a queue
+// listing can be refreshed with only the changes since a known version.
+// Changes and claims refer to a submission by its queue key, as shares
+// that are not problems all have Sid 0.
+//---------------------------------------------------------
+type QueueChange struct {
+	Version int
+	Key     int
+	Removed bool
+}
+
+type QueueEntry struct {
+	Key         int
+	Sid         int
+	Uid         int
+	Name        string
+	Filename    string
+	Priority    int
+	WaitSeconds int
+}
+
+type QueueListing struct {
+	Epoch   int64
+	Version int
+	Full    bool
+	Entries []*QueueEntry
+	Removed []int
+}
+
+// QueueVersion starts over when the server restarts; QueueEpoch tells
+// clients which run of the server their version belongs to.
+var QueueEpoch = time.Now().UnixNano()
+var QueueVersion = 0
+var QueueChanges = make([]*QueueChange, 0)
+var QueueKeys = 0
+
+const QueueChangesMax = 1000
+
+// A key for a new submission.  QueueSem must be held.
+func next_queue_key() int {
+	QueueKeys++
+	return QueueKeys
+}
+
+func queue_changed(key int, removed bool) {
+	QueueVersion++
+	QueueChanges = append(QueueChanges, &QueueChange{QueueVersion, key, removed})
+	if len(QueueChanges) > QueueChangesMax {
+		QueueChanges = QueueChanges[len(QueueChanges)-QueueChangesMax:]
+	}
+}
+
+//---------------------------------------------------------
+type GradeRequest struct {
+	Sid         int
+	Content     string
+	Decision    string
+	Changed     bool
+	Delta       string
+	BaseHash    string `json:"base_hash"`
+	ContentHash string `json:"content_hash"`
+}
+
+type GradeResult struct {
+	Sid     int
+	Message string
+	Graded  bool
+}
+
+type GradeSummary struct {
+	Summary string
+	Results []*GradeResult
+}
+
 //---------------------------------------------------------
 type ProblemInfo struct {
 	Description string
@@ -118,6 +320,7 @@ type ProblemInfo struct {
 }
 
 type ActiveProblem struct {
+	Sem      sync.Mutex // guards Answers, Active and Attempts
 	Info     *ProblemInfo
 	Answers  []string
 	Active   bool
@@ -126,6 +329,51 @@ type ActiveProblem struct {
 
 var ActiveProblems = make(map[string]*ActiveProblem)
 
+func get_problem(filename string) (*ActiveProblem, bool) {
+	ProblemsSem.RLock()
+	defer ProblemsSem.RUnlock()
+	prob, ok := ActiveProblems[filename]
+	return prob, ok
+}
+
+//---------------------------------------------------------
+// Take one of a student's attempts at a problem, if counted.  Returns the
+// attempts left, or false if the student has none left.
+//---------------------------------------------------------
+func take_attempt(prob *ActiveProblem, stid int, counted bool) (int, bool) {
+	prob.Sem.Lock()
+	defer prob.Sem.Unlock()
+	if _, ok := prob.Attempts[stid]; !ok {
+		prob.Attempts[stid] = prob.Info.Attempts
+	}
+	if prob.Attempts[stid] == 0 {
+		return 0, false
+	}
+	if counted {
+		prob.Attempts[stid] -= 1
+	}
+	return prob.Attempts[stid], true
+}
+
+func add_attempts(prob *ActiveProblem, stid, n int) {
+	prob.Sem.Lock()
+	defer prob.Sem.Unlock()
+	prob.Attempts[stid] += n
+}
+
+// No further submissions of the problem are taken from the student.
+func end_attempts(prob *ActiveProblem, stid int) {
+	prob.Sem.Lock()
+	defer prob.Sem.Unlock()
+	prob.Attempts[stid] = 0
+}
+
+func record_answer(prob *ActiveProblem, answer string) {
+	prob.Sem.Lock()
+	defer prob.Sem.Unlock()
+	prob.Answers = append(prob.Answers, answer)
+}
+
 //---------------------------------------------------------
 // Utilities
 //---------------------------------------------------------
@@ -140,15 +388,32 @@ func RandStringRunes(n int) string {
 	return string(b)
 }
 
+//-----------------------------------------------------------------------------
+// Wake up a student's pending student_waits_update request, if any.
+//-----------------------------------------------------------------------------
+func notify_student(stid int) {
+	if st, ok := get_student(stid); ok {
+		notify(st)
+	}
+}
+
+func notify(st *StudenInfo) {
+	select {
+	case st.Updated <- true:
+	default:
+	}
+}
+
 //-----------------------------------------------------------------------------
 func writeLog(filename, message string) {
 	f, err := os.OpenFile(filename, os.O_WRONLY|os.O_CREATE|os.O_APPEND, 0644)
 	if err != nil {
-		log.Fatal(err)
+		// Losing the log must not stop the class.
+		fmt.Println(time.Now(), " ", message)
+		return
 	}
 	defer f.Close()
-	log.SetOutput(f)
-	log.Println(time.Now(), " ", message)
+	log.New(f, "", log.LstdFlags).Println(time.Now(), " ", message)
 }
 
 //---------------------------------------------------------
@@ -32,11 +32,12 @@ func init_handlers() {
 
 	// Others
 	http.HandleFunc("/student_periodic_update", Authorize(student_periodic_updateHandler))
+	http.HandleFunc("/student_waits_update", Authorize(student_waits_updateHandler))
 
 	http.HandleFunc("/student_gets_report", Authorize(student_gets_reportHandler))
 	http.HandleFunc("/student_checks_in", Authorize(student_checks_inHandler))
-	http.HandleFunc("/student_shares", Authorize(student_sharesHandler))
-	http.HandleFunc("/student_gets", Authorize(student_getsHandler))
+	http.HandleFunc("/student_shares", Compressed(Authorize(student_sharesHandler)))
+	http.HandleFunc("/student_gets", Compressed(Authorize(student_getsHandler)))
 	http.HandleFunc("/view_bulletin_board", view_bulletin_boardHandler)
 	http.HandleFunc("/remove_bulletin_page", remove_bulletin_pageHandler)
 	http.HandleFunc("/bulletin_board_data", bulletin_board_dataHandler)
@@ -46,10 +47,13 @@ func init_handlers() {
 	http.HandleFunc("/teacher_adds_bulletin_page", Authorize(teacher_adds_bulletin_pageHandler))
 	http.HandleFunc("/teacher_clears_submissions", Authorize(teacher_clears_submissionsHandler))
 	http.HandleFunc("/teacher_deactivates_problems", Authorize(teacher_deactivates_problemsHandler))
-	http.HandleFunc("/teacher_grades", Authorize(teacher_gradesHandler))
+	http.HandleFunc("/teacher_grades", Compressed(Authorize(teacher_gradesHandler)))
+	http.HandleFunc("/teacher_grades_batch", Compressed(Authorize(teacher_grades_batchHandler)))
 	http.HandleFunc("/teacher_puts_back", Authorize(teacher_puts_backHandler))
-	http.HandleFunc("/teacher_gets", Authorize(teacher_getsHandler))
-	http.HandleFunc("/teacher_broadcasts", Authorize(teacher_broadcastsHandler))
+	http.HandleFunc("/teacher_gets", Compressed(Authorize(teacher_getsHandler)))
+	http.HandleFunc("/teacher_opens", Authorize(teacher_opensHandler))
+	http.HandleFunc("/teacher_broadcasts", Compressed(Authorize(teacher_broadcastsHandler)))
+	http.HandleFunc("/teacher_broadcasts_batch", Compressed(Authorize(teacher_broadcasts_batchHandler)))
 	http.HandleFunc("/teacher_gets_passcode", Authorize(teacher_gets_passcodeHandler))
 
 	http.HandleFunc("/ping", func(w http.ResponseWriter, r *http.Request) { fmt.Fprintf(w, "pong") })
@@ -131,7 +135,7 @@ func main() {
 	}
 	fmt.Printf("*   GEM %s\n", VERSION)
 	fmt.Println("**************************************************\n")
-	err := http.ListenAndServe(Config.Address, nil)
+	err := http.ListenAndServe(Config.Address, Traced(http.DefaultServeMux))
 	if err != nil {
 		log.Fatal("Unable to serve gem server at " + Config.Address)
 	}
@@ -16,28 +16,41 @@ func teacher_gets_passcodeHandler(w http.ResponseWriter, r *http.Request, who st
 //-----------------------------------------------------------------------------------
 func testHandler(w http.ResponseWriter, r *http.Request) {
 	// Show content of boards
+	log, _ := board_log()
+	fmt.Printf("Board log: %d pages\n", len(log))
+	for i := 0; i < len(log); i++ {
+		b := log[i]
+		fmt.Printf("Attempts: %d, Filename: %s, Pid: %d, Answer: %s, len of content: %d\n",
+			b.Attempts, b.Filename, b.Pid, b.Answer, len(b.Content))
+	}
+	StudentsSem.RLock()
 	fmt.Println("Students:", len(Students))
 	for uid, st := range Students {
-		fmt.Printf("Uid: %d has %d pages. Status: %d\n", uid, len(st.Boards), st.SubmissionStatus)
-		for i := 0; i < len(st.Boards); i++ {
-			b := st.Boards[i]
-			fmt.Printf("Attempts: %d, Filename: %s, Pid: %d, Answer: %s, len of content: %d\n",
-				b.Attempts, b.Filename, b.Pid, b.Answer, len(b.Content))
-		}
+		st.Sem.Lock()
+		fmt.Printf("Uid: %d is at page %d, has %d feedback pages. Status: %d\n", uid, st.Cursor, len(st.Feedback), st.SubmissionStatus)
+		st.Sem.Unlock()
 	}
+	StudentsSem.RUnlock()
+
+	QueueSem.Lock()
 
 	fmt.Printf("WorkingSubs: %d entries", len(WorkingSubs))
 	for i := 0; i < len(WorkingSubs); i++ {
 		fmt.Println(WorkingSubs[i].Sid, WorkingSubs[i].Uid, WorkingSubs[i].Pid, WorkingSubs[i].Priority)
 		fmt.Println(WorkingSubs[i].Content)
 	}
+	QueueSem.Unlock()
 	fmt.Println()
 
-	fmt.Println("ActiveProblems:", ActiveProblems)
+	ProblemsSem.RLock()
+	fmt.Println("ActiveProblems:", len(ActiveProblems))
 	for fname, v := range ActiveProblems {
+		v.Sem.Lock()
 		fmt.Println(fname, v.Active, "Answers:", v.Answers, "Attempts:", v.Attempts)
+		v.Sem.Unlock()
 		fmt.Println(fname, v.Info.Pid, v.Info.Merit, v.Info.Effort, v.Info.Attempts, v.Info.ExactAnswer, v.Info.Answer)
 	}
+	ProblemsSem.RUnlock()
 	fmt.Fprintf(w, Passcode)
 }
 
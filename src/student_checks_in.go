@@ -6,8 +6,8 @@ package main
 import (
 	"encoding/json"
 	"fmt"
-	"log"
 	"net/http"
+	"strconv"
 	"time"
 )
 
@@ -17,10 +17,12 @@ func student_checks_inHandler(w http.ResponseWriter, r *http.Request, who string
 	// attendance is taken automatically by authorization when this handler is called.
 	// Next: return student attendance report
 	rows, err := Database.Query("select at from attendance where stid=?", uid)
-	defer rows.Close()
 	if err != nil {
-		log.Fatal(err)
+		writeLog(Config.LogFile, fmt.Sprintf("Unable to read attendance of %d: %s", uid, err))
+		http.Error(w, err.Error(), http.StatusInternalServerError)
+		return
 	}
+	defer rows.Close()
 	dates := make([]int64, 0)
 	var t time.Time
 	for rows.Next() {
@@ -33,12 +35,83 @@ func student_checks_inHandler(w http.ResponseWriter, r *http.Request, who string
 }
 
 //-----------------------------------------------------------------
-func student_periodic_updateHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
-	submission_stat := Students[uid].SubmissionStatus
+func take_student_update(st *StudenInfo) (int, int, int) {
+	st.Sem.Lock()
+	defer st.Sem.Unlock()
+	log, _ := board_log()
+	submission_stat := st.SubmissionStatus
 	board_stat := 0
-	if len(Students[uid].Boards) > 0 {
+	if st.Cursor < len(log) || len(st.Feedback) > 0 {
 		board_stat = 1
 	}
-	Students[uid].SubmissionStatus = 0 // reset status after notifying student
+	st.SubmissionStatus = 0 // reset status after notifying student
+	return submission_stat, board_stat, boards_version(st, log)
+}
+
+//-----------------------------------------------------------------
+func student_changed(st *StudenInfo, version int) bool {
+	st.Sem.Lock()
+	defer st.Sem.Unlock()
+	log, _ := board_log()
+	return st.SubmissionStatus != 0 || boards_version(st, log) != version
+}
+
+//-----------------------------------------------------------------
+// Seconds a polling student should wait before the next update: short
+// while one of the student's submissions is being graded, and longer as
+// the class grows so that polls are spread out.
+//-----------------------------------------------------------------
+func poll_interval(st *StudenInfo) int {
+	st.Sem.Lock()
+	grading := st.Grading
+	st.Sem.Unlock()
+	if grading > 0 {
+		return PollIntervalGrading
+	}
+	interval := student_count() / 5
+	if interval < PollIntervalMin {
+		interval = PollIntervalMin
+	} else if interval > PollIntervalMax {
+		interval = PollIntervalMax
+	}
+	return interval
+}
+
+//-----------------------------------------------------------------
+func student_periodic_updateHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
+	st, _ := get_student(uid)
+	w.Header().Set("X-Poll-Interval", strconv.Itoa(poll_interval(st)))
+	submission_stat, board_stat, _ := take_student_update(st)
 	fmt.Fprintf(w, "%d;%d", submission_stat, board_stat)
 }
+
+//-----------------------------------------------------------------
+// Long-polling version of student_periodic_update.  The request is held
+// until the submission status changes or boards newer than the client's
+// version arrive.  A client ahead of the server, which has restarted, is
+// answered at once so that it picks up the new version.
+// Response: submission status;board status;boards version.
+//-----------------------------------------------------------------
+func student_waits_updateHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
+	version, _ := strconv.Atoi(r.FormValue("version"))
+	st, _ := get_student(uid)
+	timeout := time.After(StudentWaitTimeout)
+wait:
+	for {
+		// Take the channel before checking, so a broadcast in between is not missed.
+		_, broadcast := board_log()
+		if student_changed(st, version) {
+			break
+		}
+		select {
+		case <-st.Updated:
+		case <-broadcast:
+		case <-timeout:
+			break wait
+		case <-r.Context().Done():
+			return
+		}
+	}
+	submission_stat, board_stat, boards_version := take_student_update(st)
+	fmt.Fprintf(w, "%d;%d;%d", submission_stat, board_stat, boards_version)
+}
@@ -7,6 +7,7 @@ import (
 	"encoding/json"
 	"fmt"
 	"net/http"
+	"sort"
 )
 
 //-----------------------------------------------------------------------------------
@@ -14,12 +15,22 @@ func student_getsHandler(w http.ResponseWriter, r *http.Request, who string, uid
 	var js []byte
 	var err error
 
-	BoardsSem.Lock()
-	defer BoardsSem.Unlock()
-
-	if _, ok := Students[uid]; ok {
-		js, err = json.Marshal(Students[uid].Boards)
-		Students[uid].Boards = []*Board{}
+	if st, ok := get_student(uid); ok {
+		// Broadcasts after the student's cursor, then the student's feedback,
+		// in the order they were made.  The log is read under st.Sem, so a
+		// concurrent get cannot move the cursor past this snapshot.
+		st.Sem.Lock()
+		log, _ := board_log()
+		boards := make([]*Board, 0, len(log)-st.Cursor+len(st.Feedback))
+		boards = append(boards, log[st.Cursor:]...)
+		boards = append(boards, st.Feedback...)
+		st.Cursor = len(log)
+		st.Feedback = []*Board{}
+		st.Sem.Unlock()
+		sort.SliceStable(boards, func(i, j int) bool {
+			return boards[i].StartingTime.Before(boards[j].StartingTime)
+		})
+		js, err = json.Marshal(boards)
 		if err == nil {
 			// fmt.Println(string(js))
 			w.Header().Set("Content-Type", "application/json")
@@ -5,34 +5,69 @@ package main
 
 import (
 	"encoding/json"
-	"log"
+	"fmt"
 	"net/http"
+	"strconv"
 	"time"
 )
 
 type StudentReport struct {
+	Id       int
 	Points   int
 	Filename string
 	Date     int64
 }
 
+//-----------------------------------------------------------------------------------
+// Scores changed since the given version; clients keep them in a local
+// ledger and pass back Now as since on the next request.  Now is one more
+// than the largest version seen, and later changes get larger versions, so
+// none is missed.  A client ahead of the server, whose database was replaced,
+// gets all of its scores.
+//-----------------------------------------------------------------------------------
+type StudentReportChanges struct {
+	Now    int64
+	Scores []*StudentReport
+}
+
 //-----------------------------------------------------------------------------------
 func student_gets_reportHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
-	rows, err := Database.Query("select score.points, score.at, problem.filename from score join problem on problem.id == score.pid where stid=?", uid)
-	defer rows.Close()
+	since_param := r.FormValue("since")
+	since, _ := strconv.ParseInt(since_param, 10, 64)
+	var latest int64
+	if since > 0 {
+		Database.QueryRow("select coalesce(max(updated), 0) from score").Scan(&latest)
+		if since > latest+1 {
+			since = 0
+		}
+	}
+	now := since
+	rows, err := Database.Query("select score.id, score.points, score.at, problem.filename, coalesce(score.updated, 0) from score join problem on problem.id == score.pid where stid=? and coalesce(score.updated, 0) >= ?", uid, since)
 	if err != nil {
-		log.Fatal(err)
+		writeLog(Config.LogFile, fmt.Sprintf("Unable to read scores of %d: %s", uid, err))
+		http.Error(w, err.Error(), http.StatusInternalServerError)
+		return
 	}
+	defer rows.Close()
 	report := make([]*StudentReport, 0)
-	var points int
+	var id, points int
 	var t time.Time
 	var filename string
+	var version int64
 	for rows.Next() {
 		// fmt.Println(rows)
-		rows.Scan(&points, &t, &filename)
-		report = append(report, &StudentReport{Points: points, Filename: filename, Date: t.Unix()})
+		rows.Scan(&id, &points, &t, &filename, &version)
+		if version >= now {
+			now = version + 1
+		}
+		report = append(report, &StudentReport{Id: id, Points: points, Filename: filename, Date: t.Unix()})
+	}
+	var js []byte
+	if since_param == "" {
+		js, _ = json.Marshal(report)
+	} else {
+		js, _ = json.Marshal(&StudentReportChanges{Now: now, Scores: report})
 	}
-	js, _ := json.Marshal(report)
 	w.Header().Set("Content-Type", "application/json")
 	w.Write(js)
 }
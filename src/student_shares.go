@@ -4,17 +4,66 @@
 package main
 
 import (
-	"database/sql"
 	"fmt"
-	"log"
 	"net/http"
 	"strconv"
+	"sync"
 	"time"
 )
 
+//-----------------------------------------------------------------------------------
+// Keys of recent submissions; clients retrying a submission from their
+// outbox reuse its key, so a retry of one that did arrive is dropped.
+//-----------------------------------------------------------------------------------
+const SubmissionKeysMax = 10000
+
+var SubmissionKeys = make(map[string]bool)
+var SubmissionKeyOrder = make([]string, 0, SubmissionKeysMax)
+var SubmissionKeysSem sync.Mutex
+
+func seen_submission(uid int, key string) bool {
+	if key == "" {
+		return false
+	}
+	key = fmt.Sprintf("%d/%s", uid, key)
+	SubmissionKeysSem.Lock()
+	defer SubmissionKeysSem.Unlock()
+	if SubmissionKeys[key] {
+		return true
+	}
+	if len(SubmissionKeyOrder) >= SubmissionKeysMax {
+		delete(SubmissionKeys, SubmissionKeyOrder[0])
+		SubmissionKeyOrder = SubmissionKeyOrder[1:]
+	}
+	SubmissionKeys[key] = true
+	SubmissionKeyOrder = append(SubmissionKeyOrder, key)
+	return false
+}
+
+// A submission that could not be saved may be sent again with its key.
+func forget_submission(uid int, key string) {
+	SubmissionKeysSem.Lock()
+	defer SubmissionKeysSem.Unlock()
+	delete(SubmissionKeys, fmt.Sprintf("%d/%s", uid, key))
+}
+
 //-----------------------------------------------------------------------------------
 func student_sharesHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
 	content, filename := r.FormValue("content"), r.FormValue("filename")
+	if delta := r.FormValue("delta"); delta != "" {
+		var ok bool
+		content, ok = rebuild_shared(uid, filename, r.FormValue("base_hash"), delta, r.FormValue("content_hash"))
+		if !ok {
+			w.Header().Set("X-Gem-Delta", "mismatch")
+			fmt.Fprintf(w, "Please send the full submission.")
+			return
+		}
+	}
+	remember_shared(uid, filename, content)
+	if seen_submission(uid, r.FormValue("key")) {
+		fmt.Fprintf(w, "This submission was already received.")
+		return
+	}
 	answer := r.FormValue("answer")
 	priority, _ := strconv.Atoi(r.FormValue("priority"))
 	sid := int64(0)
@@ -24,62 +73,67 @@ func student_sharesHandler(w http.ResponseWriter, r *http.Request, who string, u
 	msg := "Your submission will be looked at soon."
 
 	pid := 0
-	prob, ok := ActiveProblems[filename]
+	prob, ok := get_problem(filename)
 	if ok {
-		if !prob.Active {
+		prob.Sem.Lock()
+		active := prob.Active
+		prob.Sem.Unlock()
+		if !active {
 			msg = "Problem is no longer active. But the teacher will look at your submission."
 		} else {
 			pid = prob.Info.Pid
-			if _, ok := prob.Attempts[uid]; !ok {
-				ActiveProblems[filename].Attempts[uid] = prob.Info.Attempts
-			}
-			if ActiveProblems[filename].Attempts[uid] == 0 {
+
+			// Decrement attempts **only if students are not asking for help**
+			left, ok := take_attempt(prob, uid, priority < 2)
+			if !ok {
 				fmt.Fprintf(w, "This is not submitted because either you have reached the submission limit or your solution was previously graded correctly.")
 				return
 			}
+			if priority < 2 && left <= 3 {
+				msg += fmt.Sprintf(" You have %d attempt(s) left.", left)
+			}
 
-			// Decrement attempts **only if students are not asking for help**
-			if priority < 2 {
-				ActiveProblems[filename].Attempts[uid] -= 1
-				if ActiveProblems[filename].Attempts[uid] <= 3 {
-					msg += fmt.Sprintf(" You have %d attempt(s) left.", ActiveProblems[filename].Attempts[uid])
+			// Autograding if possible.  The submission is saved before it is
+			// scored, so a failed save leaves nothing to undo and a retry is
+			// accepted.
+			correct_answer = prob.Info.Answer
+			correct := answer != "" && correct_answer == answer
+			complete = correct || (answer != "" && prob.Info.ExactAnswer)
+			if complete {
+				sid, err = db_write_wait(AddSubmissionCompleteSQL, pid, uid, content, priority, time.Now(), time.Now())
+			} else {
+				sid, err = db_write_wait(AddSubmissionSQL, pid, uid, content, priority, time.Now())
+			}
+			if err != nil {
+				// Nothing was saved: give the attempt back and let the client retry.
+				if priority < 2 {
+					add_attempts(prob, uid, 1)
 				}
+				forget_submission(uid, r.FormValue("key"))
+				http.Error(w, "Unable to save your submission. Please share it again.", http.StatusInternalServerError)
+				return
 			}
-
-			// Autograding if possible
-			correct_answer = ActiveProblems[filename].Info.Answer
 			if answer != "" {
 				scoring_mesg := ""
-				if correct_answer == answer {
-					scoring_mesg = add_or_update_score("correct", pid, uid, 0, -1)
-					ActiveProblems[filename].Attempts[uid] = 0 // This prevents further submission
-					complete = true
-				} else if ActiveProblems[filename].Info.ExactAnswer {
-					scoring_mesg = add_or_update_score("incorrect", pid, uid, 0, -1)
-					complete = true
+				if correct {
+					scoring_mesg, _ = add_or_update_score(nil, "correct", pid, uid, 0, -1)
+					end_attempts(prob, uid) // This prevents further submission
+				} else if complete {
+					scoring_mesg, _ = add_or_update_score(nil, "incorrect", pid, uid, 0, -1)
 				} else {
 					scoring_mesg = "Answer appears to be incorrect. It will be looked at."
 				}
-				ActiveProblems[filename].Answers = append(ActiveProblems[filename].Answers, answer)
+				record_answer(prob, answer)
 				fmt.Fprintf(w, scoring_mesg)
 			}
-			var result sql.Result
-			if complete {
-				result, err = AddSubmissionCompleteSQL.Exec(pid, uid, content, priority, time.Now(), time.Now())
-			} else {
-				result, err = AddSubmissionSQL.Exec(pid, uid, content, priority, time.Now())
-			}
-			if err != nil {
-				log.Fatal(err)
-			}
-			sid, _ = result.LastInsertId()
 		}
 	}
 	if !complete {
-		SubSem.Lock()
-		defer SubSem.Unlock()
+		QueueSem.Lock()
+		defer QueueSem.Unlock()
 		sub := &Submission{
 			Sid:      int(sid),
+			Key:      next_queue_key(),
 			Uid:      uid,
 			Pid:      pid,
 			Content:  content,
@@ -90,6 +144,7 @@ func student_sharesHandler(w http.ResponseWriter, r *http.Request, who string, u
 		}
 		WorkingSubs = append(WorkingSubs, sub)
 		Submissions[int(sid)] = sub
+		queue_changed(sub.Key, false)
 		fmt.Fprintf(w, msg)
 	}
 }
@@ -4,22 +4,27 @@
 package main
 
 import (
+	"database/sql"
+	"encoding/json"
 	"fmt"
-	"log"
 	"net/http"
 	"strconv"
 	"time"
 )
 
 //-----------------------------------------------------------------------------------
-// func insert_problems(uid int, problems []*ProblemInfo) {
+// Insert a graded problem into the database, inside tx if given.
 //-----------------------------------------------------------------------------------
-func insert_problem(uid int, problem *ProblemInfo) {
+func insert_problem(tx *sql.Tx, uid int, problem *ProblemInfo) error {
 	// Create new problem
 	pid := int64(0)
 	if problem.Merit > 0 {
+		query := Database.Query
+		if tx != nil {
+			query = tx.Query
+		}
 		// Find Tag id
-		rows, _ := Database.Query("select id from tag where description=?", problem.Tag)
+		rows, _ := query("select id from tag where description=?", problem.Tag)
 		tagID := int64(0)
 		for rows.Next() {
 			rows.Scan(&tagID)
@@ -27,7 +32,7 @@ func insert_problem(uid int, problem *ProblemInfo) {
 		}
 		rows.Close()
 		if tagID == 0 {
-			result, err := AddTagSQL.Exec(problem.Tag)
+			result, err := in_tx(tx, AddTagSQL).Exec(problem.Tag)
 			if err != nil {
 				fmt.Println(err)
 			} else {
@@ -36,7 +41,7 @@ func insert_problem(uid int, problem *ProblemInfo) {
 		}
 
 		// Insert only real problems into database
-		result, err := AddProblemSQL.Exec(
+		result, err := in_tx(tx, AddProblemSQL).Exec(
 			uid,
 			problem.Description,
 			problem.Answer,
@@ -48,10 +53,19 @@ func insert_problem(uid int, problem *ProblemInfo) {
 			time.Now(),
 		)
 		if err != nil {
-			log.Fatal(err)
+			return err
 		}
 		pid, _ = result.LastInsertId()
 		problem.Pid = int(pid)
+	}
+	return nil
+}
+
+//-----------------------------------------------------------------------------------
+func activate_problem(problem *ProblemInfo) {
+	if problem.Merit > 0 {
+		ProblemsSem.Lock()
+		defer ProblemsSem.Unlock()
 		ActiveProblems[problem.Filename] = &ActiveProblem{
 			Info:     problem,
 			Answers:  make([]string, 0),
@@ -61,6 +75,27 @@ func insert_problem(uid int, problem *ProblemInfo) {
 	}
 }
 
+//-----------------------------------------------------------------------------------
+// Add problems to the board log, once for the whole class.  Each student
+// picks them up after their cursor.
+//-----------------------------------------------------------------------------------
+func broadcast_problems(problems []*ProblemInfo) {
+	boards := make([]*Board, 0, len(problems))
+	for _, problem := range problems {
+		b := &Board{
+			Content:      problem.Description,
+			Answer:       problem.Answer,
+			Attempts:     problem.Attempts,
+			Filename:     problem.Filename,
+			Pid:          problem.Pid,
+			StartingTime: time.Now(),
+			Type:         "new",
+		}
+		boards = append(boards, b)
+	}
+	append_board_log(boards)
+}
+
 //-----------------------------------------------------------------------------------
 // Teacher starts one or more problems.
 //-----------------------------------------------------------------------------------
@@ -88,22 +123,54 @@ func teacher_broadcastsHandler(w http.ResponseWriter, r *http.Request, who strin
 	}
 	// fmt.Println("answer:", problem.Answer, problem.ExactAnswer)
 
-	insert_problem(uid, problem)
-	BoardsSem.Lock()
-	defer BoardsSem.Unlock()
-	for stid, _ := range Students {
-		b := &Board{
-			Content:      problem.Description,
-			Answer:       problem.Answer,
-			Attempts:     problem.Attempts,
-			Filename:     problem.Filename,
-			Pid:          problem.Pid,
-			StartingTime: time.Now(),
-			Type:         "new",
-		}
-		Students[stid].Boards = append(Students[stid].Boards, b)
+	if err := insert_problem(nil, uid, problem); err != nil {
+		writeLog(Config.LogFile, fmt.Sprintf("Unable to insert problem %s: %s", problem.Filename, err))
+		http.Error(w, err.Error(), http.StatusInternalServerError)
+		return
 	}
+	activate_problem(problem)
+	broadcast_problems([]*ProblemInfo{problem})
 	fmt.Fprintf(w, "Content copied to white boards.")
 }
 
 //-----------------------------------------------------------------------------------
+// Teacher starts a whole problem set: one transaction, one fan-out.
+//-----------------------------------------------------------------------------------
+func teacher_broadcasts_batchHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
+	problems := make([]*ProblemInfo, 0)
+	err := json.Unmarshal([]byte(r.FormValue("problems")), &problems)
+	if err != nil || len(problems) == 0 {
+		http.Error(w, "Unable to read problems.", http.StatusBadRequest)
+		return
+	}
+	tx, err := Database.Begin()
+	if err != nil {
+		writeLog(Config.LogFile, fmt.Sprintf("Unable to start broadcast transaction: %s", err))
+		http.Error(w, err.Error(), http.StatusInternalServerError)
+		return
+	}
+	for _, problem := range problems {
+		if err = insert_problem(tx, uid, problem); err != nil {
+			tx.Rollback()
+			writeLog(Config.LogFile, fmt.Sprintf("Unable to insert problem %s: %s", problem.Filename, err))
+			http.Error(w, err.Error(), http.StatusInternalServerError)
+			return
+		}
+	}
+	if err = tx.Commit(); err != nil {
+		writeLog(Config.LogFile, fmt.Sprintf("Unable to commit problems: %s", err))
+		http.Error(w, err.Error(), http.StatusInternalServerError)
+		return
+	}
+	graded := 0
+	for _, problem := range problems {
+		activate_problem(problem)
+		if problem.Merit > 0 {
+			graded++
+		}
+	}
+	broadcast_problems(problems)
+	fmt.Fprintf(w, "%d problem(s), %d graded, copied to white boards.", len(problems), graded)
+}
+
+//-----------------------------------------------------------------------------------
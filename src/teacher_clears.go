@@ -8,6 +8,7 @@ import (
 	"fmt"
 	// "log"
 	"net/http"
+	"time"
 )
 
 //-----------------------------------------------------------------------------------
@@ -15,9 +16,12 @@ import (
 //-----------------------------------------------------------------------------------
 func teacher_deactivates_problemsHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
 	filename := r.FormValue("filename")
-	if prob, ok := ActiveProblems[filename]; ok {
+	if prob, ok := get_problem(filename); ok {
+		prob.Sem.Lock()
 		prob.Active = false
-		if len(prob.Answers) > 0 {
+		answers := len(prob.Answers)
+		prob.Sem.Unlock()
+		if answers > 0 {
 			fmt.Fprintf(w, "1")
 		} else {
 			fmt.Fprintf(w, "0")
@@ -52,6 +56,12 @@ func teacher_deactivates_problemsHandler(w http.ResponseWriter, r *http.Request,
 // Clear submissions, boards, statuses, and set all problems inactive.
 //-----------------------------------------------------------------------------------
 func teacher_clears_submissionsHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
+	QueueSem.Lock()
+	defer QueueSem.Unlock()
+	for _, sub := range WorkingSubs {
+		queue_changed(sub.Key, true)
+	}
 	WorkingSubs = make([]*Submission, 0)
+	Prefetched = make(map[int]time.Time)
 	fmt.Fprintf(w, "Done.")
 }
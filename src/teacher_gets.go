@@ -8,31 +8,52 @@ import (
 	"fmt"
 	"net/http"
 	"strconv"
+	"time"
 )
 
 //-----------------------------------------------------------------------------------
-// Return a submission by index or priority
+// Return a submission by index or priority.  A prefetched submission is
+// claimed but the student is not told until the teacher opens it.  Only
+// submissions of problems (Sid > 0) are prefetched, since a lease is kept
+// by submission id.
 //-----------------------------------------------------------------------------------
 func teacher_getsHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
 	index, _ := strconv.Atoi(r.FormValue("index"))
 	priority, _ := strconv.Atoi(r.FormValue("priority"))
+	key, _ := strconv.Atoi(r.FormValue("key"))
+	prefetch := r.FormValue("prefetch") == "1"
 
-	BoardsSem.Lock()
-	defer BoardsSem.Unlock()
+	QueueSem.Lock()
+	defer QueueSem.Unlock()
+	reclaim_prefetched()
 
 	selected := &Submission{}
 
-	if index >= 0 {
+	if key > 0 {
+		// Try to select by queue key, as listed in the queue summary
+		for i := 0; i < len(WorkingSubs); i++ {
+			if WorkingSubs[i].Key == key {
+				selected = WorkingSubs[i]
+				WorkingSubs = append(WorkingSubs[:i], WorkingSubs[i+1:]...)
+				if !prefetch {
+					set_submission_status(selected.Uid, 1)
+				}
+				break
+			}
+		}
+	} else if index >= 0 {
 		// Try to select by index first
 		selected = WorkingSubs[index]
 		WorkingSubs = append(WorkingSubs[:index], WorkingSubs[index+1:]...)
 	} else if priority > 0 {
 		// Try to select by priority: 1 (got it), 2 (help me)
 		for i := 0; i < len(WorkingSubs); i++ {
-			if WorkingSubs[i].Priority == priority {
+			if WorkingSubs[i].Priority == priority && (!prefetch || WorkingSubs[i].Sid > 0) {
 				selected = WorkingSubs[i]
 				WorkingSubs = append(WorkingSubs[:i], WorkingSubs[i+1:]...)
-				Students[selected.Uid].SubmissionStatus = 1
+				if !prefetch {
+					set_submission_status(selected.Uid, 1)
+				}
 				break
 			}
 		}
@@ -41,6 +62,9 @@ func teacher_getsHandler(w http.ResponseWriter, r *http.Request, who string, uid
 		first_sub_w_priority := []int{-1, -1, -1}
 		for i := 0; i < len(WorkingSubs); i++ {
 			p := WorkingSubs[i].Priority
+			if prefetch && WorkingSubs[i].Sid == 0 {
+				continue
+			}
 			if first_sub_w_priority[p] == -1 {
 				first_sub_w_priority[p] = i
 			}
@@ -50,11 +74,23 @@ func teacher_getsHandler(w http.ResponseWriter, r *http.Request, who string, uid
 				j := first_sub_w_priority[i]
 				selected = WorkingSubs[j]
 				WorkingSubs = append(WorkingSubs[:j], WorkingSubs[j+1:]...)
-				Students[selected.Uid].SubmissionStatus = 1
+				if !prefetch {
+					set_submission_status(selected.Uid, 1)
+				}
 				break
 			}
 		}
 	}
+	if selected.Key > 0 {
+		queue_changed(selected.Key, true)
+	}
+	if selected.Sid > 0 && prefetch {
+		Prefetched[selected.Sid] = time.Now().Add(PrefetchLease)
+	}
+	// Shares that are not problems are never graded, so they are not counted.
+	if selected.Sid > 0 && !prefetch {
+		add_grading(selected.Uid, 1)
+	}
 	js, err := json.Marshal(selected)
 	if err != nil {
 		fmt.Println(err.Error())
@@ -64,9 +100,58 @@ func teacher_getsHandler(w http.ResponseWriter, r *http.Request, who string, uid
 	}
 }
 
+//-----------------------------------------------------------------------------------
+// A prefetched submission is opened by the teacher.  If its lease ran out,
+// it is taken back out of the queue, unless another grader has it.
+//-----------------------------------------------------------------------------------
+func teacher_opensHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
+	sid, _ := strconv.Atoi(r.FormValue("sid"))
+	if sid <= 0 {
+		return
+	}
+
+	QueueSem.Lock()
+	defer QueueSem.Unlock()
+	if _, leased := Prefetched[sid]; leased {
+		delete(Prefetched, sid)
+	} else {
+		for i := 0; i < len(WorkingSubs); i++ {
+			if WorkingSubs[i].Sid == sid {
+				queue_changed(WorkingSubs[i].Key, true)
+				WorkingSubs = append(WorkingSubs[:i], WorkingSubs[i+1:]...)
+				break
+			}
+		}
+	}
+	if sub, ok := Submissions[sid]; ok && sub.Uid > 0 {
+		add_grading(sub.Uid, 1)
+		set_submission_status(sub.Uid, 1)
+	}
+}
+
+//-----------------------------------------------------------------------------------
+// With summary=1, list the queue without contents.  With since=<version>,
+// list only the submissions added and removed after that version.  A
+// version from an earlier run of the server (epoch) gets a full listing.
 //-----------------------------------------------------------------------------------
 func teacher_gets_queueHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
-	js, err := json.Marshal(WorkingSubs)
+	var js []byte
+	var err error
+	if r.FormValue("summary") == "1" {
+		since, e := strconv.Atoi(r.FormValue("since"))
+		if e != nil {
+			since = -1
+		}
+		if epoch, e := strconv.ParseInt(r.FormValue("epoch"), 10, 64); e == nil && epoch != QueueEpoch {
+			since = -1
+		}
+		js, err = json.Marshal(queue_listing(since))
+	} else {
+		QueueSem.Lock()
+		reclaim_prefetched()
+		js, err = json.Marshal(WorkingSubs)
+		QueueSem.Unlock()
+	}
 	if err != nil {
 		fmt.Println(err.Error())
 	} else {
@@ -76,3 +161,61 @@ func teacher_gets_queueHandler(w http.ResponseWriter, r *http.Request, who strin
 }
 
 //-----------------------------------------------------------------------------------
+func queue_entry(sub *Submission) *QueueEntry {
+	return &QueueEntry{
+		Key:         sub.Key,
+		Sid:         sub.Sid,
+		Uid:         sub.Uid,
+		Name:        sub.Name,
+		Filename:    sub.Filename,
+		Priority:    sub.Priority,
+		WaitSeconds: int(time.Since(sub.At).Seconds()),
+	}
+}
+
+//-----------------------------------------------------------------------------------
+func queue_listing(since int) *QueueListing {
+	QueueSem.Lock()
+	defer QueueSem.Unlock()
+	reclaim_prefetched()
+
+	listing := &QueueListing{
+		Epoch:   QueueEpoch,
+		Version: QueueVersion,
+		Entries: make([]*QueueEntry, 0),
+		Removed: make([]int, 0),
+	}
+
+	// A full listing is needed if the changes since that version are no longer logged.
+	oldest := QueueVersion + 1
+	if len(QueueChanges) > 0 {
+		oldest = QueueChanges[0].Version
+	}
+	if since < 0 || since > QueueVersion || since+1 < oldest {
+		listing.Full = true
+		for _, sub := range WorkingSubs {
+			listing.Entries = append(listing.Entries, queue_entry(sub))
+		}
+		return listing
+	}
+
+	queued := make(map[int]*Submission)
+	for _, sub := range WorkingSubs {
+		queued[sub.Key] = sub
+	}
+	added := make(map[int]bool)
+	for _, c := range QueueChanges {
+		if c.Version <= since {
+			continue
+		}
+		if c.Removed {
+			listing.Removed = append(listing.Removed, c.Key)
+		} else if sub, ok := queued[c.Key]; ok && !added[c.Key] {
+			added[c.Key] = true
+			listing.Entries = append(listing.Entries, queue_entry(sub))
+		}
+	}
+	return listing
+}
+
+//-----------------------------------------------------------------------------------
@@ -4,8 +4,9 @@
 package main
 
 import (
+	"database/sql"
+	"encoding/json"
 	"fmt"
-	"log"
 	"net/http"
 	"regexp"
 	"strconv"
@@ -25,29 +26,57 @@ func extract_partial_credits(content string) int {
 }
 
 //-----------------------------------------------------------------------------------
-func teacher_gradesHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
-	content, decision := r.FormValue("content"), r.FormValue("decision")
-	sid, _ := strconv.Atoi(r.FormValue("sid"))
-	changed := r.FormValue("changed")
-	// stid, _ := strconv.Atoi(r.FormValue("stid"))
-	// pid, _ := strconv.Atoi(r.FormValue("pid"))
+// Grade one submission, inside tx if given.  The student's state is changed
+// only by the returned apply, to be called once the grade is committed; apply
+// is nil if the submission cannot be graded, with an error if the score could
+// not be saved.
+//-----------------------------------------------------------------------------------
+func grade_submission(tx *sql.Tx, uid, sid int, content, decision string, changed bool) (string, func(), error) {
 	mesg := ""
-
-	sub, ok := Submissions[sid]
+	sub, ok := find_submission(sid)
 	if !ok {
-		fmt.Fprintf(w, "Unknown submission cannot be graded.")
-		return
+		return "Unknown submission cannot be graded.", nil, nil
 	}
 	stid := sub.Uid
-	if changed == "True" {
+	prob, active := get_problem(sub.Filename)
+
+	// Update score based on the grading decision.  A dismissed submission
+	// does not take that attempt away from the student.
+	status := 2
+	switch decision {
+	case "dismissed":
+		mesg = "Submission dismissed."
+	case "ungraded":
+		status = 5
+	default:
+		partial_credits := -1
+		if decision != "correct" {
+			partial_credits = extract_partial_credits(content)
+		}
+		scoring_mesg, err := add_or_update_score(tx, decision, sub.Pid, sub.Uid, uid, partial_credits)
+		if err != nil {
+			return scoring_mesg, nil, err
+		}
+		mesg = scoring_mesg + "\n"
+		status = 3
+		if decision == "correct" {
+			status = 4
+		}
+		// Update submission complete time
+		db_write_in(tx, CompleteSubmissionSQL, time.Now(), sid)
+	}
+
+	var feedback *Board
+	if changed {
 		// If the original file is changed, there's feedback.  Copy it to whiteboard.
-		if prob, ok := ActiveProblems[sub.Filename]; ok {
-			AddFeedbackSQL.Exec(uid, stid, content, time.Now())
-			mesg = "Feedback saved to student's board."
-			BoardsSem.Lock()
-			defer BoardsSem.Unlock()
-			b := &Board{
-				Content:      content,
+		if _, ok := get_student(stid); ok && active {
+			patch := feedback_patch(sub.Filename, sub.Content, content)
+			db_write_in(tx, AddFeedbackSQL, uid, stid, patch, time.Now())
+			if decision != "dismissed" {
+				mesg += "Feedback saved to student's board."
+			}
+			feedback = &Board{
+				Content:      patch,
 				Answer:       prob.Info.Answer,
 				Attempts:     0, // This tells the client this is an existing problem
 				Filename:     sub.Filename,
@@ -55,40 +84,129 @@ func teacher_gradesHandler(w http.ResponseWriter, r *http.Request, who string, u
 				StartingTime: time.Now(),
 				Type:         "feedback",
 			}
-			Students[stid].Boards = append(Students[stid].Boards, b)
 		}
 	}
 
-	// If submission is dismissed, do not take that attempt away from the student.
-	if decision == "dismissed" {
-		Students[stid].SubmissionStatus = 2
-		ActiveProblems[sub.Filename].Attempts[stid] += 1
-		fmt.Fprintf(w, "Submission dismissed.")
-	} else if decision == "ungraded" {
-		Students[stid].SubmissionStatus = 5
-		fmt.Fprintf(w, mesg)
-	} else {
-		// Update score based on the grading decision
-		partial_credits := -1
-		if decision != "correct" {
-			partial_credits = extract_partial_credits(content)
+	apply := func() {
+		add_grading(stid, -1)
+		if feedback != nil {
+			if st, ok := get_student(stid); ok {
+				st.Sem.Lock()
+				st.Feedback = append(st.Feedback, feedback)
+				st.FeedbackVersion++
+				st.Sem.Unlock()
+			}
 		}
-		scoring_mesg := add_or_update_score(decision, sub.Pid, sub.Uid, uid, partial_credits)
-		mesg = scoring_mesg + "\n" + mesg
-		if decision == "correct" {
-			Students[sub.Uid].SubmissionStatus = 4
-			ActiveProblems[sub.Filename].Attempts[stid] = 0 // This prevents further submission.
-		} else {
-			Students[stid].SubmissionStatus = 3
+		if active && decision == "dismissed" {
+			add_attempts(prob, stid, 1)
+		} else if active && decision == "correct" {
+			end_attempts(prob, stid) // This prevents further submission.
 		}
+		set_submission_status(stid, status)
+	}
+	return mesg, apply, nil
+}
 
-		// Update submission complete time
-		_, err := CompleteSubmissionSQL.Exec(time.Now(), sid)
+//-----------------------------------------------------------------------------------
+// Graded content may come as a delta against the submission; rebuild it.
+// Returns false if the grader's copy of the submission is not the server's.
+//-----------------------------------------------------------------------------------
+func grade_content(sid int, content, delta, base_hash, want_hash string) (string, bool) {
+	sub, ok := find_submission(sid)
+	if !ok || delta == "" {
+		return content, true
+	}
+	if content_hash(sub.Content) != base_hash {
+		return "", false
+	}
+	rebuilt, err := apply_delta(sub.Content, delta)
+	if err != nil || content_hash(rebuilt) != want_hash {
+		return "", false
+	}
+	return rebuilt, true
+}
+
+//-----------------------------------------------------------------------------------
+func teacher_gradesHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
+	content, decision := r.FormValue("content"), r.FormValue("decision")
+	sid, _ := strconv.Atoi(r.FormValue("sid"))
+	changed := r.FormValue("changed") == "True"
+	content, ok := grade_content(sid, content, r.FormValue("delta"), r.FormValue("base_hash"), r.FormValue("content_hash"))
+	if !ok {
+		w.Header().Set("X-Gem-Delta", "mismatch")
+		fmt.Fprintf(w, "Please send the full content.")
+		return
+	}
+	mesg, apply, _ := grade_submission(nil, uid, sid, content, decision, changed)
+	if apply != nil {
+		apply()
+	}
+	fmt.Fprintf(w, mesg)
+}
+
+//-----------------------------------------------------------------------------------
+// Grade many submissions in one request and one transaction.  If a score
+// cannot be saved, nothing is graded; students are told of their grades
+// only after the transaction is committed.
+//-----------------------------------------------------------------------------------
+func teacher_grades_batchHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
+	grades := make([]*GradeRequest, 0)
+	err := json.Unmarshal([]byte(r.FormValue("grades")), &grades)
+	if err != nil {
+		http.Error(w, "Unable to read grades.", http.StatusBadRequest)
+		return
+	}
+	tx, err := Database.Begin()
+	if err != nil {
+		writeLog(Config.LogFile, fmt.Sprintf("Unable to start grading transaction: %s", err))
+		http.Error(w, err.Error(), http.StatusInternalServerError)
+		return
+	}
+	results := make([]*GradeResult, 0, len(grades))
+	applies := make([]func(), 0, len(grades))
+	counts := make(map[string]int)
+	failed := 0
+	for _, g := range grades {
+		content, ok := grade_content(g.Sid, g.Content, g.Delta, g.BaseHash, g.ContentHash)
+		if !ok {
+			failed++
+			results = append(results, &GradeResult{Sid: g.Sid, Message: "Submission has changed. Please grade it again.", Graded: false})
+			continue
+		}
+		mesg, apply, err := grade_submission(tx, uid, g.Sid, content, g.Decision, g.Changed)
 		if err != nil {
-			log.Fatal(err)
+			tx.Rollback()
+			http.Error(w, "Unable to save grades. Please grade them again.", http.StatusInternalServerError)
+			return
 		}
-		fmt.Fprintf(w, mesg)
+		if apply != nil {
+			counts[g.Decision]++
+			applies = append(applies, apply)
+		} else {
+			failed++
+		}
+		results = append(results, &GradeResult{Sid: g.Sid, Message: mesg, Graded: apply != nil})
+	}
+	if err = tx.Commit(); err != nil {
+		writeLog(Config.LogFile, fmt.Sprintf("Unable to commit grades: %s", err))
+		http.Error(w, "Unable to save grades. Please grade them again.", http.StatusInternalServerError)
+		return
+	}
+	for _, apply := range applies {
+		apply()
+	}
+	summary := fmt.Sprintf("Graded %d submission(s): %d correct, %d incorrect, %d dismissed.",
+		len(grades)-failed, counts["correct"], counts["incorrect"], counts["dismissed"])
+	if failed > 0 {
+		summary += fmt.Sprintf("\n%d submission(s) could not be graded.", failed)
+	}
+	js, err := json.Marshal(&GradeSummary{Summary: summary, Results: results})
+	if err != nil {
+		http.Error(w, err.Error(), http.StatusInternalServerError)
+		return
 	}
+	w.Header().Set("Content-Type", "application/json")
+	w.Write(js)
 }
 
 //-----------------------------------------------------------------------------------
@@ -12,10 +12,22 @@ import (
 //-----------------------------------------------------------------------------------
 func teacher_puts_backHandler(w http.ResponseWriter, r *http.Request, who string, uid int) {
 	sid, _ := strconv.Atoi(r.FormValue("sid"))
-	SubSem.Lock()
-	defer SubSem.Unlock()
-	if _, ok := Submissions[sid]; ok {
-		WorkingSubs = append(WorkingSubs, Submissions[sid])
+	QueueSem.Lock()
+	defer QueueSem.Unlock()
+	if sub, ok := Submissions[sid]; ok {
+		_, leased := Prefetched[sid]
+		delete(Prefetched, sid)
+		if r.FormValue("prefetched") == "1" && !leased {
+			// Its lease ran out, so it is back in the queue already.
+			fmt.Fprintf(w, "Submission has been put back into the queue.")
+			return
+		}
+		WorkingSubs = append(WorkingSubs, sub)
+		queue_changed(sub.Key, false)
+		// A prefetched submission was never opened, so nobody was grading it.
+		if r.FormValue("prefetched") != "1" && sub.Sid > 0 {
+			add_grading(sub.Uid, -1)
+		}
 		fmt.Fprintf(w, "Submission has been put back into the queue.")
 	} else {
 		fmt.Fprintf(w, "Unknown submission.")
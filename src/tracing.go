@@ -0,0 +1,57 @@
+package main
+
+import (
+	"fmt"
+	"net/http"
+	"time"
+)
+
+//-----------------------------------------------------------------
+// Requests from the plugins carry an id in X-Gem-Request-Id. It is
+// echoed back, and slow or failed requests are logged with it, so a
+// slow request seen in the editor can be found in the log.
+//-----------------------------------------------------------------
+const SlowRequest = time.Second
+
+// Long-polling requests are slow by design.
+var LongPolls = map[string]bool{"/student_waits_update": true}
+
+type tracedResponseWriter struct {
+	http.ResponseWriter
+	status int
+	bytes  int
+}
+
+func (w *tracedResponseWriter) WriteHeader(status int) {
+	w.status = status
+	w.ResponseWriter.WriteHeader(status)
+}
+
+func (w *tracedResponseWriter) Write(b []byte) (int, error) {
+	if w.status == 0 {
+		w.status = http.StatusOK
+	}
+	n, err := w.ResponseWriter.Write(b)
+	w.bytes += n
+	return n, err
+}
+
+//-----------------------------------------------------------------
+func Traced(handler http.Handler) http.Handler {
+	return http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		id := r.Header.Get("X-Gem-Request-Id")
+		if id != "" {
+			w.Header().Set("X-Gem-Request-Id", id)
+		}
+		tw := &tracedResponseWriter{ResponseWriter: w}
+		start := time.Now()
+		handler.ServeHTTP(tw, r)
+		elapsed := time.Since(start)
+		if tw.status == 0 {
+			tw.status = http.StatusOK
+		}
+		if tw.status >= 500 || (elapsed >= SlowRequest && !LongPolls[r.URL.Path]) {
+			writeLog(Config.LogFile, fmt.Sprintf("request %s %s status=%d bytes=%d took=%s", id, r.URL.Path, tw.status, tw.bytes, elapsed))
+		}
+	})
+}